@@ -6,6 +6,9 @@ from rich import print
 from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
 
 from LLMAgent.ConversationBot import ConversationBot
+from LLMAgent.replayLLM import TranscriptRecorder
+from LLMAgent.renderProfile import configure_render_profiles
+from LLMAgent.resultHandles import RESULT_STORE, find_handles
 
 from LLMAgent.dataTools import (
     roadVolumeTrend,
@@ -46,6 +49,9 @@ elif OPENAI_CONFIG['OPENAI_API_TYPE'] == 'openai':
 if not os.path.exists('./fig/'):
     os.mkdir('./fig/')
 
+# 图片默认以快速预览输出，可在 config.yaml 中修改
+configure_render_profiles(OPENAI_CONFIG)
+
 toolModels = [
     roadVolumeTrend('./fig/'),
     roadVolume(),
@@ -70,19 +76,33 @@ botPrefix = """
 # 10. When you realize that you need to clarify what the human wants, end your actions and ask the human for more information as your final answer.
 """
 
-bot = ConversationBot(llm, toolModels, botPrefix, verbose=True)
+# 每个浏览器会话使用自己的对话模型，工具在会话之间共享
+def new_bot() -> ConversationBot:
+    callbacks = []
+    if OPENAI_CONFIG.get('RECORD_TRANSCRIPT'):
+        # 录制对话，用于离线基准测试
+        callbacks.append(TranscriptRecorder(OPENAI_CONFIG['RECORD_TRANSCRIPT'], 'data'))
+    return ConversationBot(
+        llm, toolModels, botPrefix, verbose=True,
+        memoryTokenLimit=OPENAI_CONFIG.get('MEMORY_TOKEN_LIMIT', 2000),
+        callbacks=callbacks
+    )
 
 
-def reset(chat_history: list, thoughts: str):
+def reset(chat_history: list, thoughts: str, bot: ConversationBot):
     chat_history = []
     thoughts = ""
-    bot.agent_memory.clear()
-    bot.ch.memory = [[]]
-    return chat_history, thoughts
+    if bot is not None:
+        bot.agent_memory.clear()
+        bot.ch.memory = [[]]
+        bot.turn_usage = []
+    return chat_history, thoughts, bot, gr.update(value=None, visible=False)
 
 
-def respond(msg: str, chat_history: list, thoughts: str):
-    res, cb = bot.dialogue(msg)
+async def respond(msg: str, chat_history: list, thoughts: str, bot: ConversationBot):
+    if bot is None:
+        bot = new_bot()
+    res, cb = await bot.adialogue(msg)
     regex = re.compile(r'`([^`]+)`')
     try:
         filenames = regex.findall(res)
@@ -101,7 +121,16 @@ def respond(msg: str, chat_history: list, thoughts: str):
         thoughts += actionMemory
         thoughts += '\n'
     thoughts += f"<<< {res}\n"
-    return "", chat_history, thoughts
+    thoughts += f"(tokens: prompt {cb.prompt_tokens}, completion {cb.completion_tokens}, chat history {bot.agent_memory.history_tokens})\n"
+
+    # 以句柄引用的完整表格不经过 LLM，直接显示在界面中
+    handles = find_handles(res)
+    table = RESULT_STORE.get(handles[-1]) if handles else None
+    if table is not None:
+        tableUpdate = gr.update(value=table, visible=True)
+    else:
+        tableUpdate = gr.update()
+    return "", chat_history, thoughts, bot, tableUpdate
 
 
 with gr.Blocks(
@@ -110,6 +139,9 @@ with gr.Blocks(
     with gr.Row(visible=True, variant="panel"):
         with gr.Column(visible=True, variant='default'):
             chatbot = gr.Chatbot(scale=2, height=650)
+            botState = gr.State()
+            resultTable = gr.Dataframe(
+                label='Full result table', interactive=False, visible=False)
 
             with gr.Row():
                 humanMsg = gr.Textbox(scale=2)
@@ -137,15 +169,17 @@ with gr.Blocks(
 
     humanMsg.submit(
         respond,
-        [humanMsg, chatbot, ReActMsg],
-        [humanMsg, chatbot, ReActMsg]
+        [humanMsg, chatbot, ReActMsg, botState],
+        [humanMsg, chatbot, ReActMsg, botState, resultTable]
     )
     submitBtn.click(
         respond,
-        [humanMsg, chatbot, ReActMsg],
-        [humanMsg, chatbot, ReActMsg]
+        [humanMsg, chatbot, ReActMsg, botState],
+        [humanMsg, chatbot, ReActMsg, botState, resultTable]
     )
-    clearBtn.click(reset, [chatbot, ReActMsg], [chatbot, ReActMsg])
+    clearBtn.click(reset, [chatbot, ReActMsg, botState], [chatbot, ReActMsg, botState, resultTable])
 
 if __name__ == "__main__":
+    # 同时处理多个会话的请求，耗时的工具不会阻塞其他用户
+    demo.queue(concurrency_count=OPENAI_CONFIG.get('CONCURRENCY_COUNT', 4))
     demo.launch()
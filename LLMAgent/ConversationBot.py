@@ -4,8 +4,10 @@ from langchain import LLMChain
 from langchain.agents import Tool
 from langchain.chat_models import AzureChatOpenAI
 from LLMAgent.callbackHandler import CustomHandler
+from LLMAgent.toolPool import DEFAULT_POOL, tool_coroutine
+from LLMAgent.toolMemo import ToolMemo
+from LLMAgent.tokenMemory import TokenBudgetMemory
 from langchain.callbacks import get_openai_callback
-from langchain.memory import ConversationBufferMemory
 from langchain.agents import ZeroShotAgent, Tool, AgentExecutor
 
 
@@ -81,20 +83,44 @@ Question: {input}
 class ConversationBot:
     def __init__(
             self, llm: AzureChatOpenAI, toolModels: List,
-            customedPrefix: str, verbose: bool = False
+            customedPrefix: str, verbose: bool = False,
+            memoryTokenLimit: int = 2000, callbacks: List = None
     ) -> Any:
         self.ch = CustomHandler()
+        # further callback handlers of every turn, e.g. a TranscriptRecorder
+        self.callbacks = callbacks or []
+        # 对话历史保持在 token 预算内，较早的轮次只保留摘要，大表格以引用代替
+        self.agent_memory = TokenBudgetMemory(
+            llm=llm, max_token_limit=memoryTokenLimit, memory_key="chat_history")
+        # token usage of each turn
+        self.turn_usage: List[dict] = []
+        # 同一轮对话中重复的工具调用直接返回上次的结果
+        self.memo = ToolMemo()
         tools = []
 
         for ins in toolModels:
             func = getattr(ins, 'inference')
+            reads = getattr(ins, 'reads', None)
+            writes = getattr(ins, 'writes', ())
             tools.append(
                 Tool(
                     name=func.name,
                     description=func.description,
-                    func=func
+                    func=self.memo.wrap(func.name, func, reads, writes),
+                    coroutine=self.memo.awrap(
+                        func.name, tool_coroutine(func, getattr(ins, 'pool', DEFAULT_POOL)),
+                        reads, writes)
                 )
             )
+        tools.append(
+            Tool(
+                name='Expand Stored Table',
+                description="""
+                This tool is used to get the full content of a large table from the earlier conversation that is only referenced as, for example, (table T1: ...).
+                The input should be the table reference, for example: T1""",
+                func=self.agent_memory.expand_table
+            )
+        )
 
         prompt = ZeroShotAgent.create_prompt(
             tools,
@@ -102,7 +128,6 @@ class ConversationBot:
             suffix=suffix,
             input_variables=["input", "chat_history", "agent_scratchpad"],
         )
-        self.agent_memory = ConversationBufferMemory(memory_key="chat_history")
 
         llm_chain = LLMChain(llm=llm, prompt=prompt)
         agent = ZeroShotAgent(
@@ -117,7 +142,28 @@ class ConversationBot:
 
     def dialogue(self, input: str):
         print('TransGPT is running, Please wait for a moment...')
+        self.memo.clear()
         with get_openai_callback() as cb:
-            res = self.agent_chain.run(input=input, callbacks=[self.ch])
+            res = self.agent_chain.run(input=input, callbacks=[self.ch, *self.callbacks])
         # print('History: ', self.agent_memory.buffer)
+        self.record_usage(cb)
         return res, cb
+
+    async def adialogue(self, input: str):
+        """dialogue() for asyncio: the LLM is awaited and the tools run in
+        their pools, so other sessions are served in the meantime."""
+        print('TransGPT is running, Please wait for a moment...')
+        self.memo.clear()
+        with get_openai_callback() as cb:
+            res = await self.agent_chain.arun(input=input, callbacks=[self.ch, *self.callbacks])
+        self.record_usage(cb)
+        return res, cb
+
+    def record_usage(self, cb) -> None:
+        self.turn_usage.append({
+            'prompt_tokens': cb.prompt_tokens,
+            'completion_tokens': cb.completion_tokens,
+            'total_tokens': cb.total_tokens,
+            'total_cost': cb.total_cost,
+            'history_tokens': self.agent_memory.history_tokens,
+        })
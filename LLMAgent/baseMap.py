@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import LinearSegmentedColormap, to_rgb
+
+
+# 静态路网底图的栅格缓存，只保存透明度通道（每像素1字节）
+MAX_BASE_MAPS = 4
+
+_baseMaps = OrderedDict()
+_baseMapsLock = threading.Lock()
+
+
+def pad_extent(bounds, margin: float) -> tuple:
+    xmin, ymin, xmax, ymax = bounds
+    dx, dy = (xmax - xmin) * margin, (ymax - ymin) * margin
+    return (xmin - dx, xmax + dx, ymin - dy, ymax + dy)
+
+
+def render_base_map(draw, extent: tuple, width_for, dpi: float) -> tuple:
+    """Rasterize `draw(ax)` over `extent` into an alpha mask that is
+    `width_for(aspect)` pixels wide.
+
+    Returns the mask and the data aspect `draw` set on its axes (geopandas
+    uses 1/cos(latitude) for lon/lat data).
+    """
+    x0, x1, y0, y1 = extent
+    fig = plt.figure(dpi=dpi)
+    fig.patch.set_alpha(0)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    draw(ax)
+    aspect = ax.get_aspect()
+    aspect = 1. if aspect in ('equal', 'auto') else float(aspect)
+    width_px = width_for(aspect)
+    # the mask fills the whole canvas, so it is stretched to the aspect here
+    height_px = max(1, round(width_px * aspect * (y1 - y0) / (x1 - x0)))
+    fig.set_size_inches(width_px / dpi, height_px / dpi)
+    ax.set_aspect('auto')
+    ax.set_xlim(x0, x1)
+    ax.set_ylim(y0, y1)
+    fig.canvas.draw()
+    alpha = np.asarray(fig.canvas.buffer_rgba())[:, :, 3].copy()
+    plt.close(fig)
+    return alpha, aspect
+
+
+def draw_base_map(ax, key, draw, extent: tuple, color, dpi: float) -> float:
+    """Draw the static layer `draw(ax)` on `ax` as a cached image.
+
+    The layer is rendered once per `key`, extent, axes width and `dpi` (the
+    DPI the figure will be saved with), in the single color `color`; only
+    the dynamic overlay is drawn as vector data afterwards. Returns the data
+    aspect of the layer.
+    """
+    fig = ax.figure
+    x0, x1, y0, y1 = extent
+
+    def width_for(aspect):
+        # the axes box shrinks to the aspect; render at its final width
+        ax.set_aspect(aspect)
+        ax.set_xlim(x0, x1)
+        ax.set_ylim(y0, y1)
+        ax.apply_aspect()
+        return max(1, round(fig.get_size_inches()[0] * ax.get_position().width * dpi))
+
+    cacheKey = (key, extent, tuple(fig.get_size_inches()),
+                tuple(ax.get_position(original=True).bounds), dpi)
+    with _baseMapsLock:
+        baseMap = _baseMaps.get(cacheKey)
+        if baseMap is not None:
+            _baseMaps.move_to_end(cacheKey)
+    if baseMap is None:
+        baseMap = render_base_map(draw, extent, width_for, dpi)
+        with _baseMapsLock:
+            _baseMaps[cacheKey] = baseMap
+            while len(_baseMaps) > MAX_BASE_MAPS:
+                _baseMaps.popitem(last=False)
+
+    rgb = to_rgb(color)
+    cmap = LinearSegmentedColormap.from_list(
+        'base_map', [(*rgb, 0.), (*rgb, 1.)], N=256)
+    alpha, aspect = baseMap
+    # the mask is rendered at the output resolution, nearest is enough
+    ax.imshow(alpha, cmap=cmap, vmin=0, vmax=255, extent=extent,
+              aspect=aspect, interpolation='nearest', zorder=0)
+    ax.set_xlim(x0, x1)
+    ax.set_ylim(y0, y1)
+    return aspect
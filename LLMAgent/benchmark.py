@@ -0,0 +1,190 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+import pandas as pd
+from langchain.callbacks.base import BaseCallbackHandler
+
+from LLMAgent.ConversationBot import ConversationBot
+from LLMAgent.replayLLM import ReplayChatModel, load_transcript
+from LLMAgent.stageTimer import get_stage_totals
+from LLMAgent.queryRegistry import get_query_stats
+
+
+SCENARIO = './real-world-simulation-withTLS'
+
+
+def simulation_tools(scenario: str, figfolder: str) -> list:
+    # 与 SimulationProcessBot.py 中的工具相同
+    from LLMAgent.trafficTools import (
+        simulationControl,
+        intersectionPerformance,
+        intersectionSignalOptimization,
+        intersectionVisulization,
+    )
+    sumoCFGFile = f'{scenario}/xuancheng.sumocfg'
+    sumoNetFile = f'{scenario}/xuancheng.net.xml'
+    sumoRouFile = f'{scenario}/xuancheng.rou.xml'
+    sumoEdgeDataFile = f'{scenario}/edgedata.xml'
+    sumoOriginalStateFile = f'{scenario}/originalstate.xml'
+    sumoTempStateFile = f'{scenario}/tempstate.xml'
+    sumoNewTLSFile = f'{scenario}/newTLS.add.xml'
+    return [
+        simulationControl(
+            sumoCFGFile, sumoNetFile, sumoEdgeDataFile,
+            sumoOriginalStateFile, sumoTempStateFile, figfolder
+        ),
+        intersectionPerformance(sumoNetFile, sumoEdgeDataFile),
+        intersectionSignalOptimization(
+            sumoNetFile, sumoCFGFile, sumoRouFile, sumoNewTLSFile,
+        ),
+        intersectionVisulization(sumoNetFile, figfolder)
+    ]
+
+
+def data_tools(scenario: str, figfolder: str) -> list:
+    # 与 DataProcessBot.py 中的工具相同
+    from LLMAgent.dataTools import (
+        roadVolumeTrend,
+        roadVolume,
+        roadNameToID,
+        plotGeoHeatmap,
+        getCurrentTime,
+        roadVisulization,
+        odVolume,
+        odMap
+    )
+    return [
+        roadVolumeTrend(figfolder),
+        roadVolume(),
+        roadNameToID(),
+        plotGeoHeatmap(figfolder),
+        getCurrentTime(),
+        roadVisulization(figfolder),
+        odVolume(),
+        odMap(figfolder)
+    ]
+
+
+TOOLSETS = {'simulation': simulation_tools, 'data': data_tools}
+
+
+class ToolTimer(BaseCallbackHandler):
+    """Wall time of every tool call of a run."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls = []
+        self._started = {}
+
+    def on_tool_start(
+            self, serialized: Dict[str, Any], input_str: str, *,
+            run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        self._started[run_id] = (serialized.get('name'), input_str, time.perf_counter())
+
+    def on_tool_end(self, output: str, *, run_id: UUID, **kwargs: Any) -> Any:
+        self.finish(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> Any:
+        self.finish(run_id)
+
+    def finish(self, run_id: UUID) -> None:
+        name, input_str, start = self._started.pop(run_id)
+        self.calls.append((name, input_str, time.perf_counter() - start))
+
+
+def stage_diff(before: dict, after: dict) -> dict:
+    return {
+        name: (n - before.get(name, (0, 0.))[0], total - before.get(name, (0, 0.))[1])
+        for name, (n, total) in after.items()
+        if n != before.get(name, (0, 0.))[0]
+    }
+
+
+def query_totals() -> dict:
+    stats = get_query_stats()
+    return {f'query {q}': (n, total) for q, n, total in stats[['query', 'calls', 'total_s']].itertuples(index=False)}
+
+
+def run_benchmark(transcript: dict, scenario: str, figfolder: str, repeat: int = 1) -> pd.DataFrame:
+    """Replay every dialogue of `transcript` `repeat` times and return one
+    row per turn, tool call and stage with its time in seconds.
+
+    The first repeat starts with the caches of a fresh process; the
+    later ones show the warm timings.
+    """
+    tools = TOOLSETS[transcript['bot']](scenario, figfolder)
+    dialogues = transcript['dialogues']
+    rows = []
+    for r in range(repeat):
+        llm = ReplayChatModel(dialogues=dialogues)
+        timer = ToolTimer()
+        bot = ConversationBot(llm, tools, '', callbacks=[timer])
+        for i, dialogue in enumerate(dialogues):
+            # 前一轮失败时从下一段对话继续
+            llm.turn = i
+            timer.calls = []
+            before = {**get_stage_totals(), **query_totals()}
+            start = time.perf_counter()
+            try:
+                bot.dialogue(dialogue['question'])
+                status = 'ok'
+            except Exception as e:
+                status = f'{type(e).__name__}: {e}'
+            elapsed = time.perf_counter() - start
+            after = {**get_stage_totals(), **query_totals()}
+
+            base = {'repeat': r, 'question': dialogue['question']}
+            rows.append({**base, 'stage': 'turn', 'calls': 1, 'seconds': elapsed, 'status': status})
+            for name, input_str, seconds in timer.calls:
+                rows.append({**base, 'stage': f'tool {name}', 'calls': 1, 'seconds': seconds,
+                             'status': input_str})
+            for name, (n, total) in stage_diff(before, after).items():
+                rows.append({**base, 'stage': name, 'calls': n, 'seconds': total, 'status': ''})
+    return pd.DataFrame(rows, columns=['repeat', 'question', 'stage', 'calls', 'seconds', 'status'])
+
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """Seconds per question and stage in the first repeat (cold) and the
+    median over the later ones (warm); stages that only ran cold, like
+    parsing a network, have no warm time."""
+    keys = ['question', 'stage']
+    perRepeat = results.groupby(['repeat', *keys], sort=False)['seconds'].sum().reset_index()
+    cold = perRepeat[perRepeat['repeat'] == 0].set_index(keys)['seconds']
+    warm = perRepeat[perRepeat['repeat'] > 0].groupby(keys)['seconds'].median()
+    order = pd.MultiIndex.from_frame(results[keys].drop_duplicates())
+    return pd.DataFrame({
+        'cold_s': cold.reindex(order), 'warm_s': warm.reindex(order)
+    }).reset_index()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(
+        description='Replay recorded dialogues offline and time every turn, tool call and stage')
+    ap.add_argument('transcript', help='transcript file, e.g. benchmark/simulation.json')
+    ap.add_argument('-r', '--repeat', type=int, default=3)
+    ap.add_argument('--scenario', default=SCENARIO,
+                    help='SUMO scenario folder, copied so that the benchmark leaves it unchanged')
+    ap.add_argument('--figfolder', default='./fig/')
+    ap.add_argument('-o', '--output', help='write all timings to this CSV file')
+    args = ap.parse_args()
+
+    transcript = load_transcript(args.transcript)
+    os.makedirs(args.figfolder, exist_ok=True)
+    with tempfile.TemporaryDirectory() as workdir:
+        scenario = os.path.join(workdir, os.path.basename(os.path.abspath(args.scenario)))
+        # 不复制路网快照等缓存文件，第一次重复即冷启动
+        shutil.copytree(args.scenario, scenario, ignore=shutil.ignore_patterns(
+            '*.snapshot', '*.graph.npz', '*.kpi'))
+        results = run_benchmark(transcript, scenario, args.figfolder, args.repeat)
+    if args.output:
+        results.to_csv(args.output, index=False)
+    failed = results[(results['stage'] == 'turn') & (results['status'] != 'ok')]
+    for question, status in failed[['question', 'status']].drop_duplicates().itertuples(index=False):
+        print(f'FAILED {question!r}: {status}')
+    print(summarize(results).to_markdown(index=False, floatfmt='.3f'))
@@ -1,49 +1,132 @@
+import os
+import threading
+from collections.abc import Mapping
+import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection
 from xml.etree import ElementTree as ET
 import matplotlib
 matplotlib.use('TkAgg')
 
+from LLMAgent.netCache import file_digest
+from LLMAgent.stageTimer import timed_stage
+
+
+def parse_shapes(rawShapes: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Parse SUMO shape strings into one (n, 2) coordinate array and the
+    offsets of each shape in it; z coordinates are dropped."""
+    counts = np.fromiter((s.strip().count(' ') + 1 for s in rawShapes),
+                         dtype=np.int64, count=len(rawShapes))
+    offsets = np.zeros(len(rawShapes) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    nPoints = offsets[-1]
+    values = np.array(' '.join(rawShapes).replace(',', ' ').split(), dtype=float)
+    if values.size == 2 * nPoints:
+        coords = values.reshape(-1, 2)
+    elif values.size == 3 * nPoints:
+        coords = values.reshape(-1, 3)[:, :2].copy()
+    else:
+        # 二维与三维坐标混合的路网
+        coords = np.array([
+            [float(v) for v in p.split(',')[:2]]
+            for s in rawShapes for p in s.split()
+        ]).reshape(-1, 2)
+    return coords, offsets
+
+
+def group_by(keys: np.ndarray, values: np.ndarray, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """`values` grouped by the integer `keys` in [0, n): the values of key
+    `k` are values[offsets[k]:offsets[k + 1]], in their original order."""
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n), out=offsets[1:])
+    return offsets, values[np.argsort(keys, kind='stable')]
+
 
 class Lane:
-    def __init__(
-            self, id: str, speed: float, length: float,
-            raw_shape: str
-    ) -> None:
-        self.id = id
-        self.speed = speed
-        self.length = length
-        self.shape = self.process_raw_shape(raw_shape)
+    """View of one lane row of a Graph."""
+    __slots__ = ('graph', 'index')
+
+    def __init__(self, graph: 'Graph', index: int) -> None:
+        self.graph = graph
+        self.index = index
 
-    def process_raw_shape(self, raw_shape: str) -> [[float]]:
-        raw_list = raw_shape.split(' ')
-        shape = [list(map(float, p.split(','))) for p in raw_list]
-        return shape
+    @property
+    def id(self) -> str:
+        return self.graph.laneIDs[self.index]
+
+    @property
+    def speed(self) -> float:
+        return float(self.graph.laneSpeed[self.index])
+
+    @property
+    def length(self) -> float:
+        return float(self.graph.laneLength[self.index])
+
+    @property
+    def shape(self) -> np.ndarray:
+        offsets = self.graph.coordOffsets
+        return self.graph.coords[offsets[self.index]:offsets[self.index + 1]]
 
     def plot_self(self, color: str, alpha: float):
-        plt.plot(
-            list(zip(*self.shape))[0],
-            list(zip(*self.shape))[1],
-            color=color, alpha=alpha
-        )
+        xs, ys = self.shape.T
+        plt.plot(xs, ys, color=color, alpha=alpha)
 
 
 class Edge:
-    def __init__(self, id: str, fromNode: str, toNode: str) -> None:
-        self.id = id,
-        self.fromNode = fromNode
-        self.toNode = toNode
-        self.lanes: dict[str, Lane] = {}
-        self.next_edges: set[str] = set()
-        self.length: float = 0
-        self.freeFlowSpeed = 13.89
+    """View of one edge row of a Graph."""
+    __slots__ = ('graph', 'index')
+    freeFlowSpeed = 13.89
+
+    def __init__(self, graph: 'Graph', index: int) -> None:
+        self.graph = graph
+        self.index = index
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Edge) and other.graph is self.graph and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash(self.index)
+
+    def __repr__(self) -> str:
+        return f'Edge({self.id!r})'
+
+    @property
+    def id(self) -> str:
+        return self.graph.edgeIDs[self.index]
+
+    @property
+    def fromNode(self) -> str:
+        return self.graph.junctionIDs[self.graph.edgeFrom[self.index]]
+
+    @property
+    def toNode(self) -> str:
+        return self.graph.junctionIDs[self.graph.edgeTo[self.index]]
+
+    @property
+    def lanes(self) -> dict[str, Lane]:
+        graph = self.graph
+        return {
+            graph.laneIDs[j]: Lane(graph, j)
+            for j in range(graph.laneOffsets[self.index], graph.laneOffsets[self.index + 1])
+        }
+
+    @property
+    def next_edges(self) -> set[str]:
+        graph = self.graph
+        nextEdges = graph.nextEdges[graph.nextOffsets[self.index]:graph.nextOffsets[self.index + 1]]
+        return {graph.edgeIDs[e] for e in nextEdges}
+
+    @property
+    def length(self) -> float:
+        return float(self.graph.edgeLength[self.index])
+
+    @property
+    def capacity(self) -> float:
+        return float(self.graph.edgeCapacity[self.index])
 
     def get_length(self) -> None:
-        max_length = 0
-        for lane in self.lanes.values():
-            if lane.length > max_length:
-                max_length = lane.length
-        self.length = max_length
-        self.capacity = 1800.0 * len(self.lanes)
+        # 长度与通行能力在建图时已按列计算
+        pass
 
     def plot_self(self, color: str, alpha: float) -> None:
         for lane in self.lanes.values():
@@ -51,24 +134,144 @@ class Edge:
 
 
 class Junction:
-    def __init__(self, id: str) -> None:
-        self.id = id
-        self.inEdges: set[Edge] = set()
-        self.outEdges: set[Edge] = set()
+    """View of one junction row of a Graph."""
+    __slots__ = ('graph', 'index')
+
+    def __init__(self, graph: 'Graph', index: int) -> None:
+        self.graph = graph
+        self.index = index
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Junction) and other.graph is self.graph and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash(self.index)
+
+    def __repr__(self) -> str:
+        return f'Junction({self.id!r})'
+
+    @property
+    def id(self) -> str:
+        return self.graph.junctionIDs[self.index]
+
+    @property
+    def inEdges(self) -> set[Edge]:
+        return {Edge(self.graph, e) for e in self.graph.junction_in_edges(self.index)}
+
+    @property
+    def outEdges(self) -> set[Edge]:
+        return {Edge(self.graph, e) for e in self.graph.junction_out_edges(self.index)}
 
     def calCap(self) -> float:
         jCap = 0
-        nEdges = len(self.inEdges)
-        for edge in self.inEdges:
-            jCap += edge.capacity / nEdges
+        inEdges = self.graph.junction_in_edges(self.index)
+        nEdges = len(inEdges)
+        for capacity in self.graph.edgeCapacity[inEdges]:
+            jCap += capacity / nEdges
 
         return jCap
 
 
+class GraphViews(Mapping):
+    """Read-only ID -> view mapping over the rows of a Graph."""
+
+    def __init__(self, ids: list[str], index: dict[str, int], view) -> None:
+        self.ids = ids
+        self.index = index
+        self.view = view
+
+    def __getitem__(self, key: str):
+        return self.view(self.index[key])
+
+    def __contains__(self, key) -> bool:
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
 class Graph:
-    def __init__(self) -> None:
-        self.edges: dict[str, Edge] = {}
-        self.junctions: dict[str, Junction] = {}
+    """Array-backed road network without internal edges.
+
+    Junctions, edges and lanes are rows of NumPy columns; `junctionIndex`
+    and `edgeIndex` map IDs to rows. The lanes of edge `i` are the rows
+    laneOffsets[i]:laneOffsets[i + 1] and the shape of lane `j` is
+    coords[coordOffsets[j]:coordOffsets[j + 1]]. `edges` and `junctions`
+    map IDs to Edge and Junction views of the rows.
+    """
+
+    ARRAYS = [
+        'junctionIDs', 'edgeIDs', 'edgeFrom', 'edgeTo', 'laneOffsets',
+        'laneIDs', 'laneSpeed', 'laneLength', 'coords', 'coordOffsets'
+    ]
+    IDS = ['junctionIDs', 'edgeIDs', 'laneIDs']
+
+    def __init__(
+            self, junctionIDs: list[str], edgeIDs: list[str],
+            edgeFrom: np.ndarray, edgeTo: np.ndarray, laneOffsets: np.ndarray,
+            laneIDs: list[str], laneSpeed: np.ndarray, laneLength: np.ndarray,
+            coords: np.ndarray, coordOffsets: np.ndarray, connections: np.ndarray
+    ) -> None:
+        self.junctionIDs = junctionIDs
+        self.junctionIndex = {jid: j for j, jid in enumerate(junctionIDs)}
+        self.edgeIDs = edgeIDs
+        self.edgeIndex = {eid: i for i, eid in enumerate(edgeIDs)}
+        self.edgeFrom = edgeFrom
+        self.edgeTo = edgeTo
+        self.laneOffsets = laneOffsets
+        self.laneIDs = laneIDs
+        self.laneSpeed = laneSpeed
+        self.laneLength = laneLength
+        self.coords = coords
+        self.coordOffsets = coordOffsets
+
+        # 边长取最长车道的长度，通行能力按每车道 1800 veh/h 计算
+        laneCount = np.diff(laneOffsets)
+        self.edgeLength = np.zeros(len(edgeIDs))
+        hasLanes = laneCount > 0
+        if hasLanes.any():
+            self.edgeLength[hasLanes] = np.maximum.reduceat(
+                laneLength, laneOffsets[:-1][hasLanes])
+        self.edgeCapacity = 1800.0 * laneCount
+
+        # (from edge, to edge) rows of the connections -> successors per edge
+        nEdges = len(edgeIDs)
+        pairs = np.unique(connections[:, 0] * nEdges + connections[:, 1])
+        self.nextOffsets, self.nextEdges = group_by(pairs // nEdges, pairs % nEdges, nEdges)
+
+        self.edges = GraphViews(edgeIDs, self.edgeIndex, lambda i: Edge(self, i))
+        self.junctions = GraphViews(junctionIDs, self.junctionIndex, lambda j: Junction(self, j))
+        self._junctionInEdges: dict[int, tuple] = {}
+        completeJunctions(self)
+
+    @property
+    def connections(self) -> np.ndarray:
+        fromEdges = np.repeat(np.arange(len(self.edgeIDs)), np.diff(self.nextOffsets))
+        return np.column_stack([fromEdges, self.nextEdges])
+
+    def save(self, path: str, digest: str) -> None:
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        for name in self.IDS:
+            arrays[name] = np.array(arrays[name], dtype=str)
+        np.savez(path, digest=np.array(digest), connections=self.connections, **arrays)
+
+    @classmethod
+    def load(cls, path: str, digest: str):
+        """Load a saved graph, or return None if it is missing or was built
+        from another version of the net file."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if str(data['digest']) != digest:
+                    return None
+                arrays = {name: data[name] for name in cls.ARRAYS}
+                for name in cls.IDS:
+                    arrays[name] = arrays[name].tolist()
+                return cls(**arrays, connections=data['connections'])
+        except (OSError, KeyError, ValueError):
+            return None
 
     def get_junction(self, jid: str):
         return self.junctions[jid]
@@ -83,63 +286,151 @@ class Graph:
     def get_edge(self, eid: str):
         return self.edges[eid]
 
+    def junction_in_edges(self, j: int) -> np.ndarray:
+        return self.inEdges[self.inOffsets[j]:self.inOffsets[j + 1]]
+
+    def junction_out_edges(self, j: int) -> np.ndarray:
+        return self.outEdges[self.outOffsets[j]:self.outOffsets[j + 1]]
+
     def getEdgeByJunction(self, fnode: str, tnode: str):
-        fj = self.get_junction(fnode)
-        for edge in fj.outEdges:
-            if edge.toNode == tnode:
-                return edge
+        fj = self.junctionIndex[fnode]
+        for e in self.junction_out_edges(fj):
+            if self.junctionIDs[self.edgeTo[e]] == tnode:
+                return Edge(self, e)
         raise ValueError(f'There is no edge between {fnode} and {tnode}.')
 
+    def get_junction_inedges(self, minInEdges: int = 3):
+        """Flat junction -> incoming edge index of the junctions with at least
+        `minInEdges` incoming edges: (junction ids, offsets, edge ids)."""
+        if minInEdges not in self._junctionInEdges:
+            counts = np.diff(self.inOffsets)
+            selected = counts >= minInEdges
+            owner = np.repeat(np.arange(len(counts)), counts)
+            offsets = np.zeros(selected.sum() + 1, dtype=np.int64)
+            np.cumsum(counts[selected], out=offsets[1:])
+            eids = np.array(self.edgeIDs, dtype=object)[self.inEdges[selected[owner]]]
+            jids = [self.junctionIDs[j] for j in np.flatnonzero(selected)]
+            self._junctionInEdges[minInEdges] = (jids, offsets, eids)
+        return self._junctionInEdges[minInEdges]
+
     def plot_self(self):
-        for edge in self.edges.values():
-            edge.plot_self('grey', 0.3)
+        # all lanes in one LineCollection instead of a line per lane
+        shapes = np.split(self.coords, self.coordOffsets[1:-1])
+        ax = plt.gca()
+        ax.add_collection(LineCollection(shapes, colors='grey', alpha=0.3))
+        ax.autoscale_view()
 
 
 def completeJunctions(graph: Graph):
-    for ek, ev in graph.edges.items():
-        fj = graph.get_junction(ev.fromNode)
-        tf = graph.get_junction(ev.toNode)
-        fj.outEdges.add(ev)
-        tf.inEdges.add(ev)
+    # incoming and outgoing edges of each junction, grouped by junction row
+    edges = np.arange(len(graph.edgeIDs))
+    nJunctions = len(graph.junctionIDs)
+    graph.inOffsets, graph.inEdges = group_by(graph.edgeTo, edges, nJunctions)
+    graph.outOffsets, graph.outEdges = group_by(graph.edgeFrom, edges, nJunctions)
 
 
-def build_graph(file: str) -> Graph:
-    graph = Graph()
-    eTree = ET.parse(file)
-    root = eTree.getroot()
-    for child in root:
-        if child.tag == 'edge':
-            eid = child.attrib['id']
-            if ':' not in eid:
-                fromNode = child.attrib['from']
-                toNode = child.attrib['to']
-                edge = Edge(eid, fromNode, toNode)
-                for gchild in child:
-                    lid = gchild.attrib['id']
-                    speed = float(gchild.attrib['speed'])
-                    length = float(gchild.attrib['length'])
-                    raw_shape = gchild.attrib['shape']
-                    lane = Lane(
-                        lid, speed, length, raw_shape)
-                    edge.lanes[lid] = lane
-                    edge.get_length()
-                graph.edges[eid] = edge
-            else:
-                continue
-        elif child.tag == 'junction':
-            jid = child.attrib['id']
+class NetFileTarget:
+    """Parser target collecting the columns of the non-internal junctions,
+    edges, lanes and connections of a net file from the start tags, without
+    building an XML tree."""
+
+    def __init__(self) -> None:
+        self.junctionIDs, self.edgeIDs, self.fromNodes, self.toNodes = [], [], [], []
+        self.laneCounts, self.laneIDs, self.laneSpeed, self.laneLength, self.rawShapes = [], [], [], [], []
+        self.connections = []
+        self._inEdge = False
+
+    def start(self, tag: str, attrib: dict) -> None:
+        if tag == 'lane':
+            if self._inEdge:
+                self.laneIDs.append(attrib['id'])
+                self.laneSpeed.append(float(attrib['speed']))
+                self.laneLength.append(float(attrib['length']))
+                self.rawShapes.append(attrib['shape'])
+                self.laneCounts[-1] += 1
+        elif tag == 'edge':
+            eid = attrib['id']
+            self._inEdge = ':' not in eid
+            if self._inEdge:
+                self.edgeIDs.append(eid)
+                self.fromNodes.append(attrib['from'])
+                self.toNodes.append(attrib['to'])
+                self.laneCounts.append(0)
+        elif tag == 'junction':
+            jid = attrib['id']
             if ':' not in jid:
-                graph.junctions[jid] = Junction(jid)
-        elif child.tag == 'connection':
-            from_edge_id = child.attrib['from']
-            to_edge_id = child.attrib['to']
+                self.junctionIDs.append(jid)
+        elif tag == 'connection':
+            from_edge_id = attrib['from']
+            to_edge_id = attrib['to']
             if ':' not in from_edge_id and ':' not in to_edge_id:
-                from_edge = graph.get_edge(from_edge_id)
-                from_edge.next_edges.add(to_edge_id)
-            else:
-                continue
-        else:
-            continue
-
-    completeJunctions(graph)
-    return graph
+                self.connections.append((from_edge_id, to_edge_id))
+
+    def end(self, tag: str) -> None:
+        if tag == 'edge':
+            self._inEdge = False
+
+    def close(self) -> None:
+        pass
+
+
+def build_graph(file: str) -> Graph:
+    net = NetFileTarget()
+    parser = ET.XMLParser(target=net)
+    with open(file, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            parser.feed(chunk)
+    parser.close()
+    junctionIDs, edgeIDs = net.junctionIDs, net.edgeIDs
+
+    junctionIndex = {jid: j for j, jid in enumerate(junctionIDs)}
+    edgeIndex = {eid: i for i, eid in enumerate(edgeIDs)}
+    laneOffsets = np.zeros(len(edgeIDs) + 1, dtype=np.int64)
+    np.cumsum(net.laneCounts, out=laneOffsets[1:])
+    coords, coordOffsets = parse_shapes(net.rawShapes)
+
+    return Graph(
+        junctionIDs, edgeIDs,
+        np.array([junctionIndex[j] for j in net.fromNodes], dtype=np.int64),
+        np.array([junctionIndex[j] for j in net.toNodes], dtype=np.int64),
+        laneOffsets, net.laneIDs,
+        np.array(net.laneSpeed), np.array(net.laneLength),
+        coords, coordOffsets,
+        np.array([(edgeIndex[f], edgeIndex[t]) for f, t in net.connections],
+                 dtype=np.int64).reshape(-1, 2)
+    )
+
+
+# net file path -> ((mtime, size), Graph), shared by every caller in the process
+_graphCache: dict[str, tuple[tuple[int, int], Graph]] = {}
+_graphCacheLock = threading.Lock()
+
+
+def get_graph(file: str) -> Graph:
+    """Return the graph of `file`, rebuilt only when the file changes.
+
+    The graph is also saved next to the net file as `<file>.graph.npz`,
+    checked against the SHA-1 of the file.
+    """
+    st = os.stat(file)
+    stamp = (st.st_mtime_ns, st.st_size)
+    key = os.path.abspath(file)
+    with _graphCacheLock:
+        cached = _graphCache.get(key)
+        if cached is None or cached[0] != stamp:
+            with timed_stage('parse graph'):
+                digest = file_digest(file)
+                snapshotfile = f'{file}.graph.npz'
+                graph = Graph.load(snapshotfile, digest)
+                if graph is None:
+                    graph = build_graph(file)
+                    try:
+                        graph.save(snapshotfile, digest)
+                    except OSError:
+                        pass
+            cached = (stamp, graph)
+            _graphCache[key] = cached
+    return cached[1]
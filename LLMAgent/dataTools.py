@@ -1,8 +1,13 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 
-from LLMAgent.dbConnector import fetch_from_database
+from LLMAgent.dbConnector import fetch_query
+from LLMAgent.roadTripIndex import has_road_trip_index
+from LLMAgent.volumeRollup import plan_volume_query
 from LLMAgent.plotGeoMap import plot_geo_heatmap, plot_road_segements, plot_OD_map
+from LLMAgent.renderProfile import PYPLOT_LOCK, render_dpi, save_figure, split_profile
+from LLMAgent.resultHandles import table_observation
+from LLMAgent.stageTimer import timed_stage
 from LLMAgent.getTime import get_time_period, get_fake_current_time
 
 
@@ -17,6 +22,9 @@ def prompts(name, description):
 
 
 class roadVolumeTrend:
+    # 工具读取的资源，同一轮对话中重复的调用会被缓存，见 LLMAgent/toolMemo.py
+    reads = ('database',)
+
     def __init__(self, figfolder: str) -> None:
         self.figfolder = figfolder
 
@@ -26,21 +34,22 @@ class roadVolumeTrend:
             Use this tool more than others if the question is about traffic trends.
             The output will tell you whether you have finished this command successfully.
             The input should be one sigle semicolon-separated string that separate two parts of information, and the two parts to the left and right of the semicolon are date and roadID, respectively. 
-            The input date should be an integer, representing the day of the month. The input roadID should be a "|" seperated string, representing the id of the target roads. For example: 15;1076|30188""")
+            The input date should be an integer, representing the day of the month. The input roadID should be a "|" seperated string, representing the id of the target roads. For example: 15;1076|30188
+            Only if the human user asks for a full-resolution figure for a report, append ";report" to the input. For example: 15;1076|30188;report""")
     def inference(self, target: str) -> str:
 
+        target, profile = split_profile(target)
         day, road_id = target.replace(' ', '').split(';')
+        road_id = '|'.join(sorted(set(road_id.split('|'))))
 
         # query
-        query = f"""
-        select date_trunc('hour', departure_time) as hours, count(*) as volume  
-        from the_synthetic_individual_level_trip_dataset
-        where path similar to '%({road_id})%' AND extract(day from departure_time) = {day}
-        group by hours
-        order by hours;
-        """
-
-        rows = fetch_from_database(query)
+        if has_road_trip_index():
+            # 按道路ID精确匹配预建的倒排索引
+            rows = fetch_query('road_volume_trend_indexed', {
+                'road_ids': road_id.split('|'), 'day': int(day)})
+        else:
+            rows = fetch_query('road_volume_trend', {
+                'path_pattern': f'%({road_id})%', 'day': int(day)})
 
         time = []
         volume = []
@@ -49,16 +58,18 @@ class roadVolumeTrend:
             volume.append(row[-1])
 
 
-        plt.figure(figsize=(16,8),dpi=300)
-        plt.bar(time,volume)
-        plt.xticks(rotation=70)
-        fig_path = f'{self.figfolder}volume_bar.png'
-        plt.savefig(fig_path, dpi=300)
+        with PYPLOT_LOCK, timed_stage('render volume_bar'):
+            fig = plt.figure(figsize=(16,8),dpi=render_dpi(300, profile))
+            plt.bar(time,volume)
+            plt.xticks(rotation=70)
+            fig_path = save_figure(fig, f'{self.figfolder}volume_bar', 300, profile)
 
         return f"You have successfully visualized the Road Traffic Trends. And your final answer should include this sentence without changing anything: The histogram showing the traffic trend is kept at: `{fig_path}`."
 
 
 class roadVolume:
+    reads = ('database',)
+
     def __init__(self) -> None:
         pass
 
@@ -81,52 +92,34 @@ class roadVolume:
             target_road_id = []
         else:
             have_target = True
-            target_road_id = target.split(',')
+            target_road_id = [item.strip() for item in target.split(',')]
             # print('target'+ str(target.replace(' ', '').split(','))) 
-            idlist = ', '.join(f"'{item}'" for item in target_road_id)
         
         # query
         if have_target == False and 'None' in target:
-            query = f"""
-            select road as road_id, SUM(road_count) as volume
-            from road_volume_per_hour
-            WHERE hour_start >= '{begin}' AND hour_start < '{end}'
-            group by road_id
-            ORDER BY volume DESC
-            LIMIT 5;
-            """
+            name, params = plan_volume_query('road_volume_top', begin, end)
+            rows = fetch_query(name, {**params, 'limit': 5})
         elif have_target == False and 'All' in target:
-            query = f"""
-            select road as road_id, SUM(road_count) as volume
-            from road_volume_per_hour
-            WHERE hour_start >= '{begin}' AND hour_start < '{end}'
-            group by road_id
-            ORDER BY volume DESC
-            """
+            rows = fetch_query(*plan_volume_query('road_volume_all', begin, end))
         else:
-            query = f"""
-            select road as road_id, SUM(road_count) as volume
-            from road_volume_per_hour
-            WHERE hour_start >= '{begin}' AND hour_start < '{end}' AND road IN ({idlist})
-            group by road_id
-            ORDER BY volume DESC
-            """
-
-        rows = fetch_from_database(query)
+            name, params = plan_volume_query('road_volume_by_ids', begin, end)
+            rows = fetch_query(name, {**params, 'road_ids': target_road_id})
         data = pd.DataFrame(rows,columns=['road_id','volume'])
 
         if 'None' in target:
             msg = 'No specific target roads. The human user just wants to see an overview. So, I can show you the overview by providing traffic data for the 5 highest volume roads by default. Make sure you output the tabular content in markdown format into your final answer. \n'
-            return msg + data.to_markdown()
+            return table_observation(msg, data)
         elif 'All' in target:
             msg = 'Here are the traffic volume of all roads. Make sure you output the tabular content in markdown format into your final answer. \n'
-            return msg + data.to_markdown()
+            return table_observation(msg, data)
         else:
             msg = 'Here are the traffic status of your targeted roads. Make sure you output the tabular content in markdown format into your final answer. \n'
-            return msg + data.to_markdown()
+            return table_observation(msg, data)
 
 
 class roadNameToID:
+    reads = ('database',)
+
     def __init__(self) -> None:
         pass
 
@@ -142,13 +135,7 @@ class roadNameToID:
         road_name = target.replace(' ', '')
 
         # query
-        query = f"""
-        select objectid,mc
-        from topo_centerroad
-        where mc = '{road_name}'
-        """
-
-        rows = fetch_from_database(query)
+        rows = fetch_query('road_id_by_name', {'road_name': road_name})
         data = pd.DataFrame(rows,columns=['road_id','road_name'])
         road_id_list = data['road_id'].tolist()
         road_ids = ', '.join(str(int(road)) for road in road_id_list)
@@ -157,6 +144,8 @@ class roadNameToID:
 
 
 class plotGeoHeatmap:
+    reads = ('database',)
+
     def __init__(self, figfolder: str) -> None:
         self.figfolder = figfolder
 
@@ -167,24 +156,16 @@ class plotGeoHeatmap:
             Use this tool more than others if the human user want to see the traffic status of the network.
             The output will tell you the file path of the heat mapas a supplementary information for you to provide the final answer. 
             The input must be the target point in time in the "YYYY-MM-DD HH:MM:SS" format. 
-            
+            Only if the human user asks for a full-resolution figure for a report, append ";report" to the input. For example: 2019-08-13 08:00:00;report
             """)
     def inference(self, time: str) -> str:
+        time, profile = split_profile(time)
         try:
             start, end = get_time_period(time)
         except:
             return "Wrong format of input parameters, The input must be the target point in time in the 'YYYY-MM-DD HH:MM:SS' format."
 
-        # query
-        query = f"""SELECT mc, objectid, volume, geom 
-        FROM topo_centerroad join (
-        select road as road_ID, SUM(road_count) as volume
-        from road_volume_per_hour
-        WHERE hour_start >= '{start}' AND hour_start < '{end}'
-        group by road_ID) as traffic_volume
-        on CAST(ROUND(objectid) as varchar) = traffic_volume.road_ID;"""
-
-        fig_path = plot_geo_heatmap(query,self.figfolder)
+        fig_path = plot_geo_heatmap(start, end, self.figfolder, profile)
 
         return f"The heat map is ploted according to traffic volume data at {time}. And your final answer should include this sentence without changing anything: the road network heat map is kept at: `{fig_path}`."
     
@@ -208,6 +189,8 @@ class getCurrentTime:
     
 
 class roadVisulization:
+    reads = ('database',)
+
     def __init__(self, figfolder: str) -> None:
         self.figfolder = figfolder
 
@@ -217,17 +200,21 @@ class roadVisulization:
             Use this tool more than others if the question is about locations of roads.
             The output will tell you whether you have finished this command successfully.
             The input should be a comma seperated string, with each part be a series of figures representing a target road_id. 
-            For example: 1076,30188 """)
+            For example: 1076,30188 
+            Only if the human user asks for a full-resolution figure for a report, append ";report" to the input. For example: 1076,30188;report""")
     def inference(self, target: str) -> str:
 
+        target, profile = split_profile(target)
         road_ids = target.replace(' ', '')
 
-        fig_path = plot_road_segements(road_ids, self.figfolder)
+        fig_path = plot_road_segements(road_ids, self.figfolder, profile)
 
         return f"You have successfully visualized the location of road {target} on the following map. And your final answer should include the following sentence without changing words: The location of road {target} is kept at: `{fig_path}`."
     
 
 class odVolume:
+    reads = ('database',)
+
     def __init__(self) -> None:
         pass
 
@@ -246,24 +233,19 @@ class odVolume:
         if number == "None":
             N =5
         else:
-            N = eval(number)
-
-        query = f"""
-        SELECT o_zone, d_zone, COUNT(*) AS od_pair_volume
-        FROM the_synthetic_individual_level_trip_dataset
-        WHERE departure_time >= '{begin}' AND departure_time < '{end}'
-        GROUP BY o_zone, d_zone
-        ORDER BY od_pair_volume DESC
-        LIMIT {N};"""
+            N = int(number)
 
-        rows = fetch_from_database(query)
+        name, params = plan_volume_query('od_volume_top', begin, end)
+        rows = fetch_query(name, {**params, 'limit': N})
         data = pd.DataFrame(rows,columns=['o_zone','d_zone','od_pair_volume'])
 
         msg = f'Here are the traffic volume data of top{N} OD pairs. Make sure you output the tabular content in markdown format into your final answer. \n'
-        return msg + data.to_markdown()
+        return table_observation(msg, data)
     
 
 class odMap:
+    reads = ('database',)
+
     def __init__(self, figfolder: str) -> None:
         self.figfolder = figfolder
 
@@ -273,13 +255,14 @@ class odMap:
             Use this tool more than others if the question is about OD map.
             The output will tell you the file path of the OD map as a supplementary information for you to provide the final answer. 
             The input time_period should be a comma seperated string, with each part representing the start and end date and time of the time_period in the "YYYY-MM-DD HH:MM:SS" format.
-            
+            Only if the human user asks for a full-resolution figure for a report, append ";report" to the input. For example: 2019-08-13 08:00:00,2019-08-13 09:00:00;report
             """)
     def inference(self, time: str) -> str:
 
+        time, profile = split_profile(time)
         begin, end = time.split(',')
         
-        fig_path = plot_OD_map(begin, end, self.figfolder)
+        fig_path = plot_OD_map(begin, end, self.figfolder, profile)
 
         return f"The OD map is ploted according to traffic volume data at from {begin} to {end}. And your final answer should include this sentence without changing anything: The OD map is kept at: `{fig_path}`."
     
\ No newline at end of file
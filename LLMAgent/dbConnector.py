@@ -1,19 +1,67 @@
+import threading
 import sqlalchemy as sa
 import yaml
 
-def fetch_from_database(query):
-
-    # 读取配置文件
-    with open("dbconfig.yaml", "r") as f:
-        config = yaml.safe_load(f)
-
-    # 连接到PostgreSQL数据库
-    db_uri = f"postgresql://{config['username']}:{config['password']}@{config['host']}:{config['port']}/{config['db_name']}"
-    engine = sa.create_engine(db_uri)
-    conn = engine.connect()
-    
-    # 执行查询
-    query_obj = sa.text(query)
-    result = conn.execute(query_obj)
-    conn.close()
-    return result
+from LLMAgent.queryRegistry import execute_query, timed_query
+from LLMAgent.resultCache import RESULT_CACHE
+
+# 连接池的默认参数，可在 dbconfig.yaml 中覆盖
+POOL_DEFAULTS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+    'pool_recycle': 1800,
+}
+
+_engine = None
+_engineLock = threading.Lock()
+
+
+def get_engine() -> sa.engine.Engine:
+    """The engine shared by all data tools, created on first use."""
+    global _engine
+    if _engine is None:
+        with _engineLock:
+            if _engine is None:
+                # 读取配置文件
+                with open("dbconfig.yaml", "r") as f:
+                    config = yaml.safe_load(f)
+
+                # 连接到PostgreSQL数据库
+                db_uri = f"postgresql://{config['username']}:{config['password']}@{config['host']}:{config['port']}/{config['db_name']}"
+                pool_options = {k: config.get(k, v) for k, v in POOL_DEFAULTS.items()}
+                _engine = sa.create_engine(
+                    db_uri, pool_pre_ping=True, **pool_options)
+    return _engine
+
+
+def fetch_from_database(query, params=None):
+    # 执行查询，在归还连接前取出全部结果
+    with get_engine().connect() as conn:
+        result = conn.execute(sa.text(query), params or {})
+        return result.fetchall()
+
+
+def has_table(table_name):
+    # 查询表是否存在，用于在预计算表建好后自动切换查询
+    with get_engine().connect() as conn:
+        return sa.inspect(conn).has_table(table_name)
+
+
+def fetch_query(name, params=None):
+    # 执行 queryRegistry 中的具名查询，并记录耗时；相同参数的结果从缓存读取
+    def run(params):
+        with get_engine().connect() as conn:
+            with timed_query(name):
+                return execute_query(conn, name, params).fetchall()
+
+    return list(RESULT_CACHE.get_or_run(name, params, run))
+
+
+def stream_from_database(query, params=None, chunk_size=10000):
+    # 使用服务器端游标逐批读取结果
+    with get_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(
+            sa.text(query), params or {})
+        for rows in result.partitions(chunk_size):
+            yield from rows
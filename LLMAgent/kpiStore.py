@@ -0,0 +1,390 @@
+import functools
+import hashlib
+import mmap
+import os
+import threading
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from LLMAgent.stageTimer import timed_stage
+
+
+# the measures of the intervals given to the tools
+MEASURES = ['speed', 'waitingTime', 'timeLoss', 'left', 'density']
+
+# header bytes of a dump that identify one SUMO run; SUMO writes the start
+# time into the header comment and truncates the file when it restarts
+PREFIX_BYTES = 4096
+
+
+def prefix_digest(data, offset: int) -> str:
+    return hashlib.sha1(data[:min(offset, PREFIX_BYTES)]).hexdigest()
+
+
+class DumpChunkTarget:
+    """Parser target collecting the complete intervals of an edgedata dump
+    as rows of (edge, attribute values)."""
+
+    def __init__(self, measureIndex: dict[str, int]) -> None:
+        self.measureIndex = measureIndex
+        self.begins, self.ends, self.rowOffsets = [], [], []
+        self.edgeIDs, self.rows = [], []
+
+    def start(self, tag: str, attrib: dict) -> None:
+        if tag == 'edge':
+            row = [np.nan] * len(self.measureIndex)
+            for name, value in attrib.items():
+                if name == 'id':
+                    continue
+                try:
+                    value = float(value)
+                except ValueError:
+                    continue
+                i = self.measureIndex.setdefault(name, len(self.measureIndex))
+                if i >= len(row):
+                    row.extend([np.nan] * (i + 1 - len(row)))
+                row[i] = value
+            self.edgeIDs.append(attrib['id'])
+            self.rows.append(row)
+        elif tag == 'interval':
+            self.begins.append(float(attrib['begin']))
+            self.ends.append(float(attrib['end']))
+            self.rowOffsets.append(len(self.rows))
+
+    def end(self, tag: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def synchronized(method):
+    # ingest replaces several arrays; readers must not see them half updated
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class KPIStore:
+    """Append-only time series of an edgedata dump.
+
+    Intervals are stored in dump order: the rows of interval `i` are
+    rowOffsets[i]:rowOffsets[i + 1], with the edge as an integer code into
+    `edgeNames` and one column of `values` per attribute in `measures`
+    (NaN where the dump has no value). `offset` is the end of the last
+    ingested interval in the dump file. `complete` is False if the store
+    started at the latest interval of a dump and skipped the earlier ones.
+
+    Every ingest produces a segment of the same arrays, which is appended
+    to the store and saved as one file in `folder`.
+    """
+
+    ARRAYS = ['begins', 'ends', 'rowOffsets', 'edgeCodes', 'edgeNames', 'measures', 'values']
+
+    def __init__(self, folder: str = None, **arrays) -> None:
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.edgeNames = list(self.edgeNames)
+        self.measures = list(self.measures)
+        self.offset = int(arrays.get('offset', 0))
+        self.prefix = str(arrays.get('prefix', ''))
+        self.complete = bool(arrays.get('complete', True))
+        self.folder = folder
+        self.segments = 0
+        self.loaded = folder is None
+        self._edgeCode = {eid: i for i, eid in enumerate(self.edgeNames)}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def empty(cls, folder: str = None) -> 'KPIStore':
+        return cls(
+            folder=folder,
+            begins=np.zeros(0), ends=np.zeros(0),
+            rowOffsets=np.zeros(1, dtype=np.int64),
+            edgeCodes=np.zeros(0, dtype=np.int32), edgeNames=[], measures=[],
+            values=np.zeros((0, 0))
+        )
+
+    def __len__(self) -> int:
+        return len(self.begins)
+
+    @synchronized
+    def truncate(self, nIntervals: int) -> None:
+        nRows = self.rowOffsets[nIntervals]
+        self.begins = self.begins[:nIntervals]
+        self.ends = self.ends[:nIntervals]
+        self.rowOffsets = self.rowOffsets[:nIntervals + 1]
+        self.edgeCodes = self.edgeCodes[:nRows]
+        self.values = self.values[:nRows]
+
+    @synchronized
+    def clear(self) -> None:
+        self.truncate(0)
+        self.offset = 0
+        self.prefix = ''
+        self.complete = True
+
+    @synchronized
+    def ingest(self, dumpfile: str, tail: bool = False):
+        """Parse the intervals written to `dumpfile` since the last call,
+        append them and return them as a segment, or None if there are none.
+
+        With `tail`, an empty store only reads the latest complete interval
+        of the dump, which is found from the end of the file.
+
+        If the dump was rewritten by a new SUMO run, it is read again from
+        the start and its intervals replace the stored ones from the first
+        new interval on, the time the simulation was restarted from.
+        """
+        with open(dumpfile, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                return None
+            with data:
+                restarted = len(data) < self.offset or self.offset > 0 and \
+                    self.prefix != prefix_digest(data, self.offset)
+                offset = 0 if restarted else self.offset
+                # only complete intervals; SUMO may still be writing the last one
+                end = data.rfind(b'</interval>')
+                begin = data.find(b'<interval', offset)
+                complete = True
+                if tail and offset == 0 and len(self) == 0 and end >= 0:
+                    # earlier intervals are never parsed
+                    last = data.rfind(b'<interval', 0, end)
+                    complete = last == begin
+                    begin = last
+                if end < 0 or begin < 0 or end < begin:
+                    return None
+                end += len(b'</interval>')
+                chunk = data[begin:end]
+                prefix = prefix_digest(data, end)
+
+        target = DumpChunkTarget({})
+        parser = ET.XMLParser(target=target)
+        parser.feed(b'<meandata>')
+        parser.feed(chunk)
+        parser.feed(b'</meandata>')
+        parser.close()
+        if not target.begins:
+            return None
+
+        values = np.full((len(target.rows), len(target.measureIndex)), np.nan)
+        for r, row in enumerate(target.rows):
+            values[r, :len(row)] = row
+        edgeNames, edgeCodes = np.unique(np.array(target.edgeIDs, dtype=str), return_inverse=True)
+        segment = {
+            'begins': np.array(target.begins), 'ends': np.array(target.ends),
+            'rowOffsets': np.array(target.rowOffsets + [len(target.rows)], dtype=np.int64),
+            'edgeCodes': edgeCodes.astype(np.int32), 'edgeNames': edgeNames,
+            'measures': np.array(list(target.measureIndex), dtype=str), 'values': values,
+            'offset': end, 'prefix': prefix, 'complete': complete, 'restarted': restarted,
+        }
+        self.append(segment)
+        return segment
+
+    @synchronized
+    def append(self, segment: dict) -> None:
+        """Add the intervals of `segment`, read by ingest or loaded from a
+        segment file."""
+        begins = np.asarray(segment['begins'], dtype=float)
+        if bool(segment['restarted']) and len(begins):
+            replaced = np.flatnonzero(self.begins >= begins[0])
+            if len(replaced):
+                self.truncate(int(replaced[0]))
+        if len(self) == 0:
+            self.complete = bool(segment['complete'])
+        else:
+            self.complete = self.complete and bool(segment['complete'])
+
+        # 片段中的测量值与道路按名称对应到存储中的列与编号
+        measureIndex = {m: i for i, m in enumerate(self.measures)}
+        columns = [measureIndex.setdefault(str(m), len(measureIndex)) for m in segment['measures']]
+        self.measures = list(measureIndex)
+        nMeasures = len(measureIndex)
+        if self.values.shape[1] < nMeasures:
+            self.values = np.hstack([
+                self.values,
+                np.full((len(self.values), nMeasures - self.values.shape[1]), np.nan)])
+        values = np.full((len(segment['values']), nMeasures), np.nan)
+        values[:, columns] = segment['values']
+        codeMap = np.fromiter(
+            (self._edgeCode.setdefault(str(eid), len(self._edgeCode)) for eid in segment['edgeNames']),
+            dtype=np.int32, count=len(segment['edgeNames']))
+        self.edgeNames = list(self._edgeCode)
+
+        nRows = len(self.edgeCodes)
+        self.begins = np.concatenate([self.begins, begins])
+        self.ends = np.concatenate([self.ends, np.asarray(segment['ends'], dtype=float)])
+        self.rowOffsets = np.concatenate([self.rowOffsets[:-1], nRows + np.asarray(segment['rowOffsets'])])
+        self.edgeCodes = np.concatenate([self.edgeCodes, codeMap[np.asarray(segment['edgeCodes'], dtype=np.int64)]])
+        self.values = np.vstack([self.values, values])
+        self.offset = int(segment['offset'])
+        self.prefix = str(segment['prefix'])
+
+    def as_segment(self) -> dict:
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        arrays['edgeNames'] = np.array(self.edgeNames, dtype=str)
+        arrays['measures'] = np.array(self.measures, dtype=str)
+        return {**arrays, 'offset': self.offset, 'prefix': self.prefix,
+                'complete': self.complete, 'restarted': False}
+
+    @synchronized
+    def update(self, dumpfile: str, full: bool = False) -> int:
+        """Load the saved segments on first use, ingest the new intervals of
+        `dumpfile` and save them; return how many were added.
+
+        A store without saved segments starts at the latest interval of the
+        dump unless `full` is set, which also reads a store that skipped
+        intervals again from the start.
+        """
+        if not self.loaded:
+            self.load()
+            self.loaded = True
+        if full and not self.complete:
+            self.clear()
+            self.remove_segments()
+        with timed_stage('parse edgedata'):
+            segment = self.ingest(dumpfile, tail=not full)
+        if segment is None:
+            return 0
+        if self.folder is not None:
+            try:
+                if segment['restarted']:
+                    # 仿真重新开始后整体保存一次，旧片段不再需要
+                    self.remove_segments()
+                    segment = self.as_segment()
+                self.save_segment(segment)
+            except OSError:
+                pass
+        return len(segment['begins'])
+
+    def segment_files(self) -> list[str]:
+        try:
+            names = sorted(n for n in os.listdir(self.folder) if n.endswith('.npz'))
+        except OSError:
+            return []
+        return [os.path.join(self.folder, n) for n in names]
+
+    def remove_segments(self) -> None:
+        for path in self.segment_files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.segments = 0
+
+    def save_segment(self, segment: dict) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+        np.savez(os.path.join(self.folder, f'{self.segments:06d}.npz'),
+                 **{k: np.asarray(v) for k, v in segment.items()})
+        self.segments += 1
+
+    def load(self) -> None:
+        """Append the saved segments; an unreadable one discards them all."""
+        files = self.segment_files()
+        try:
+            for path in files:
+                with np.load(path, allow_pickle=False) as data:
+                    self.append({k: data[k] for k in data.files})
+            self.segments = len(files)
+        except (OSError, KeyError, ValueError, IndexError):
+            self.clear()
+            self.remove_segments()
+
+    @synchronized
+    def find_interval(self, begin: float = None) -> int:
+        """Index of the last interval starting at `begin`, or of the latest
+        interval if `begin` is None; -1 if there is none."""
+        if len(self) == 0:
+            return -1
+        if begin is None:
+            return int(np.flatnonzero(self.begins == self.begins.max())[-1])
+        matches = np.flatnonzero(self.begins == float(begin))
+        return int(matches[-1]) if len(matches) else -1
+
+    def interval_rows(self, i: int) -> slice:
+        return slice(self.rowOffsets[i], self.rowOffsets[i + 1])
+
+    @synchronized
+    def measure_values(self, i: int, measure: str) -> dict[str, float]:
+        """edge ID -> value of `measure` in interval `i`, for the edges that
+        have it."""
+        if i < 0 or measure not in self.measures:
+            return {}
+        rows = self.interval_rows(i)
+        values = self.values[rows, self.measures.index(measure)]
+        codes = self.edgeCodes[rows]
+        valid = ~np.isnan(values)
+        return dict(zip([self.edgeNames[c] for c in codes[valid]], values[valid].tolist()))
+
+    @synchronized
+    def kpi_frame(self, i: int = None, measures: list[str] = MEASURES) -> pd.DataFrame:
+        """The edges of interval `i` (default the latest) in dump order with
+        `measures`, all NaN for edges without samples."""
+        if i is None:
+            i = self.find_interval()
+        if i < 0:
+            rows = slice(0, 0)
+        else:
+            rows = self.interval_rows(i)
+        df = pd.DataFrame({'edgeID': np.array(
+            [self.edgeNames[c] for c in self.edgeCodes[rows]], dtype=object)})
+        columns = np.full((len(df), len(measures)), np.nan)
+        for j, measure in enumerate(measures):
+            if measure in self.measures:
+                columns[:, j] = self.values[rows, self.measures.index(measure)]
+        sampled = np.full(len(df), np.nan)
+        if 'sampledSeconds' in self.measures:
+            sampled = self.values[rows, self.measures.index('sampledSeconds')]
+        empty = np.isnan(columns).any(axis=1) | np.isnan(sampled) | (sampled == 0)
+        columns[empty] = np.nan
+        for j, measure in enumerate(measures):
+            df[measure] = columns[:, j]
+        return df
+
+    @synchronized
+    def trend(self, measure: str, edgeIDs: list[str] = None) -> pd.DataFrame:
+        """`measure` over all intervals: one row per interval begin, one
+        column per edge."""
+        owner = np.repeat(np.arange(len(self)), np.diff(self.rowOffsets))
+        values = self.values[:, self.measures.index(measure)] if measure in self.measures \
+            else np.full(len(self.edgeCodes), np.nan)
+        df = pd.DataFrame({
+            'begin': self.begins[owner],
+            'edgeID': np.array(self.edgeNames, dtype=object)[self.edgeCodes],
+            measure: values
+        })
+        if edgeIDs is not None:
+            df = df[df['edgeID'].isin(edgeIDs)]
+        return df.pivot_table(index='begin', columns='edgeID', values=measure,
+                              aggfunc='last', dropna=False)
+
+
+# dump file path -> KPIStore
+_kpiStores: dict[str, KPIStore] = {}
+_kpiStoresLock = threading.Lock()
+
+
+def get_kpi_store(dumpfile: str, full: bool = False) -> KPIStore:
+    """Return the time series of `dumpfile` up to its latest complete interval.
+
+    Only the intervals written since the last call are parsed, and a dump
+    seen for the first time is only read from its latest interval, unless
+    `full` asks for all of them. The new intervals of every call are saved
+    next to the dump as a segment in `<dumpfile>.kpi/`, so a new session
+    continues from where the last one stopped.
+    """
+    key = os.path.abspath(dumpfile)
+    with _kpiStoresLock:
+        store = _kpiStores.get(key)
+        if store is None:
+            store = KPIStore.empty(folder=f'{dumpfile}.kpi')
+            _kpiStores[key] = store
+    store.update(dumpfile, full)
+    return store
@@ -0,0 +1,214 @@
+import copyreg
+import gc
+import hashlib
+import io
+import importlib.metadata
+import os
+import pickle
+import sys
+import threading
+
+import sumolib
+
+from LLMAgent.stageTimer import timed_stage
+
+
+# 路网快照与路网文件放在一起，以文件内容的哈希校验，删除后会在下次使用时重新生成
+SNAPSHOT_VERSION = 2
+
+# lazily built caches of a sumolib Net, rebuilt by the Net after loading
+NET_CACHE_ATTRS = ('_rtreeEdges', '_rtreeLanes', '_shortestPathCache', '_routingCache', '_proj')
+
+# readNet options that differ from these defaults select another snapshot
+READNET_DEFAULTS = {
+    'withPrograms': False, 'withLatestPrograms': False, 'withConnections': True,
+    'withFoes': True, 'withPedestrianConnections': False, 'withMacroConnectors': False,
+}
+
+# file path -> ((mtime, size), sha1)
+_digests: dict[str, tuple[tuple[int, int], str]] = {}
+# (file path, readNet options) -> ((mtime, size), Net)
+_nets: dict[tuple, tuple[tuple[int, int], sumolib.net.Net]] = {}
+_netsLock = threading.Lock()
+
+
+def file_stamp(file: str) -> tuple[int, int]:
+    st = os.stat(file)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def file_digest(file: str) -> str:
+    """SHA-1 of the content of `file`, hashed again only when it changed."""
+    stamp = file_stamp(file)
+    key = os.path.abspath(file)
+    cached = _digests.get(key)
+    if cached is None or cached[0] != stamp:
+        sha1 = hashlib.sha1()
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        cached = (stamp, sha1.hexdigest())
+        _digests[key] = cached
+    return cached[1]
+
+
+def is_net_object(obj) -> bool:
+    return type(obj).__module__.startswith('sumolib.net')
+
+
+def net_objects(net: sumolib.net.Net) -> list:
+    """`net` and all nodes, edges, lanes, connections and programs
+    reachable from it, found without recursion."""
+    objects, seen, stack = [], set(), [net]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (str, bytes, int, float, type(None))):
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif is_net_object(obj):
+            objects.append(obj)
+            stack.extend(object_state(obj).values())
+    return objects
+
+
+def object_state(obj) -> dict:
+    if type(obj) is sumolib.net.Net:
+        # without its caches; the default edge type factory is a lambda
+        state = {k: v for k, v in obj.__dict__.items() if k not in NET_CACHE_ATTRS}
+        state['_edgeTypes'] = dict(obj._edgeTypes)
+        return state
+    return obj.__dict__
+
+
+def restore_state(obj, state: dict) -> None:
+    if type(obj) is sumolib.net.Net:
+        fresh = sumolib.net.Net()
+        fresh._edgeTypes.update(state.pop('_edgeTypes'))
+        obj.__dict__.update(fresh.__dict__)
+    obj.__dict__.update(state)
+
+
+class NetPickler(pickle.Pickler):
+    """Pickles the objects in `shells` without their state, so that the
+    states pickled after them refer to each other through the memo."""
+
+    def __init__(self, file, shells: set, **kwargs) -> None:
+        super().__init__(file, **kwargs)
+        self.shells = shells
+
+    def reducer_override(self, obj):
+        if id(obj) in self.shells:
+            return (copyreg.__newobj__, (type(obj),))
+        return NotImplemented
+
+
+def dump_snapshot(net: sumolib.net.Net) -> bytes:
+    # nodes, edges and connections reference each other, so pickling the
+    # Net directly recurses about as deep as the network is large; the
+    # objects and their states are pickled as two flat lists instead
+    objects = net_objects(net)
+    buf = io.BytesIO()
+    pickler = NetPickler(buf, {id(obj) for obj in objects}, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.dump((objects, [object_state(obj) for obj in objects]))
+    return buf.getvalue()
+
+
+def restore_snapshot(data: tuple) -> sumolib.net.Net:
+    objects, states = data
+    for obj, state in zip(objects, states):
+        restore_state(obj, state)
+    return objects[0]
+
+
+def save_snapshot(path: str, header: dict, net: sumolib.net.Net) -> None:
+    data = dump_snapshot(net)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(data)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    # 并行的进程可能同时写入，替换是原子的
+    os.replace(tmp, path)
+
+
+def load_snapshot(path: str, header: dict):
+    """Load a saved snapshot, or return None if it is missing or its header
+    (net file hash, options, versions) differs from `header`."""
+    try:
+        with open(path, 'rb') as f:
+            if pickle.load(f) != header:
+                return None
+            # the unpickled objects are all alive, collecting would only cost time
+            gcEnabled = gc.isenabled()
+            gc.disable()
+            try:
+                return restore_snapshot(pickle.load(f))
+            finally:
+                if gcEnabled:
+                    gc.enable()
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError, ValueError):
+        return None
+
+
+def sumolib_version() -> str:
+    # the pickled objects are only valid for the sumolib classes that wrote them
+    try:
+        return importlib.metadata.version('sumolib')
+    except importlib.metadata.PackageNotFoundError:
+        return sumolib.__file__
+
+
+def snapshot_header(file: str, options: dict) -> dict:
+    return {
+        'version': SNAPSHOT_VERSION,
+        'sha1': file_digest(file),
+        'options': options,
+        'sumolib': sumolib_version(),
+        'python': sys.version_info[:2],
+    }
+
+
+def snapshot_path(file: str, options: dict) -> str:
+    tag = '-'.join(k if v is True else f'{k}_{v}' for k, v in options.items()) or 'net'
+    return f'{file}.{tag}.snapshot'
+
+
+def get_net(file: str, **options) -> sumolib.net.Net:
+    """sumolib.net.readNet(file, **options), parsed once per net file.
+
+    The Net is kept in memory for the process and pickled next to the net
+    file as `<file>.<options>.snapshot`, which is checked against the SHA-1
+    of the file, so other processes and later sessions load it instead of
+    parsing the XML. The returned Net is shared and must not be modified.
+    """
+    # withInternal defaults to withPedestrianConnections
+    defaults = {**READNET_DEFAULTS, 'withInternal': options.get('withPedestrianConnections', False)}
+    options = {k: v for k, v in sorted(options.items()) if k not in defaults or v != defaults[k]}
+    stamp = file_stamp(file)
+    key = (os.path.abspath(file), tuple(options.items()))
+    with _netsLock:
+        cached = _nets.get(key)
+        if cached is None or cached[0] != stamp:
+            with timed_stage('parse net'):
+                header = snapshot_header(file, options)
+                path = snapshot_path(file, options)
+                net = load_snapshot(path, header)
+                if net is None:
+                    net = sumolib.net.readNet(file, **options)
+                    try:
+                        save_snapshot(path, header, net)
+                    except Exception:
+                        # 无法写入或序列化时只在进程内保留
+                        pass
+            cached = (stamp, net)
+            _nets[key] = cached
+    return cached[1]
@@ -0,0 +1,100 @@
+import weakref
+
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba, to_rgba_array
+
+
+class NetShapes:
+    """The edge shapes of a network packed into one coordinate array.
+
+    The points of edge `i` are `coords[offsets[i]:offsets[i + 1]]`; `index`
+    maps edge IDs to `i`, in the order of `net._edges` like sumolib's plotNet.
+    """
+
+    def __init__(self, edgeIDs: list[str], shapes: list) -> None:
+        self.edgeIDs = edgeIDs
+        self.index = {eid: i for i, eid in enumerate(edgeIDs)}
+        lengths = np.fromiter((len(s) for s in shapes), dtype=np.int64, count=len(shapes))
+        self.offsets = np.zeros(len(shapes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        if shapes:
+            self.coords = np.concatenate(
+                [np.asarray(s, dtype=float)[:, :2] for s in shapes])
+        else:
+            self.coords = np.zeros((0, 2))
+        self.segments = np.split(self.coords, self.offsets[1:-1])
+
+    def __len__(self) -> int:
+        return len(self.edgeIDs)
+
+    def values(self, mapping: dict, default=np.nan) -> np.ndarray:
+        """Per-edge array of `mapping[edgeID]`, `default` for missing edges."""
+        out = np.full(len(self), default, dtype=float)
+        for eid, v in mapping.items():
+            i = self.index.get(eid)
+            if i is not None:
+                out[i] = v
+        return out
+
+
+_netShapes = weakref.WeakKeyDictionary()
+
+
+def get_net_shapes(net) -> NetShapes:
+    shapes = _netShapes.get(net)
+    if shapes is None:
+        shapes = NetShapes([e.getID() for e in net._edges],
+                           [e.getShape() for e in net._edges])
+        _netShapes[net] = shapes
+    return shapes
+
+
+def plot_net(net, colors, widths, options, ax=None) -> LineCollection:
+    """Draw all edges as a single LineCollection.
+
+    `colors` is an (n, 4) RGBA array in edge order or a dict edgeID -> color,
+    `widths` an array (NaN for the default width) or a dict edgeID -> width.
+    """
+    shapes = get_net_shapes(net)
+    if isinstance(colors, dict):
+        rgba = np.tile(to_rgba(options.defaultColor), (len(shapes), 1))
+        for eid, c in colors.items():
+            i = shapes.index.get(eid)
+            if i is not None:
+                rgba[i] = to_rgba(c)
+    else:
+        rgba = colors
+    if isinstance(widths, dict):
+        widths = shapes.values(widths)
+    widths = np.where(np.isnan(widths), options.defaultWidth, widths)
+
+    line_segments = LineCollection(
+        shapes.segments, linewidths=widths, colors=rgba, linestyles=options.linestyle)
+    ax = ax or plt.gca()
+    ax.add_collection(line_segments)
+    ax.set_xmargin(0.1)
+    ax.set_ymargin(0.1)
+    ax.autoscale_view(True, True, True)
+    return line_segments
+
+
+def lin_normalise(values: np.ndarray, minValue, maxValue) -> np.ndarray:
+    # same as sumolib.visualization.helpers.linNormalise on an array
+    if minValue is None or maxValue is None:
+        return values
+    valRange = maxValue - minValue
+    if valRange == 0:
+        valRange = 1
+    return (values - minValue) / valRange
+
+
+def map_colors(values: np.ndarray, options) -> np.ndarray:
+    """RGBA of the normalised `values`, the default color where NaN."""
+    rgba = np.tile(to_rgba(options.defaultColor), (len(values), 1))
+    valid = ~np.isnan(values)
+    cmap = matplotlib.cm.get_cmap(options.colormap)
+    rgba[valid] = to_rgba_array(cmap(values[valid]))
+    return rgba
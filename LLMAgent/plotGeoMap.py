@@ -1,30 +1,49 @@
 import geopandas as gpd
+import pandas as pd
 import matplotlib
-matplotlib.use('TkAgg')
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 from matplotlib.colorbar import ColorbarBase
-import sqlalchemy as sa
-import yaml
 
+from LLMAgent.baseMap import draw_base_map, pad_extent
+from LLMAgent.dbConnector import get_engine, fetch_query
+from LLMAgent.queryRegistry import prepare_query, timed_query
+from LLMAgent.renderProfile import pyplot_locked, render_dpi, save_figure
+from LLMAgent.resultCache import RESULT_CACHE
+from LLMAgent.roadGeometry import get_road_geometry
+from LLMAgent.volumeRollup import plan_volume_query
 
-def plot_geo_heatmap(query,figfolder):
-    
-    # 读取配置文件
-    with open("dbconfig.yaml", "r") as f:
-        config = yaml.safe_load(f)
-
-    # 连接到PostgreSQL数据库
-    db_uri = f"postgresql://{config['username']}:{config['password']}@{config['host']}:{config['port']}/{config['db_name']}"
-    engine = sa.create_engine(db_uri)
-    conn = engine.connect()
-    query_obj = sa.text(query)
-    
-    # 获取几何数据和交通流量数据
-    gdf = gpd.GeoDataFrame.from_postgis(query_obj, conn, geom_col='geom')
 
-    # 关闭数据库连接
-    conn.close()
+def read_geo_query(conn, name, params=None):
+    # 以预编译语句执行具名查询，读取几何数据；相同参数的结果从缓存读取
+    def run(params):
+        with timed_query(name):
+            return gpd.GeoDataFrame.from_postgis(
+                prepare_query(conn, name), conn, geom_col='geom', params=params)
+
+    return RESULT_CACHE.get_or_run(name, params, run).copy()
+
+
+# 报告输出的分辨率
+FULL_DPI = 800
+
+
+def draw_road_base_map(ax, roads, dpi):
+    # 灰色路网底图对每次请求都相同，从缓存的栅格图绘制
+    extent = pad_extent(roads.total_bounds, 0.05)
+    return draw_base_map(ax, ('topo_centerroad', len(roads)),
+                  lambda base_ax: roads['geom'].plot(ax=base_ax, color='grey'),
+                  extent, 'grey', dpi)
+
+
+@pyplot_locked
+def plot_geo_heatmap(begin, end, figfolder, profile=None):
+    
+    # 只从数据库读取交通流量数据，在本地与道路几何连接
+    rows = fetch_query(*plan_volume_query('road_volume_all', begin, end))
+    volume = pd.DataFrame(rows, columns=['road_id', 'volume'])
+    gdf = get_road_geometry().merge(volume, on='road_id')
 
     # 创建渐变颜色映射和线条宽度映射
     colors = [(0, 1, 0), (1, 1, 0), (1, 0, 0)]  # 绿-黄-红的渐变色
@@ -32,7 +51,8 @@ def plot_geo_heatmap(query,figfolder):
     volume_normalized = (gdf['volume'] - gdf['volume'].min()) / (gdf['volume'].max() - gdf['volume'].min())
 
     # 设置绘图参数
-    fig, ax = plt.subplots(figsize=(8, 6), dpi=800)
+    dpi = render_dpi(FULL_DPI, profile)
+    fig, ax = plt.subplots(figsize=(8, 6), dpi=dpi)
     ax.set_aspect('equal')
 
     # 绘制地图，根据交通流量数据设置颜色和线条宽度
@@ -54,115 +74,62 @@ def plot_geo_heatmap(query,figfolder):
     ax.set_axis_off()
 
     # 输出热力图
-    fig_path = f'{figfolder}heatmap.png'
-    fig.savefig(fig_path, dpi=800)
+    fig_path = save_figure(fig, f'{figfolder}heatmap', FULL_DPI, profile)
     return fig_path
 
 
-def plot_road_segements(road_ids,figfolder):
+@pyplot_locked
+def plot_road_segements(road_ids,figfolder, profile=None):
     
-    # 读取配置文件
-    with open("dbconfig.yaml", "r") as f:
-        config = yaml.safe_load(f)
-
-    # 连接到PostgreSQL数据库
-    db_uri = f"postgresql://{config['username']}:{config['password']}@{config['host']}:{config['port']}/{config['db_name']}"
-    engine = sa.create_engine(db_uri)
-    conn = engine.connect()
-
-    # 获取几何数据和路名id
-    query1 = "SELECT mc, objectid, geom FROM topo_centerroad"
-    query1_obj = sa.text(query1)
-    gdf1 = gpd.GeoDataFrame.from_postgis(query1_obj, conn, geom_col='geom')
-
-    query2 = f"SELECT mc, objectid, geom FROM topo_centerroad WHERE objectid IN ({road_ids})"
-    query2_obj = sa.text(query2)
-    gdf2 = gpd.GeoDataFrame.from_postgis(query2_obj, conn, geom_col='geom')
-
-    # 关闭数据库连接
-    conn.close()
+    # 从本地快照获取几何数据和路名id
+    gdf1 = get_road_geometry()
+    gdf2 = gdf1[gdf1['objectid'].isin([int(road) for road in road_ids.split(',')])]
 
     # 设置参数
     annotation_params = {'fontsize': 8, 'color': 'black', 'fontname':'Times New Roman', 'weight':'bold'}  # 标注文本的参数
-    fig, ax = plt.subplots(figsize=(8, 6), dpi=800)
+    dpi = render_dpi(FULL_DPI, profile)
+    fig, ax = plt.subplots(figsize=(8, 6), dpi=dpi)
 
     # 绘制地图，根据颜色数据设置颜色
-    ax = gdf1['geom'].plot(ax=ax,color= 'grey')
+    draw_road_base_map(ax, gdf1, dpi)
     ax = gdf2['geom'].plot(ax=ax,color= 'red')
 
     # 标注每条路的id
     for idx, row in gdf2.iterrows():
         ax.text(row['geom'].centroid.x, row['geom'].centroid.y, int(row['objectid']), **annotation_params)
 
-    fig_path = f'{figfolder}roads.png'
-    fig.savefig(fig_path, dpi=800)
+    fig_path = save_figure(fig, f'{figfolder}roads', FULL_DPI, profile)
     return fig_path
 
-def plot_OD_map(begin, end, figfolder):
+@pyplot_locked
+def plot_OD_map(begin, end, figfolder, profile=None):
 
-    # 读取配置文件
-    with open("dbconfig.yaml", "r") as f:
-        config = yaml.safe_load(f)
-
-    # 连接到PostgreSQL数据库
-    db_uri = f"postgresql://{config['username']}:{config['password']}@{config['host']}:{config['port']}/{config['db_name']}"
-    engine = sa.create_engine(db_uri)
-    conn = engine.connect()
+    # 从连接池获取数据库连接
+    conn = get_engine().connect()
 
     # 获取OD数据
-    query1 = f"""
-    SELECT o_zone, d_zone, od_pair_count, ST_MakeLine(ST_MakePoint(ozone_long, ozone_lat), ST_MakePoint(dzone_long, dzone_lat)) AS geom 
-    from (
-            SELECT
-                o_zone,
-                d_zone,
-                od_pair_count,
-                ozone_info.longitude AS ozone_long,
-                ozone_info.latitude AS ozone_lat,
-                dzone_info.longitude AS dzone_long,
-                dzone_info.latitude AS dzone_lat
-            FROM
-                (
-                    SELECT
-                        o_zone,
-                        d_zone,
-                        od_pair_count
-                    FROM
-                        (SELECT o_zone, d_zone, COUNT(*) AS od_pair_count
-                                    FROM the_synthetic_individual_level_trip_dataset
-                                    WHERE departure_time >= '{begin}' AND departure_time < '{end}'
-                                    GROUP BY o_zone, d_zone
-                                    ORDER BY od_pair_count DESC) as od_pair_count
-                ) AS od
-            JOIN
-                zone_roads AS ozone_info ON od.o_zone = ozone_info.zone_id
-            JOIN
-                zone_roads AS dzone_info ON od.d_zone = dzone_info.zone_id
-            ) as OD_volume;
-    """
-    query1_obj = sa.text(query1)
-    gdf1 = gpd.GeoDataFrame.from_postgis(query1_obj, conn, geom_col='geom')
-
-    # 获取地图数据
-    query2 = "SELECT mc, objectid, geom FROM topo_centerroad"
-    query2_obj = sa.text(query2)
-    gdf2 = gpd.GeoDataFrame.from_postgis(query2_obj, conn, geom_col='geom')
+    gdf1 = read_geo_query(conn, *plan_volume_query('od_lines', begin, end))
 
     # 关闭数据库连接
     conn.close()
 
+    # 获取地图数据
+    gdf2 = get_road_geometry()
+
     # 创建渐变颜色映射（绿-黄-红）
     colors = [(0, 1, 0), (1, 1, 0), (1, 0, 0)]  # 绿-黄-红的渐变色
     cmap = LinearSegmentedColormap.from_list('custom_cmap', colors, N=100)
     volume_normalized = (gdf1['od_pair_count'] - gdf1['od_pair_count'].min()) / (gdf1['od_pair_count'].max() - gdf1['od_pair_count'].min())
 
     # 设置绘图参数
-    fig, ax = plt.subplots(figsize=(8, 6), dpi=800)
+    dpi = render_dpi(FULL_DPI, profile)
+    fig, ax = plt.subplots(figsize=(8, 6), dpi=dpi)
     ax.set_aspect('equal')
 
     # 绘制地图，根据交通流量数据设置颜色和线条宽度
+    aspect = draw_road_base_map(ax, gdf2, dpi)
     gdf1['geom'].plot(ax=ax, cmap=cmap, linewidth=volume_normalized*5)
-    gdf2['geom'].plot(ax=ax,color= 'grey')
+    ax.set_aspect(aspect)
 
     cax_position = [0.08, 0.25, 0.02, 0.5]
     norm = plt.Normalize(gdf1['od_pair_count'].min(), gdf1['od_pair_count'].max())
@@ -178,6 +145,5 @@ def plot_OD_map(begin, end, figfolder):
 
     ax.set_axis_off()
 
-    fig_path = f'{figfolder}ODmap.png'
-    fig.savefig(fig_path, dpi=800)
+    fig_path = save_figure(fig, f'{figfolder}ODmap', FULL_DPI, profile)
     return fig_path
@@ -3,7 +3,6 @@ from __future__ import print_function
 
 import os
 import sys
-from xml.sax.handler import ContentHandler
 
 import matplotlib
 matplotlib.use('Agg')
@@ -13,29 +12,26 @@ from sumolib.visualization import helpers  # noqa
 import matplotlib.pyplot as plt  # noqa
 import matplotlib  # noqa
 
-class WeightsReader(ContentHandler):
+import numpy as np  # noqa
 
-    """Reads the dump file"""
+from LLMAgent.kpiStore import get_kpi_store  # noqa
+from LLMAgent.netRenderer import get_net_shapes, plot_net, lin_normalise, map_colors  # noqa
+from LLMAgent.renderProfile import pyplot_locked, save_figure  # noqa
+from LLMAgent.netCache import get_net  # noqa
 
-    def __init__(self, value):
-        super().__init__()
-        self._edge2value = {}
-        self._value = value
-        self._intervals = []
 
-    def startElement(self, name, attrs):
-        if name == 'interval':
-            self._time = float(attrs['begin'])
-            self._edge2value[self._time] = {}
-            self._intervals.append(self._time)
+def log_normalise(values: np.ndarray, maxValue) -> np.ndarray:
+    # sumolib's logNormalise works on a dict of the edges with data
+    valid = np.flatnonzero(~np.isnan(values))
+    byEdge = {i: values[i] for i in valid}
+    helpers.logNormalise(byEdge, maxValue)
+    values = values.copy()
+    values[valid] = [byEdge[i] for i in valid]
+    return values
 
-        elif name == 'edge':
-            id = attrs['id']
-            if self._value in attrs:
-                self._edge2value[self._time][id] = float(
-                    attrs[self._value])
 
-def plot_heatmap(figfolder, args=None) -> str:
+@pyplot_locked
+def plot_heatmap(figfolder, args=None, profile=None) -> str:
     """The main function; parses options and plots"""
     # ---------- build and read options ----------
     ap = sumolib.options.ArgumentParser()
@@ -72,6 +68,8 @@ def plot_heatmap(figfolder, args=None) -> str:
                     help="The label to put on the color bar")
     ap.add_option("--internal", action="store_true",
                     default=False, help="include internal edges in generated shapes")
+    ap.add_option("--interval-begin", dest="intervalBegin", type=float, default=None,
+                    help="If set, plot the interval beginning at this time instead of the last one")
 
     # standard plot options
     matplotlib.use('Agg')
@@ -93,7 +91,7 @@ def plot_heatmap(figfolder, args=None) -> str:
         return 1
     if options.verbose:
         print("Reading network from '%s'" % options.net)
-    net = sumolib.net.readNet(options.net, withInternal=options.internal)
+    net = get_net(options.net, withInternal=options.internal)
 
     if options.measures is None:
         print("Error: a dump file must be given.")
@@ -108,9 +106,8 @@ def plot_heatmap(figfolder, args=None) -> str:
         if options.verbose:
             print("Reading colors from '%s' (attribute:%s)" %
                     (colorDump, colorMeasure))
-        hc = WeightsReader(colorMeasure)
-        sumolib.output.parse_sax(colorDump, hc)
-        times = hc._edge2value
+        hc = get_kpi_store(colorDump, full=options.intervalBegin is not None)
+        times = hc.begins
 
     hw = None
     if len(dumps) > 1:
@@ -119,9 +116,8 @@ def plot_heatmap(figfolder, args=None) -> str:
         if options.verbose:
             print("Reading width attribute from '%s' (attribute:%s)" %
                     (widthDump, widthMeasure))
-        hw = WeightsReader(widthMeasure)
-        sumolib.output.parse_sax(widthDump, hw)
-        times = hw._edge2value
+        hw = get_kpi_store(widthDump, full=options.intervalBegin is not None)
+        times = hw.begins
 
     # Should we also save the figure to a file / list of files (comma
     # separated)? Then we need to check the output filename(s)
@@ -146,72 +142,69 @@ def plot_heatmap(figfolder, args=None) -> str:
 
     # Now go through each time interval and create the figures
     t = max(times)  # Draw last interval only
+    if options.intervalBegin is not None:
+        t = options.intervalBegin
     # for t in times:
     if options.verbose:
         print("Processing interval with a beginning of %s" % t)
-    colors = {}
-    maxColorValue = None
-    minColorValue = None
-    for e in net._id2edge:
-        if hc and t in hc._edge2value and e in hc._edge2value[t]:
-            if options.colorMax is not None and hc._edge2value[t][e] > options.colorMax:
-                hc._edge2value[t][e] = options.colorMax
-            if options.colorMin is not None and hc._edge2value[t][e] < options.colorMin:
-                hc._edge2value[t][e] = options.colorMin
-            if maxColorValue is None or maxColorValue < hc._edge2value[t][e]:
-                maxColorValue = hc._edge2value[t][e]
-            if minColorValue is None or minColorValue > hc._edge2value[t][e]:
-                minColorValue = hc._edge2value[t][e]
-            colors[e] = hc._edge2value[t][e]
+    # per-edge arrays in the order of the network's edges, NaN without data
+    shapes = get_net_shapes(net)
+    colors = np.full(len(shapes), np.nan)
+    if hc is not None:
+        colors = shapes.values(hc.measure_values(hc.find_interval(t), colorMeasure))
+    if options.colorMax is not None:
+        colors = np.minimum(colors, options.colorMax)
+    if options.colorMin is not None:
+        colors = np.maximum(colors, options.colorMin)
+    hasColors = not np.isnan(colors).all()
+    maxColorValue = np.nanmax(colors) if hasColors else None
+    minColorValue = np.nanmin(colors) if hasColors else None
     if options.colorMax is not None:
         maxColorValue = options.colorMax
     if options.colorMin is not None:
         minColorValue = options.colorMin
     if options.logColors:
-        helpers.logNormalise(colors, maxColorValue)
+        colors = log_normalise(colors, maxColorValue)
+    else:
+        colors = lin_normalise(colors, minColorValue, maxColorValue)
+    if options.colors or options.colormap[0] == '#' or getattr(options, 'colormapCenter', None):
+        # discrete or custom colors are resolved by sumolib one edge at a time
+        colors = {shapes.edgeIDs[i]: helpers.getColor(options, colors[i], 1.)
+                  for i in np.flatnonzero(~np.isnan(colors))}
     else:
-        helpers.linNormalise(colors, minColorValue, maxColorValue)
-    for e in colors:
-        colors[e] = helpers.getColor(options, colors[e], 1.)
+        colors = map_colors(colors, options)
     if options.verbose:
         print("Color values are between %s and %s" %
                 (minColorValue, maxColorValue))
 
-    widths = {}
-    maxWidthValue = None
-    minWidthValue = None
-    for e in net._id2edge:
-        if hw and t in hw._edge2value and e in hw._edge2value[t]:
-            v = abs(hw._edge2value[t][e])
-            if options.widthMax is not None and v > options.widthMax:
-                v = options.widthMax
-            if options.widthMin is not None and v < options.widthMin:
-                v = options.widthMin
-            if maxWidthValue is None or maxWidthValue < v:
-                maxWidthValue = v
-            if minWidthValue is None or minWidthValue > v:
-                minWidthValue = v
-            widths[e] = v
+    widths = np.full(len(shapes), np.nan)
+    if hw is not None:
+        widths = np.abs(shapes.values(hw.measure_values(hw.find_interval(t), widthMeasure)))
+    if options.widthMax is not None:
+        widths = np.minimum(widths, options.widthMax)
+    if options.widthMin is not None:
+        widths = np.maximum(widths, options.widthMin)
+    hasWidths = not np.isnan(widths).all()
+    maxWidthValue = np.nanmax(widths) if hasWidths else None
+    minWidthValue = np.nanmin(widths) if hasWidths else None
     if options.widthMax is not None:
         maxWidthValue = options.widthMax
     if options.widthMin is not None:
         minWidthValue = options.widthMin
     if options.logWidths:
-        helpers.logNormalise(widths, options.colorMax)
+        widths = log_normalise(widths, options.colorMax)
     else:
-        helpers.linNormalise(widths, minWidthValue, maxWidthValue)
-    for e in widths:
-        widths[e] = options.minWidth + widths[e] * \
-            (options.maxWidth - options.minWidth)
+        widths = lin_normalise(widths, minWidthValue, maxWidthValue)
+    widths = options.minWidth + widths * (options.maxWidth - options.minWidth)
     if options.verbose:
         print("Width values are between %s and %s" %
                 (minWidthValue, maxWidthValue))
-    if hw and (minWidthValue is None or maxWidthValue is None):
+    if hw is not None and (minWidthValue is None or maxWidthValue is None):
         print("Skipping interval %s without data" % t)
 
     fig, ax = helpers.openFigure(options)
     ax.set_aspect("equal", None, 'C')
-    helpers.plotNet(net, colors, widths, options)
+    plot_net(net, colors, widths, options)
 
     # drawing the legend, at least for the colors
     norm = matplotlib.colors.LogNorm if options.logColors else matplotlib.colors.Normalize
@@ -228,8 +221,7 @@ def plot_heatmap(figfolder, args=None) -> str:
     # Should we also save the figure to a file / list of files (comma
     # separated)?
 
-    fig_path = f'{figfolder}heatmap_{int(t)}.png'
-    fig.savefig(fig_path, dpi=1600)
+    fig_path = save_figure(fig, f'{figfolder}heatmap_{int(t)}', 1600, profile)
     expandedOutputNames = None
     if options.output:
 
@@ -12,7 +12,12 @@ from sumolib.visualization import helpers  # noqa
 from sumolib.options import ArgumentParser  # noqa
 import matplotlib.pyplot as plt  # noqa
 
-def plot_intersections(target_junction_id, folderpath, args=None) -> str:
+from LLMAgent.netRenderer import plot_net  # noqa
+from LLMAgent.renderProfile import pyplot_locked, save_figure  # noqa
+from LLMAgent.netCache import get_net  # noqa
+
+@pyplot_locked
+def plot_intersections(target_junction_id, folderpath, args=None, profile=None) -> str:
     """The main function; parses options and plots"""
     # ---------- build and read options ----------
     ap = ArgumentParser()
@@ -36,7 +41,7 @@ def plot_intersections(target_junction_id, folderpath, args=None) -> str:
 
     if options.verbose:
         print("Reading network from '%s'" % options.net)
-    net = sumolib.net.readNet(options.net)
+    net = get_net(options.net)
 
     tlsn = {}
     for tid in net._id2tls:
@@ -66,15 +71,14 @@ def plot_intersections(target_junction_id, folderpath, args=None) -> str:
 
     fig, ax = helpers.openFigure(options)
     ax.set_aspect("equal", None, 'C')
-    helpers.plotNet(net, {}, {}, options)
+    plot_net(net, {}, {}, options)
     plt.plot(tlspX, tlspY, options.color, linestyle='',
                 marker='o', markersize=options.width)
     for i in range(len(junctionID)):
         plt.text(tlspX[i]*1.01, tlspY[i]*1.01, str(junctionID[i]), fontsize=10, color = "r", style = "italic", weight = "light", verticalalignment='center', horizontalalignment='right',rotation=0) #给散点加标签
 
     options.nolegend = True
-    fig_path = f'{folderpath}intersections.png'
-    fig.savefig(fig_path, dpi=1600)
+    fig_path = save_figure(fig, f'{folderpath}intersections', 1600, profile)
     helpers.closeFigure(fig, ax, options)
 
     return fig_path
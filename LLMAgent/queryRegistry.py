@@ -0,0 +1,213 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import sqlalchemy as sa
+
+
+# 按 volumeRollup.plan_window 的时间段组合日汇总、小时汇总与原始出行数据
+ROAD_ROLLUP = """
+        select road, road_count from road_volume_per_day
+        where day_start >= :day_begin AND day_start < :day_end
+        union all
+        select road, road_count from road_volume_per_hour
+        where (hour_start >= :head_begin AND hour_start < :head_end)
+           OR (hour_start >= :tail_begin AND hour_start < :tail_end)
+        """
+
+OD_ROLLUP = """
+        select o_zone, d_zone, od_count from od_volume_per_day
+        where day_start >= :day_begin AND day_start < :day_end
+        union all
+        select o_zone, d_zone, od_count from od_volume_per_hour
+        where (hour_start >= :head_begin AND hour_start < :head_end)
+           OR (hour_start >= :tail_begin AND hour_start < :tail_end)
+        union all
+        select o_zone, d_zone, 1 from the_synthetic_individual_level_trip_dataset
+        where (departure_time >= :raw_head_begin AND departure_time < :raw_head_end)
+           OR (departure_time >= :raw_tail_begin AND departure_time < :raw_tail_end)
+        """
+
+# 数据工具使用的全部具名参数化查询，参数写作 :name
+QUERIES = {
+    'road_volume_trend': """
+        select date_trunc('hour', departure_time) as hours, count(*) as volume
+        from the_synthetic_individual_level_trip_dataset
+        where path similar to :path_pattern AND extract(day from departure_time) = :day
+        group by hours
+        order by hours;
+        """,
+    'road_volume_trend_indexed': """
+        select hour_start as hours, count(distinct trip_id) as volume
+        from road_trip_index
+        where road = ANY(:road_ids) AND extract(day from hour_start) = :day
+        group by hours
+        order by hours;
+        """,
+    'road_volume_top': """
+        select road as road_id, SUM(road_count) as volume
+        from road_volume_per_hour
+        WHERE hour_start >= :begin AND hour_start < :end
+        group by road_id
+        ORDER BY volume DESC
+        LIMIT :limit;
+        """,
+    'road_volume_all': """
+        select road as road_id, SUM(road_count) as volume
+        from road_volume_per_hour
+        WHERE hour_start >= :begin AND hour_start < :end
+        group by road_id
+        ORDER BY volume DESC
+        """,
+    'road_volume_by_ids': """
+        select road as road_id, SUM(road_count) as volume
+        from road_volume_per_hour
+        WHERE hour_start >= :begin AND hour_start < :end AND road = ANY(:road_ids)
+        group by road_id
+        ORDER BY volume DESC
+        """,
+    'road_id_by_name': """
+        select objectid,mc
+        from topo_centerroad
+        where mc = :road_name
+        """,
+    'od_volume_top': """
+        SELECT o_zone, d_zone, COUNT(*) AS od_pair_volume
+        FROM the_synthetic_individual_level_trip_dataset
+        WHERE departure_time >= :begin AND departure_time < :end
+        GROUP BY o_zone, d_zone
+        ORDER BY od_pair_volume DESC
+        LIMIT :limit;
+        """,
+    'road_geometry_all': """
+        SELECT mc, objectid, geom FROM topo_centerroad
+        """,
+    'od_lines': """
+        SELECT o_zone, d_zone, od_pair_count, ST_MakeLine(ST_MakePoint(ozone_long, ozone_lat), ST_MakePoint(dzone_long, dzone_lat)) AS geom
+        from (
+                SELECT
+                    o_zone,
+                    d_zone,
+                    od_pair_count,
+                    ozone_info.longitude AS ozone_long,
+                    ozone_info.latitude AS ozone_lat,
+                    dzone_info.longitude AS dzone_long,
+                    dzone_info.latitude AS dzone_lat
+                FROM
+                    (
+                        SELECT
+                            o_zone,
+                            d_zone,
+                            od_pair_count
+                        FROM
+                            (SELECT o_zone, d_zone, COUNT(*) AS od_pair_count
+                                        FROM the_synthetic_individual_level_trip_dataset
+                                        WHERE departure_time >= :begin AND departure_time < :end
+                                        GROUP BY o_zone, d_zone
+                                        ORDER BY od_pair_count DESC) as od_pair_count
+                    ) AS od
+                JOIN
+                    zone_roads AS ozone_info ON od.o_zone = ozone_info.zone_id
+                JOIN
+                    zone_roads AS dzone_info ON od.d_zone = dzone_info.zone_id
+                ) as OD_volume;
+        """,
+    'road_volume_top_rollup': f"""
+        select road as road_id, SUM(road_count)::bigint as volume
+        from ({ROAD_ROLLUP}) as rollup
+        group by road_id
+        ORDER BY volume DESC
+        LIMIT :limit;
+        """,
+    'road_volume_all_rollup': f"""
+        select road as road_id, SUM(road_count)::bigint as volume
+        from ({ROAD_ROLLUP}) as rollup
+        group by road_id
+        ORDER BY volume DESC
+        """,
+    'road_volume_by_ids_rollup': f"""
+        select road as road_id, SUM(road_count)::bigint as volume
+        from ({ROAD_ROLLUP}) as rollup
+        WHERE road = ANY(:road_ids)
+        group by road_id
+        ORDER BY volume DESC
+        """,
+    'od_volume_top_rollup': f"""
+        SELECT o_zone, d_zone, SUM(od_count)::bigint AS od_pair_volume
+        FROM ({OD_ROLLUP}) as rollup
+        GROUP BY o_zone, d_zone
+        ORDER BY od_pair_volume DESC
+        LIMIT :limit;
+        """,
+}
+QUERIES['od_lines_rollup'] = QUERIES['od_lines'].replace(
+    """SELECT o_zone, d_zone, COUNT(*) AS od_pair_count
+                                        FROM the_synthetic_individual_level_trip_dataset
+                                        WHERE departure_time >= :begin AND departure_time < :end""",
+    f"""SELECT o_zone, d_zone, SUM(od_count)::bigint AS od_pair_count
+                                        FROM ({OD_ROLLUP}) as rollup""")
+
+# :name, but not the ::type casts of PostgreSQL
+PARAM_PATTERN = re.compile(r'(?<![:\w]):(\w+)')
+
+
+def get_param_names(name: str) -> list[str]:
+    params = []
+    for p in PARAM_PATTERN.findall(QUERIES[name]):
+        if p not in params:
+            params.append(p)
+    return params
+
+
+def prepare_query(conn: sa.engine.Connection, name: str) -> str:
+    """PREPARE the query on this connection once and return the EXECUTE
+    statement with pyformat placeholders for exec_driver_sql/read_sql."""
+    params = get_param_names(name)
+    prepared = conn.connection.info.setdefault('prepared_queries', set())
+    if name not in prepared:
+        sql = PARAM_PATTERN.sub(
+            lambda m: f'${params.index(m.group(1)) + 1}', QUERIES[name])
+        # no_parameters: a literal % in the SQL is not a placeholder here
+        conn.execution_options(no_parameters=True).exec_driver_sql(
+            f'PREPARE {name} AS {sql.strip().rstrip(";")}')
+        prepared.add(name)
+    if not params:
+        return f'EXECUTE {name}'
+    return f'EXECUTE {name}(' + ', '.join(f'%({p})s' for p in params) + ')'
+
+
+def execute_query(conn: sa.engine.Connection, name: str, params: dict = None):
+    params = params or {}
+    if conn.dialect.name != 'postgresql':
+        return conn.execute(sa.text(QUERIES[name]), params)
+    return conn.exec_driver_sql(prepare_query(conn, name), params)
+
+
+# 每个查询的调用次数与耗时统计
+_queryStats: dict[str, list] = {}
+_statsLock = threading.Lock()
+
+
+@contextmanager
+def timed_query(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _statsLock:
+            stats = _queryStats.setdefault(name, [0, 0., 0.])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+
+def get_query_stats() -> pd.DataFrame:
+    with _statsLock:
+        rows = [[name, n, total, total / n, longest]
+                for name, (n, total, longest) in _queryStats.items()]
+    return pd.DataFrame(
+        rows, columns=['query', 'calls', 'total_s', 'mean_s', 'max_s']
+    ).sort_values('total_s', ascending=False).reset_index(drop=True)
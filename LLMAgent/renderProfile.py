@@ -0,0 +1,85 @@
+import functools
+import threading
+
+from LLMAgent.stageTimer import timed_stage
+
+
+# 图片输出配置：对话中使用快速预览，只有需要报告时才输出全分辨率图片
+# dpi 为 None 时使用各绘图函数原有的分辨率
+RENDER_PROFILES = {
+    'preview': {'dpi': 200, 'format': 'png', 'compress_level': 1},
+    'report': {'dpi': None, 'format': 'png', 'compress_level': 6},
+}
+FORMATS = ('png', 'webp', 'svg')
+DEFAULT_PROFILE = 'preview'
+
+_defaultProfile = DEFAULT_PROFILE
+_profilesLock = threading.Lock()
+
+# pyplot 的当前图与当前坐标轴是全局的，并行运行的工具需要依次绘图
+PYPLOT_LOCK = threading.RLock()
+
+
+def pyplot_locked(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with PYPLOT_LOCK, timed_stage(f'render {func.__name__}'):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def get_render_profile(profile: str = None) -> dict:
+    name = profile or _defaultProfile
+    if name not in RENDER_PROFILES:
+        raise ValueError(
+            f"unknown render profile '{name}', choose from {', '.join(RENDER_PROFILES)}")
+    return RENDER_PROFILES[name]
+
+
+def configure_render_profiles(config: dict) -> None:
+    """Apply the optional RENDER_PROFILE (the default profile name) and
+    RENDER_PROFILES (settings merged into the presets) keys of config.yaml."""
+    global _defaultProfile
+    with _profilesLock:
+        for name, settings in (config.get('RENDER_PROFILES') or {}).items():
+            settings = {**RENDER_PROFILES.get(name, RENDER_PROFILES[DEFAULT_PROFILE]), **settings}
+            if settings['format'].lower() not in FORMATS:
+                raise ValueError(
+                    f"unsupported figure format '{settings['format']}' in render profile '{name}'")
+            RENDER_PROFILES[name] = settings
+        profile = config.get('RENDER_PROFILE', DEFAULT_PROFILE)
+        get_render_profile(profile)
+        _defaultProfile = profile
+
+
+def split_profile(inputs: str) -> tuple[str, str]:
+    """Strip an optional trailing ';<profile>' from a tool input, e.g.
+    '1076,30188;report'. Returns the input and the profile name or None."""
+    head, sep, last = inputs.rpartition(';')
+    name = last.strip().lower()
+    if sep and name in RENDER_PROFILES:
+        return head, name
+    return inputs, None
+
+
+def render_dpi(full_dpi: float, profile: str = None) -> float:
+    return get_render_profile(profile)['dpi'] or full_dpi
+
+
+def save_figure(fig, basepath: str, full_dpi: float, profile: str = None) -> str:
+    """Save `fig` as `basepath` plus the extension of the profile's format.
+
+    `full_dpi` is the resolution of the report output; PNG and WebP are
+    written with the profile's compress_level and quality.
+    """
+    settings = get_render_profile(profile)
+    fmt = settings['format'].lower()
+    kwargs = {}
+    if fmt == 'png':
+        kwargs['pil_kwargs'] = {'compress_level': settings.get('compress_level', 6)}
+    elif fmt == 'webp':
+        kwargs['pil_kwargs'] = {'quality': settings.get('quality', 80)}
+    fig_path = f'{basepath}.{fmt}'
+    fig.savefig(fig_path, dpi=render_dpi(full_dpi, profile), format=fmt, **kwargs)
+    return fig_path
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chat_models.base import SimpleChatModel
+from langchain.schema import LLMResult
+from langchain.schema.messages import BaseMessage
+
+
+# 用录制的 ReAct 对话代替 LLM，离线、可重复地运行对话模型和工具
+PROMPT_END = 'Begin!"'
+
+
+def load_transcript(path: str) -> dict:
+    """A transcript file: {"bot": "simulation" or "data", "dialogues":
+    [{"question": ..., "responses": [LLM output of each step, ...]}, ...]}"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ReplayChatModel(SimpleChatModel):
+    """Chat model that answers with the recorded outputs of `dialogues`.
+
+    The question and the step are read from the agent prompt: the text
+    after its last "Question: " and the number of observations since. In a
+    final answer, `{observation}` is replaced by the last observation, so
+    file paths and result handles of the current run are passed on.
+    """
+
+    dialogues: List[Dict[str, Any]]
+    # index of the dialogue being replayed
+    turn: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return 'replay'
+
+    def _call(
+            self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+            run_manager=None, **kwargs: Any
+    ) -> str:
+        prompt = messages[-1].content
+        start = prompt.rfind(PROMPT_END)
+        current = prompt[prompt.find('\nQuestion: ', start) + len('\nQuestion: '):]
+        dialogue = self.dialogues[self.turn]
+        if not current.startswith(dialogue['question']):
+            raise ValueError(
+                f"the transcript expects the question {dialogue['question']!r}, "
+                f"got {current.splitlines()[0]!r}")
+        scratchpad = current[len(dialogue['question']):]
+        step = scratchpad.count('\nObservation: ')
+        responses = dialogue['responses']
+        if step >= len(responses):
+            raise ValueError(
+                f"the transcript of {dialogue['question']!r} has no step {step}")
+        response = responses[step]
+        if step == len(responses) - 1:
+            self.turn += 1
+        if '{observation}' in response:
+            last = scratchpad.rsplit('\nObservation: ', 1)[-1]
+            response = response.replace('{observation}', last.split('\nThought:')[0].strip())
+        return response
+
+
+class TranscriptRecorder(BaseCallbackHandler):
+    """Callback handler that appends the LLM outputs of every turn of a live
+    session to a transcript file for ReplayChatModel."""
+
+    def __init__(self, path: str, bot: str) -> None:
+        super().__init__()
+        self.path = path
+        self.bot = bot
+        self.current = None
+        self._lock = threading.Lock()
+
+    def on_chain_start(
+            self, serialized: Dict[str, Any], inputs: Dict[str, Any], *,
+            run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        if parent_run_id is None:
+            self.current = {'question': inputs['input'], 'responses': []}
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> Any:
+        if self.current is not None:
+            self.current['responses'].append(response.generations[0][0].text)
+
+    def on_chain_end(
+            self, outputs: Dict[str, Any], *, run_id: UUID,
+            parent_run_id: Optional[UUID] = None, **kwargs: Any
+    ) -> Any:
+        if parent_run_id is not None or self.current is None:
+            return
+        with self._lock:
+            if os.path.exists(self.path):
+                transcript = load_transcript(self.path)
+            else:
+                transcript = {'bot': self.bot, 'dialogues': []}
+            transcript['dialogues'].append(self.current)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(transcript, f, ensure_ascii=False, indent=2)
+        self.current = None
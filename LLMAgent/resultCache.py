@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+def normalize_param(value):
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, (list, tuple, set)):
+        # ID 列表与顺序、重复无关
+        return sorted({normalize_param(v) for v in value})
+    if isinstance(value, datetime):
+        return str(value)
+    return value
+
+
+def normalize_params(params: dict) -> dict:
+    return {k: normalize_param(v) for k, v in (params or {}).items()}
+
+
+def is_historical(params: dict) -> bool:
+    """True if the time window of the query ended before now."""
+    ends = []
+    for k, v in params.items():
+        if k.endswith('end'):
+            try:
+                ends.append(datetime.fromisoformat(str(v)))
+            except ValueError:
+                return False
+    return bool(ends) and max(ends) <= datetime.now()
+
+
+class ResultCache:
+    """LRU cache of query results with a TTL.
+
+    Results of queries on a time window that is already over only change
+    when late trips are loaded or the rollups are refreshed, so they are
+    kept for `historical_ttl` instead. Jobs that modify the tables call
+    `clear()`.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 600., historical_ttl: float = 6 * 3600.) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.historical_ttl = historical_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(name: str, params: dict) -> tuple:
+        return (name, tuple(sorted(
+            (k, tuple(v) if isinstance(v, list) else v) for k, v in params.items())))
+
+    def get_or_run(self, name: str, params: dict, run):
+        """Return the cached result of `name` with normalized `params`, or
+        call `run(params)` with those params and cache its result."""
+        params = normalize_params(params)
+        key = self.make_key(name, params)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        result = run(params)
+        expires = now + (self.historical_ttl if is_historical(params) else self.ttl)
+        with self._lock:
+            self._entries[key] = (expires, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+# 所有数据工具共享的查询结果缓存
+RESULT_CACHE = ResultCache()
@@ -0,0 +1,105 @@
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+
+# 大表格保存在服务端，交给 LLM 的只有前几行、统计信息和句柄，
+# 完整的表格由界面根据句柄直接显示
+PREVIEW_ROWS = 10
+RESULT_FOLDER = 'results'
+HANDLE_PATTERN = re.compile(r'\[result:([0-9a-f]{8})\]')
+
+
+class ResultStore:
+    """Full tool results by handle, the latest `maxsize` in memory.
+
+    Older results are moved to `<folder>/<handle>.parquet`. A result that
+    cannot be written there is dropped with a message, which keeps the
+    memory used bounded. Only the latest `maxfiles` of these files are
+    kept.
+    """
+
+    def __init__(self, maxsize: int = 64, folder: str = RESULT_FOLDER, maxfiles: int = 1024) -> None:
+        self.maxsize = maxsize
+        self.folder = folder
+        self.maxfiles = maxfiles
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, handle: str) -> str:
+        return os.path.join(self.folder, f'{handle}.parquet')
+
+    def put(self, df: pd.DataFrame) -> str:
+        handle = uuid.uuid4().hex[:8]
+        with self._lock:
+            self._results[handle] = df
+            evicted = []
+            while len(self._results) > self.maxsize:
+                evicted.append(self._results.popitem(last=False))
+        for old, oldDf in evicted:
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                oldDf.to_parquet(self.path(old))
+            except (ImportError, OSError, ValueError, TypeError) as e:
+                # 例如列中混有不同类型的对象，pyarrow 无法转换
+                print(f'result {old} is dropped: {e!r}')
+        if evicted:
+            self.prune_files()
+        return handle
+
+    def prune_files(self) -> None:
+        # 删除最早写入的结果文件，文件夹不会无限增长
+        try:
+            with os.scandir(self.folder) as entries:
+                files = [(e.stat().st_mtime_ns, e.path) for e in entries if e.name.endswith('.parquet')]
+        except OSError:
+            return
+        files.sort()
+        for _, path in files[:max(len(files) - self.maxfiles, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, handle: str):
+        """The result of `handle`, or None if it is unknown."""
+        with self._lock:
+            df = self._results.get(handle)
+            if df is not None:
+                self._results.move_to_end(handle)
+                return df
+        try:
+            return pd.read_parquet(self.path(handle))
+        except (ImportError, OSError):
+            return None
+
+
+RESULT_STORE = ResultStore()
+
+
+def find_handles(text: str) -> list[str]:
+    return HANDLE_PATTERN.findall(text or '')
+
+
+def table_observation(msg: str, df: pd.DataFrame, store: ResultStore = RESULT_STORE) -> str:
+    """`msg` and `df` as a tool observation. Tables longer than
+    PREVIEW_ROWS are kept in `store` and only their first rows, summary
+    statistics and handle are returned."""
+    if len(df) <= PREVIEW_ROWS:
+        return msg + df.to_markdown()
+    handle = store.put(df)
+    numeric = df.select_dtypes('number')
+    text = (
+        msg + f'The table has {len(df)} rows, only the first {PREVIEW_ROWS} are shown here. '
+        f'The full table is kept as [result:{handle}], include this handle in your final answer '
+        f'and the full table will be shown to the human user. \n'
+        + df.head(PREVIEW_ROWS).to_markdown()
+    )
+    if not numeric.empty:
+        stats = numeric.agg(['min', 'mean', 'max'])
+        text += f'\nSummary statistics of all {len(df)} rows: \n' + stats.to_markdown()
+    return text
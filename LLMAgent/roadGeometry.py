@@ -0,0 +1,51 @@
+import os
+import threading
+
+import geopandas as gpd
+
+from LLMAgent.dbConnector import get_engine
+from LLMAgent.queryRegistry import prepare_query, timed_query
+
+
+# 道路几何的本地快照，删除该文件即可在下次使用时重新导出
+SNAPSHOT_FILE = 'road_geometry.parquet'
+
+_roads = None
+_roadsLock = threading.Lock()
+
+
+def export_road_geometry(snapshotfile: str = SNAPSHOT_FILE) -> gpd.GeoDataFrame:
+    with get_engine().connect() as conn:
+        with timed_query('road_geometry_all'):
+            gdf = gpd.GeoDataFrame.from_postgis(
+                prepare_query(conn, 'road_geometry_all'), conn, geom_col='geom')
+    # 与 CAST(ROUND(objectid) as varchar) 相同的道路ID，用于本地连接流量数据
+    gdf['road_id'] = gdf['objectid'].round().astype('Int64').astype(str)
+    try:
+        gdf.to_parquet(snapshotfile)
+    except ImportError:
+        # 未安装 pyarrow 时只在进程内保留
+        pass
+    return gdf
+
+
+def get_road_geometry() -> gpd.GeoDataFrame:
+    """All roads of topo_centerroad, read once per process from the local
+    snapshot, which is exported from the database on first use."""
+    global _roads
+    if _roads is None:
+        with _roadsLock:
+            if _roads is None:
+                if os.path.exists(SNAPSHOT_FILE):
+                    try:
+                        _roads = gpd.read_parquet(SNAPSHOT_FILE)
+                    except ImportError:
+                        pass
+                if _roads is None:
+                    _roads = export_road_geometry()
+    return _roads
+
+
+if __name__ == '__main__':
+    roads = export_road_geometry()
+    print(f'{len(roads)} roads are exported to {SNAPSHOT_FILE}.')
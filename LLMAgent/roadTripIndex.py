@@ -0,0 +1,48 @@
+import sqlalchemy as sa
+
+from LLMAgent.dbConnector import get_engine, has_table
+from LLMAgent.resultCache import RESULT_CACHE
+
+
+INDEX_TABLE = 'road_trip_index'
+
+# 由出行路径拆分出的 道路 -> 出行 倒排索引，按道路ID精确查询
+BUILD_STATEMENTS = [
+    f"DROP TABLE IF EXISTS {INDEX_TABLE}_new",
+    f"""
+    CREATE TABLE {INDEX_TABLE}_new AS
+    SELECT DISTINCT
+      unnest(string_to_array(path, '-'))::VARCHAR(50) AS road,
+      trip_id,
+      DATE_TRUNC('hour', departure_time) AS hour_start
+    FROM the_synthetic_individual_level_trip_dataset
+    """,
+    f"CREATE INDEX ON {INDEX_TABLE}_new (road, hour_start) INCLUDE (trip_id)",
+    f"ANALYZE {INDEX_TABLE}_new",
+    f"DROP TABLE IF EXISTS {INDEX_TABLE}",
+    f"ALTER TABLE {INDEX_TABLE}_new RENAME TO {INDEX_TABLE}",
+]
+
+
+def build_road_trip_index():
+    # 在新表中建立索引后再替换旧表，查询不会读到未完成的索引
+    with get_engine().begin() as conn:
+        for statement in BUILD_STATEMENTS:
+            conn.execute(sa.text(statement))
+    RESULT_CACHE.clear()
+
+
+_indexReady = False
+
+
+def has_road_trip_index() -> bool:
+    # 索引建好后只会被替换，不会被删除，因此只缓存存在的结果
+    global _indexReady
+    if not _indexReady:
+        _indexReady = has_table(INDEX_TABLE)
+    return _indexReady
+
+
+if __name__ == '__main__':
+    build_road_trip_index()
+    print(f'{INDEX_TABLE} is built.')
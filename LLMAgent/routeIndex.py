@@ -0,0 +1,164 @@
+import os
+import numpy as np
+import sumolib
+from xml.etree import ElementTree as ET
+
+
+def get_pce(vtype: str) -> float:
+    pce = 1.
+    if vtype == "bicycle":
+        pce = 0.2
+    elif vtype in ["moped", "motorcycle"]:
+        pce = 0.5
+    elif vtype in ["truck", "trailer", "bus", "coach"]:
+        pce = 3.5
+    return pce
+
+
+class RouteIndex:
+    """Vehicles and routes of one route file, read in a single pass.
+
+    Vehicles are stored in file order as compact arrays: `depart` (NaN for
+    triggered vehicles), `pce` and `vehSeq`, the index of the vehicle's edge
+    sequence in `seqOffsets`/`seqEdges`. A vehicle referencing a route that
+    is not defined in this file has `vehSeq` -1 and the route id in
+    `vehRouteRef`. Edges are integer codes into `edgeNames`.
+    """
+
+    ARRAYS = [
+        'depart', 'pce', 'vehSeq', 'vehRouteRef',
+        'seqOffsets', 'seqEdges', 'edgeNames', 'routeIDs', 'routeSeq'
+    ]
+
+    def __init__(self, **arrays) -> None:
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self._routeSeq = dict(zip(self.routeIDs.tolist(), self.routeSeq.tolist()))
+
+    @classmethod
+    def parse(cls, file: str) -> 'RouteIndex':
+        depart, pce, vehSeq, vehRouteRef = [], [], [], []
+        seqOffsets, seqEdges = [0], []
+        routeIDs, routeSeq = [], []
+        edgeCodes = {}
+
+        def add_seq(edges: str) -> int:
+            for e in edges.split():
+                seqEdges.append(edgeCodes.setdefault(e, len(edgeCodes)))
+            seqOffsets.append(len(seqEdges))
+            return len(seqOffsets) - 2
+
+        localRoutes = {}
+        root = None
+        inVehicle = False
+        vehicleEdges = None
+        for event, elem in ET.iterparse(file, events=('start', 'end')):
+            if root is None:
+                root = elem
+            if event == 'start':
+                if elem.tag == 'vehicle':
+                    inVehicle = True
+                    vehicleEdges = None
+                continue
+            if elem.tag == 'route':
+                if inVehicle:
+                    vehicleEdges = elem.get('edges')
+                elif elem.get('id') is not None:
+                    s = add_seq(elem.get('edges', ''))
+                    routeIDs.append(elem.get('id'))
+                    routeSeq.append(s)
+                    localRoutes[elem.get('id')] = s
+            elif elem.tag == 'vehicle':
+                inVehicle = False
+                if elem.get('depart') == "triggered":
+                    depart.append(np.nan)
+                else:
+                    depart.append(sumolib.miscutils.parseTime(elem.get('depart')))
+                pce.append(get_pce(elem.get('type')))
+                if elem.get('route') is not None:
+                    vehSeq.append(localRoutes.get(elem.get('route'), -1))
+                    vehRouteRef.append(elem.get('route'))
+                else:
+                    vehSeq.append(add_seq(vehicleEdges or ''))
+                    vehRouteRef.append('')
+            if not inVehicle:
+                # drop the parsed top-level elements
+                root.clear()
+
+        return cls(
+            depart=np.array(depart, dtype=float),
+            pce=np.array(pce, dtype=float),
+            vehSeq=np.array(vehSeq, dtype=np.int64),
+            vehRouteRef=np.array(vehRouteRef, dtype=str),
+            seqOffsets=np.array(seqOffsets, dtype=np.int64),
+            seqEdges=np.array(seqEdges, dtype=np.int32),
+            edgeNames=np.array(list(edgeCodes), dtype=str),
+            routeIDs=np.array(routeIDs, dtype=str),
+            routeSeq=np.array(routeSeq, dtype=np.int64)
+        )
+
+    @property
+    def triggered(self) -> np.ndarray:
+        return np.isnan(self.depart)
+
+    def get_seq(self, seq: int) -> np.ndarray:
+        return self.seqEdges[self.seqOffsets[seq]:self.seqOffsets[seq + 1]]
+
+    def get_route(self, routeID: str):
+        """Edge names of the route `routeID`, or None if it is not in this file."""
+        if routeID not in self._routeSeq:
+            return None
+        return self.edgeNames[self.get_seq(self._routeSeq[routeID])].tolist()
+
+    def get_vehicle_edges(self, i: int, indexes: list['RouteIndex']) -> list[str]:
+        if self.vehSeq[i] >= 0:
+            return self.edgeNames[self.get_seq(self.vehSeq[i])].tolist()
+        # the route is defined in another route file; the last definition wins
+        for idx in reversed(indexes):
+            edges = idx.get_route(self.vehRouteRef[i])
+            if edges is not None:
+                return edges
+        raise KeyError(self.vehRouteRef[i])
+
+    def save(self, path: str, stamp: tuple) -> None:
+        np.savez(path, stamp=np.array(stamp, dtype=np.int64),
+                 **{name: getattr(self, name) for name in self.ARRAYS})
+
+    @classmethod
+    def load(cls, path: str, stamp: tuple):
+        """Load a saved index, or return None if it is missing or stale."""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if tuple(data['stamp'].tolist()) != stamp:
+                    return None
+                return cls(**{name: data[name] for name in cls.ARRAYS})
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+# route file path -> ((mtime, size), RouteIndex)
+_routeIndexCache: dict[str, tuple[tuple[int, int], RouteIndex]] = {}
+
+
+def get_route_index(file: str) -> RouteIndex:
+    """Return the index of `file`, parsing it only when it changed.
+
+    The index is kept in memory and next to the route file as
+    `<file>.index.npz`, both keyed by the file's mtime and size.
+    """
+    st = os.stat(file)
+    stamp = (st.st_mtime_ns, st.st_size)
+    key = os.path.abspath(file)
+    cached = _routeIndexCache.get(key)
+    if cached is None or cached[0] != stamp:
+        cachefile = f'{file}.index.npz'
+        index = RouteIndex.load(cachefile, stamp)
+        if index is None:
+            index = RouteIndex.parse(file)
+            try:
+                index.save(cachefile, stamp)
+            except OSError:
+                pass
+        cached = (stamp, index)
+        _routeIndexCache[key] = cached
+    return cached[1]
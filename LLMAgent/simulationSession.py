@@ -0,0 +1,134 @@
+import mmap
+import os
+import re
+from xml.etree import ElementTree as ET
+
+import traci
+from traci.exceptions import FatalTraCIError, TraCIException
+from sumolib import checkBinary
+
+
+def last_interval_end(dumpfile: str) -> float:
+    """End time of the last complete interval of an edgedata dump, or -1."""
+    try:
+        with open(dumpfile, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                end = data.rfind(b'</interval>')
+                if end < 0:
+                    return -1.
+                begin = data.rfind(b'<interval', 0, end)
+                match = re.search(rb'\send="([^"]+)"', data[begin:data.find(b'>', begin)])
+                return float(match.group(1)) if match else -1.
+    except (OSError, ValueError):  # missing or empty file
+        return -1.
+
+
+class SimulationSession:
+    """Keeps one SUMO process connected between calls and only advances time.
+
+    The state is checkpointed to `tempstatefile` after every advance, so a
+    process that died (or whose input files changed, e.g. a new TLS program
+    written by the Webster optimization) is relaunched from the last saved
+    state instead of from scratch.
+
+    SUMO only writes an edgeData interval once its end is reached, which
+    closing the process used to force. With `dumpfile`, every advance runs
+    on until the interval covering the simulated time is written.
+    """
+
+    def __init__(
+            self, sumocfgfile: str, originalstatefile: str, tempstatefile: str,
+            label: str = 'simulationSession', if_show_gui: bool = False,
+            dumpfile: str = None
+    ) -> None:
+        self.sumocfgfile = sumocfgfile
+        self.dumpfile = dumpfile
+        self.originalstatefile = originalstatefile
+        self.tempstatefile = tempstatefile
+        self.label = label
+        self.if_show_gui = if_show_gui
+        self.conn = None
+        self.inputStamp = None
+
+    def get_input_files(self) -> list[str]:
+        cfgdir = os.path.dirname(self.sumocfgfile)
+        root = ET.parse(self.sumocfgfile).getroot()
+        files = [self.sumocfgfile]
+        for tag in ['net-file', 'route-files', 'additional-files']:
+            for child in root.iter(tag):
+                for f in child.attrib['value'].split(','):
+                    files.append(os.path.join(cfgdir, f.strip()))
+        return files
+
+    def get_input_stamp(self) -> tuple:
+        stamp = []
+        for f in self.get_input_files():
+            try:
+                st = os.stat(f)
+                stamp.append((f, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append((f, None, None))
+        return tuple(stamp)
+
+    def is_alive(self) -> bool:
+        if self.conn is None:
+            return False
+        try:
+            self.conn.simulation.getTime()
+        except (FatalTraCIError, OSError):
+            self.close()
+            return False
+        return True
+
+    def start(self, statefile: str) -> None:
+        self.close()
+        if not self.if_show_gui:
+            sumoBinary = checkBinary('sumo')
+        else:
+            sumoBinary = checkBinary('sumo-gui')
+
+        self.inputStamp = self.get_input_stamp()
+        traci.start([sumoBinary, "-c", self.sumocfgfile], label=self.label)
+        self.conn = traci.getConnection(self.label)
+        print('start reading state')
+        self.conn.simulation.loadState(statefile)
+        print('read state done!')
+
+    def close(self) -> None:
+        if self.conn is None:
+            return
+        try:
+            self.conn.close()
+        except (FatalTraCIError, TraCIException, OSError):
+            # a failed CMD_CLOSE drops the socket, so closing again only
+            # unregisters the label
+            try:
+                self.conn.close(False)
+            except (FatalTraCIError, TraCIException, OSError, KeyError):
+                pass
+        self.conn = None
+
+    def advance(self, steps: int, reset: bool = False) -> float:
+        """Run `steps` seconds of simulation and return the new time.
+
+        With `reset` the simulation restarts from `originalstatefile`; otherwise
+        it continues the running process, or relaunches from `tempstatefile`
+        if the process is gone or its inputs were modified.
+        """
+        if reset:
+            self.start(self.originalstatefile)
+        elif not self.is_alive() or self.get_input_stamp() != self.inputStamp:
+            self.start(self.tempstatefile)
+
+        start_time = self.conn.simulation.getTime()
+        target = start_time + steps
+        self.conn.simulationStep(target)
+        if self.dumpfile:
+            # 统计区间的终点可能与仿真时间错开，逐秒推进直到写出本次仿真的区间
+            now = self.conn.simulation.getTime()
+            while last_interval_end(self.dumpfile) < target and now < target + steps:
+                self.conn.simulationStep()
+                now = self.conn.simulation.getTime()
+        self.conn.simulation.saveState(self.tempstatefile)
+
+        return self.conn.simulation.getTime()
@@ -0,0 +1,39 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+# 工具内部各阶段（解析路网与统计数据、推进仿真、绘图）的耗时，供基准测试统计
+_stageStats: dict[str, list] = {}
+_statsLock = threading.Lock()
+
+
+@contextmanager
+def timed_stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _statsLock:
+            stats = _stageStats.setdefault(name, [0, 0., 0.])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+
+def get_stage_totals() -> dict[str, tuple[int, float]]:
+    """stage -> (calls, total seconds) so far, to diff around a run."""
+    with _statsLock:
+        return {name: (n, total) for name, (n, total, longest) in _stageStats.items()}
+
+
+def get_stage_stats() -> pd.DataFrame:
+    with _statsLock:
+        rows = [[name, n, total, total / n, longest]
+                for name, (n, total, longest) in _stageStats.items()]
+    return pd.DataFrame(
+        rows, columns=['stage', 'calls', 'total_s', 'mean_s', 'max_s']
+    ).sort_values('total_s', ascending=False).reset_index(drop=True)
@@ -0,0 +1,133 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from langchain.memory import ConversationBufferMemory
+from langchain.schema.language_model import BaseLanguageModel
+
+
+# 没有安装 tiktoken 时按字符估计：英文约 4 个字符一个 token，中文约一个字一个 token
+CJK = re.compile(r'[\u3000-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    cjk = len(CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_tokens(text: str, llm: Optional[BaseLanguageModel] = None) -> int:
+    if llm is not None:
+        try:
+            return llm.get_num_tokens(text)
+        except ImportError:
+            pass
+    return estimate_tokens(text)
+
+
+def split_tables(text: str) -> List[tuple]:
+    """Split `text` into ('text', str) and ('table', [lines]) parts, where a
+    table is a run of markdown table lines."""
+    parts, table = [], []
+    lines = text.split('\n')
+    for line in lines:
+        if line.strip().startswith('|'):
+            table.append(line)
+            continue
+        if table:
+            parts.append(('table', table))
+            table = []
+        parts.append(('text', line))
+    if table:
+        parts.append(('table', table))
+    return parts
+
+
+class TokenBudgetMemory(ConversationBufferMemory):
+    """Conversation memory that keeps `{chat_history}` within a token budget.
+
+    Markdown tables with more than `max_table_rows` rows in the answers are
+    kept in `tables` and replaced by their first rows and a reference such
+    as `T1`, which the `Expand Stored Table` tool turns back into the full
+    table. When the history exceeds `max_token_limit`, the oldest turns are
+    reduced to a line with the question and the start of the answer; the
+    latest turn is always kept verbatim.
+    """
+
+    llm: Optional[BaseLanguageModel] = None
+    max_token_limit: int = 2000
+    max_table_rows: int = 10
+    preview_rows: int = 3
+    summary: List[str] = []
+    tables: Dict[str, str] = {}
+    # tokens of the history loaded for the last turn
+    history_tokens: int = 0
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.llm)
+
+    def compact_tables(self, text: str) -> str:
+        out = []
+        for kind, part in split_tables(text):
+            if kind == 'text':
+                out.append(part)
+                continue
+            # header, separator and rows
+            nRows = len(part) - 2
+            if nRows <= self.max_table_rows:
+                out.extend(part)
+                continue
+            ref = f'T{len(self.tables) + 1}'
+            self.tables[ref] = '\n'.join(part)
+            out.extend(part[:2 + self.preview_rows])
+            out.append(
+                f'(table {ref}: first {self.preview_rows} of {nRows} rows; '
+                f'use the tool "Expand Stored Table" with input {ref} for the full table)')
+        return '\n'.join(out)
+
+    def expand_table(self, ref: str) -> str:
+        ref = ref.strip().strip('\'"`')
+        if ref not in self.tables:
+            return f"There is no stored table {ref}. The stored tables are: {', '.join(self.tables) or 'none'}."
+        return f'Here is the full table {ref}:\n' + self.tables[ref]
+
+    def summarize_turn(self, question: str, answer: str) -> str:
+        refs = re.findall(r'\(table (T\d+):', answer)
+        text = ' '.join(
+            part.strip() for kind, part in split_tables(answer)
+            if kind == 'text' and part.strip() and not part.startswith('(table '))
+        line = f'Human asked: {question[:200]} AI answered: {text[:200]}'
+        if refs:
+            line += f" (tables {', '.join(refs)})"
+        return line
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        self.chat_memory.add_user_message(input_str)
+        self.chat_memory.add_ai_message(self.compact_tables(output_str))
+        self.prune()
+
+    def prune(self) -> None:
+        messages = self.chat_memory.messages
+        while len(messages) > 2 and self.count(self.history()) > self.max_token_limit:
+            human, ai = messages[0], messages[1]
+            del messages[:2]
+            self.summary.append(self.summarize_turn(human.content, ai.content))
+        # 摘要本身也不能超出预算的一半
+        while self.summary and self.count('\n'.join(self.summary)) > self.max_token_limit // 2:
+            self.summary.pop(0)
+
+    def history(self) -> str:
+        buffer = self.buffer_as_str
+        if not self.summary:
+            return buffer
+        return 'Summary of earlier conversation:\n' + '\n'.join(self.summary) + '\n' + buffer
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        history = self.history()
+        self.history_tokens = self.count(history)
+        return {self.memory_key: history}
+
+    def clear(self) -> None:
+        super().clear()
+        self.summary = []
+        self.tables = {}
+        self.history_tokens = 0
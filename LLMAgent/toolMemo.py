@@ -0,0 +1,125 @@
+import functools
+import re
+import threading
+
+
+class ResourceVersions:
+    """Counters of the state shared by the tools of all sessions, e.g. the
+    simulation output or the TLS programs, bumped by the tools writing it."""
+
+    def __init__(self) -> None:
+        self._versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self, names) -> tuple:
+        with self._lock:
+            return tuple(self._versions.get(n, 0) for n in names)
+
+    def bump(self, names) -> None:
+        with self._lock:
+            for n in names:
+                self._versions[n] = self._versions.get(n, 0) + 1
+
+
+RESOURCE_VERSIONS = ResourceVersions()
+
+
+def normalize_input(toolInput) -> str:
+    # 'None' 与 "None"、'J1, J2' 与 'J1,J2' 视为同一输入
+    text = ' '.join(str(toolInput).split()).strip('\'"` ')
+    return re.sub(r'\s*([,;|])\s*', r'\1', text)
+
+
+class ToolMemo:
+    """Results of the tool calls of one dialogue turn.
+
+    Tools declare the resources they read and write as class attributes,
+    e.g. `reads = ('simulation',)` and `writes = ('simulation',)`. A call of
+    a reading tool with the same normalized input returns the cached
+    observation as long as no tool, in any session, wrote one of the
+    resources it reads. Writing tools always run. Tools without a `reads`
+    declaration are not cached.
+    """
+
+    def __init__(self, versions: ResourceVersions = RESOURCE_VERSIONS) -> None:
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def lookup(self, key: tuple, reads: tuple):
+        """Return (found, result, versions) for `key`."""
+        versions = self.versions.snapshot(reads)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self.hits += 1
+                return True, entry[1], versions
+            self.misses += 1
+        return False, None, versions
+
+    def store(self, key: tuple, versions: tuple, result) -> None:
+        with self._lock:
+            self._entries[key] = (versions, result)
+
+    def wrap(self, name: str, func, reads=None, writes=()):
+        """Memoized version of the tool function `func`."""
+        if writes:
+            @functools.wraps(func)
+            def writer(toolInput, *args, **kwargs):
+                try:
+                    return func(toolInput, *args, **kwargs)
+                finally:
+                    self.versions.bump(writes)
+
+            return writer
+        if reads is None:
+            return func
+
+        @functools.wraps(func)
+        def reader(toolInput, *args, **kwargs):
+            key = (name, normalize_input(toolInput))
+            found, result, versions = self.lookup(key, reads)
+            if found:
+                return result
+            result = func(toolInput, *args, **kwargs)
+            self.store(key, versions, result)
+            return result
+
+        return reader
+
+    def awrap(self, name: str, coroutine, reads=None, writes=()):
+        """wrap() for the async tool function `coroutine`; cached results
+        are returned without waiting for a worker of the tool's pool."""
+        if writes:
+            @functools.wraps(coroutine)
+            async def writer(toolInput, *args, **kwargs):
+                try:
+                    return await coroutine(toolInput, *args, **kwargs)
+                finally:
+                    self.versions.bump(writes)
+
+            return writer
+        if reads is None:
+            return coroutine
+
+        @functools.wraps(coroutine)
+        async def reader(toolInput, *args, **kwargs):
+            key = (name, normalize_input(toolInput))
+            found, result, versions = self.lookup(key, reads)
+            if found:
+                return result
+            result = await coroutine(toolInput, *args, **kwargs)
+            self.store(key, versions, result)
+            return result
+
+        return reader
@@ -0,0 +1,48 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# 工具按使用的资源分配线程池：仿真控制与信号优化操作同一个 SUMO 场景，
+# 只能依次执行；数据查询和绘图可以与它们并行
+TOOL_POOL_WORKERS = {
+    'simulation': 1,
+    'cpu': os.cpu_count() or 1,
+    'io': 8,
+}
+DEFAULT_POOL = 'io'
+
+_pools: dict[str, ThreadPoolExecutor] = {}
+_poolsLock = threading.Lock()
+
+
+def get_tool_pool(name: str = DEFAULT_POOL) -> ThreadPoolExecutor:
+    if name not in TOOL_POOL_WORKERS:
+        raise ValueError(
+            f"unknown tool pool '{name}', choose from {', '.join(TOOL_POOL_WORKERS)}")
+    with _poolsLock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = ThreadPoolExecutor(
+                max_workers=TOOL_POOL_WORKERS[name], thread_name_prefix=f'tool-{name}')
+            _pools[name] = pool
+    return pool
+
+
+async def run_in_pool(name: str, func, *args, **kwargs):
+    """Await `func(*args, **kwargs)` run in the tool pool `name`."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_tool_pool(name), functools.partial(func, *args, **kwargs))
+
+
+def tool_coroutine(func, pool: str = DEFAULT_POOL):
+    """An async version of the tool function `func` for langchain's Tool,
+    which keeps the event loop free while the tool runs."""
+    get_tool_pool(pool)
+
+    async def coroutine(*args, **kwargs):
+        return await run_in_pool(pool, func, *args, **kwargs)
+
+    return coroutine
@@ -1,15 +1,18 @@
 
 import os
 import sys
+import numpy as np
 import pandas as pd
-import traci
-from sumolib import checkBinary
 
-from LLMAgent.buildGraph import Lane, Edge, Junction, Graph, build_graph
+from LLMAgent.buildGraph import Lane, Edge, Junction, Graph, build_graph, get_graph
 from LLMAgent.websterOptimize import Webster
 from LLMAgent.plotIntersections import plot_intersections
 from LLMAgent.plotHeatmap import plot_heatmap
-from LLMAgent.readDump import read_last_dump
+from LLMAgent.renderProfile import split_profile
+from LLMAgent.resultHandles import table_observation
+from LLMAgent.kpiStore import get_kpi_store
+from LLMAgent.simulationSession import SimulationSession
+from LLMAgent.stageTimer import timed_stage
 
 
 def prompts(name, description):
@@ -21,7 +24,61 @@ def prompts(name, description):
     return decorator
 
 
+def summarize_junctions(graph: Graph, edgedata: pd.DataFrame, target_junction_id: list = None) -> pd.DataFrame:
+    jids, offsets, eids = graph.get_junction_inedges(3)
+    owner = np.repeat(np.arange(len(jids)), np.diff(offsets))
+    if target_junction_id is not None:
+        selected = np.isin(np.array(jids, dtype=object), target_junction_id)
+        owner, eids = owner[selected[owner]], eids[selected[owner]]
+    else:
+        selected = np.ones(len(jids), dtype=bool)
+
+    # junction -> edgedata rows, in edgedata order within each junction so
+    # that the sums below add up in the same order as a per-junction filter
+    pairs = pd.DataFrame({'junction': owner, 'edgeID': eids}).merge(
+        pd.DataFrame({'edgeID': edgedata['edgeID'].to_numpy(), 'row': np.arange(len(edgedata))}),
+        on='edgeID'
+    ).sort_values(['junction', 'row'], kind='stable')
+    junction = pairs['junction'].to_numpy()
+    row = pairs['row'].to_numpy()
+    counts = np.bincount(junction, minlength=len(jids))
+    starts = np.cumsum(counts) - counts
+
+    def segment_sum(values: np.ndarray) -> np.ndarray:
+        # NaN-skipping sum per junction. Junctions with the same number of
+        # rows are summed together along the rows of one matrix, which gives
+        # bit-identical results to pandas' Series.sum on each junction.
+        values = np.where(np.isnan(values), 0., values)
+        sums = np.zeros(len(jids))
+        for n in np.unique(counts[counts > 0]):
+            js = np.flatnonzero(counts == n)
+            sums[js] = values[starts[js, None] + np.arange(n)].sum(axis=1)
+        return sums
+
+    speed = edgedata['speed'].to_numpy(dtype=float)[row]
+    timeLoss = edgedata['timeLoss'].to_numpy(dtype=float)[row]
+    left = edgedata['left'].to_numpy(dtype=float)[row]
+    density = edgedata['density'].to_numpy(dtype=float)[row]
+    volume = speed * 3.6 * density
+    with np.errstate(divide='ignore', invalid='ignore'):
+        left_sum = segment_sum(left)
+        speed_avg = segment_sum(speed * left) / left_sum
+        timeLoss_avg = segment_sum(timeLoss * left) / left_sum
+        volume_avg = segment_sum(volume) / segment_sum((~np.isnan(volume)).astype(float))
+
+    return pd.DataFrame({
+        'Juction_id': np.array(jids, dtype=object)[selected],
+        'speed_avg': speed_avg[selected],
+        'volume_avg': volume_avg[selected],
+        'timeLoss_avg': timeLoss_avg[selected]
+    })
+
+
 class simulationControl:
+    # 推进同一个 SUMO 进程，与信号优化依次执行
+    pool = 'simulation'
+    writes = ('simulation',)
+
     def __init__(self, sumocfgfile: str, netfile: str, dumpfile: str, originalstatefile: str, tempstatefile: str, figfolder: str) -> None:
         self.sumocfgfile = sumocfgfile
         self.netfile = netfile
@@ -29,6 +86,8 @@ class simulationControl:
         self.originalstatefile = originalstatefile
         self.tempstatefile = tempstatefile
         self.figfolder = figfolder
+        self.session = SimulationSession(
+            sumocfgfile, originalstatefile, tempstatefile, dumpfile=dumpfile)
 
     @prompts(name='Simulation Controller',
              description="""
@@ -36,8 +95,10 @@ class simulationControl:
              The output will tell you whether you have finished this command successfully.
              This tool will also return the file path of a heat map of the road network as a supplementary information for you to provide the final answer. 
              The input should be a string, representing how many times have you called this tool, which shoule be a number greater than or equal to 0. 
-             For example: if you never called this tool before and this is your first time calling this tool, the input should be 0; if you have called this tool twice, the imput should be 2.""")
+             For example: if you never called this tool before and this is your first time calling this tool, the input should be 0; if you have called this tool twice, the imput should be 2.
+             Only if the human user asks for a full-resolution figure for a report, append ";report" to the input. For example: 2;report""")
     def inference(self, ordinal: str) -> str:
+        ordinal, profile = split_profile(ordinal)
         ordinal_number = eval(ordinal)
         STEP = 600
 
@@ -48,37 +109,23 @@ class simulationControl:
             raise RuntimeError(
                 "please declare environment variable 'SUMO_HOME'")
 
-        if_show_gui = False
-
-        if not if_show_gui:
-            sumoBinary = checkBinary('sumo')
-        else:
-            sumoBinary = checkBinary('sumo-gui')
-
-        traci.start([sumoBinary, "-c", self.sumocfgfile])
-        print('start reading state')
-        if ordinal_number > 0:
-            traci.simulation.loadState(self.tempstatefile)
-        else:
-            traci.simulation.loadState(self.originalstatefile)
-
-        start_time = int(traci.simulation.getTime() / 1000)
-        print('read state done!')
-        for step in range(start_time, start_time + STEP):
-            traci.simulationStep()
-
-        traci.simulation.saveState(self.tempstatefile)
+        with timed_stage('simulate'):
+            self.session.advance(STEP, reset=ordinal_number <= 0)
+        # 只解析本次仿真新写入的统计区间
+        get_kpi_store(self.dumpfile)
 
-        traci.close()
         args = f'''-v -n {self.netfile} --measures speed,occupancy -i {self.dumpfile} \
             --default-width .5 --colormap RdYlGn  --max-width 3 --min-width .5 \
             --min-color-value 0 --max-color-value 15 --max-width-value 100 --min-width-value 0'''
-        fig_path = plot_heatmap(self.figfolder, args)
+        fig_path = plot_heatmap(self.figfolder, args, profile)
 
         return f"You have successfully proceeded the traffic simulation on SUMO for 600 seconds. And your final answer should include this sentence without changing anything: the road network heat map is kept at: `{fig_path}`."
 
 
 class intersectionPerformance:
+    pool = 'cpu'
+    reads = ('simulation',)
+
     def __init__(self, netfile: str, dumpfile: str) -> None:
         self.netfile = netfile
         self.dumpfile = dumpfile
@@ -103,57 +150,36 @@ class intersectionPerformance:
             target_junction_id = target.replace(' ', '').split(',')
             # print('target'+ str(target.replace(' ', '').split(',')))
 
-        graph = build_graph(self.netfile)
-        edgedata = read_last_dump(self.dumpfile)
-
-        junction_list = graph.junctions
-        junction_summary_table = pd.DataFrame(
-            columns=['Juction_id', 'speed_avg', 'volume_avg', 'timeLoss_avg'])
-        for j_id, junction in junction_list.items():
-            if len(junction.inEdges) <= 2:
-                continue
-            # print(j_id)
-            if have_target and j_id not in target_junction_id:
-                continue
-            # print(j_id)
-            upstream_list = []
-            for edge in junction.inEdges:
-                upstream_list.append(edge.id[0])
-            junction_data = edgedata[edgedata["edgeID"].isin(upstream_list)]
-            speed_avg = (
-                junction_data['speed'] * junction_data['left']).sum() / junction_data['left'].sum()
-            waitingTime_avg = (
-                junction_data['waitingTime'] * junction_data['left']).sum() / junction_data['left'].sum()
-            timeLoss_avg = (
-                junction_data['timeLoss'] * junction_data['left']).sum() / junction_data['left'].sum()
-            volume_avg = (
-                junction_data['speed'] * 3.6 * junction_data['density']).mean()
-            junction_summary_dic = {"Juction_id": j_id, "speed_avg": speed_avg,
-                                    "volume_avg": volume_avg, "timeLoss_avg": timeLoss_avg}
-            new_row = pd.DataFrame(junction_summary_dic, index=[0])
-            junction_summary_table = pd.concat(
-                [junction_summary_table, new_row], axis=0).reset_index(drop=True)
-            # print(junction_summary_dic)
+        graph = get_graph(self.netfile)
+        edgedata = get_kpi_store(self.dumpfile).kpi_frame()
+
+        junction_summary_table = summarize_junctions(
+            graph, edgedata, target_junction_id if have_target else None)
         sorted_table = junction_summary_table.sort_values(
             by=['speed_avg', 'volume_avg', 'timeLoss_avg'], ascending=[True, False, False]).reset_index(drop=True)
         # print(sorted_table)
         if 'None' in target.replace(' ', ''):
             msg = 'No specific target intersections. So, I can show you the overview by providing the traffic status of 5 intersections in the worst operating condition by default. Make sure you output the tabular content in markdown format into your final answer. \n'
-            return msg + sorted_table.head().to_markdown()
+            return table_observation(msg, sorted_table.head())
         elif 'All' in target.replace(' ', ''):
             msg = 'Here are the traffic status of all intersections. Make sure you output the tabular content in markdown format into your final answer. \n'
-            return msg + sorted_table.to_markdown()
+            return table_observation(msg, sorted_table)
         else:
             msg = 'Here are the traffic status of your targeted intersections. Make sure you output the tabular content in markdown format into your final answer. \n'
-            return msg + sorted_table.to_markdown()
+            return table_observation(msg, sorted_table)
 
 
 class intersectionSignalOptimization:
-    def __init__(self, netfile: str, configfile: str, routefile: str, tlsfile: str) -> None:
+    # 修改仿真使用的 TLS 文件
+    pool = 'simulation'
+    writes = ('tls',)
+
+    def __init__(self, netfile: str, configfile: str, routefile: str, tlsfile: str, processes: int = 1) -> None:
         self.netfile = netfile
         self.configfile = configfile
         self.routefile = routefile
         self.tlsfile = tlsfile
+        self.processes = processes
 
     @prompts(name='Optimize Intersection Signal Control Scheme',
              description="""
@@ -166,7 +192,7 @@ class intersectionSignalOptimization:
         if 'None' in target:
             return "Please provide the target intersection IDs."
 
-        options = f'-n {self.netfile} -f {self.configfile} -r {self.routefile} -o {self.tlsfile}'
+        options = f'-n {self.netfile} -f {self.configfile} -r {self.routefile} -o {self.tlsfile} -j {self.processes} --incremental'
         target_ID = target.replace(' ', '').split(',')
 
         optimizer = Webster(target_ID, options)
@@ -177,6 +203,9 @@ class intersectionSignalOptimization:
 
 
 class intersectionVisulization:
+    # 只读取不变的路网
+    reads = ()
+
     def __init__(self, netfile: str, figfolder: str) -> None:
         self.netfile = netfile
         self.figfolder = figfolder
@@ -186,16 +215,19 @@ class intersectionVisulization:
             This tool is used to show the locations of several target intersections by visualize them on a map.
             Use this tool more than others if the question is about locations of intersections.
             The output will tell you whether you have finished this command successfully.
-            The input should be a comma seperated string, with each part representing a target intersection ID. """)
+            The input should be a comma seperated string, with each part representing a target intersection ID. 
+            Only if the human user asks for a full-resolution figure for a report, append ";report" to the input. For example: J1,J2;report""")
     def inference(self, target: str) -> str:
 
+        target, profile = split_profile(target)
         target_junction_id = target.replace(' ', '').split(',')
         options = f'-n {self.netfile} --width 5 --edge-color #606060'
 
         fig_path = plot_intersections(
             target_junction_id,
             self.figfolder,
-            options
+            options,
+            profile
         )
 
         return f"You have successfully visualized the location of intersection {target} on the following map. And your final answer should include this sentence without changing anything: The location of intersection {target} is kept at: `{fig_path}`."
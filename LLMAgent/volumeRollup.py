@@ -0,0 +1,227 @@
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from LLMAgent.dbConnector import get_engine, has_table
+from LLMAgent.resultCache import RESULT_CACHE
+from LLMAgent.roadTripIndex import INDEX_TABLE
+
+
+ROAD_ROLLUPS = ['road_volume_per_hour', 'road_volume_per_day']
+OD_ROLLUPS = ['od_volume_per_hour', 'od_volume_per_day']
+
+CREATE_STATEMENTS = [
+    "CREATE TABLE IF NOT EXISTS road_volume_per_hour (hour_start TIMESTAMP, road VARCHAR(50), road_count INT)",
+    "CREATE TABLE IF NOT EXISTS road_volume_per_day (day_start TIMESTAMP, road VARCHAR(50), road_count BIGINT)",
+    "CREATE TABLE IF NOT EXISTS od_volume_per_hour (hour_start TIMESTAMP, o_zone VARCHAR(50), d_zone VARCHAR(50), od_count BIGINT)",
+    "CREATE TABLE IF NOT EXISTS od_volume_per_day (day_start TIMESTAMP, o_zone VARCHAR(50), d_zone VARCHAR(50), od_count BIGINT)",
+    "CREATE INDEX IF NOT EXISTS road_volume_per_hour_hour_start_idx ON road_volume_per_hour (hour_start)",
+    "CREATE INDEX IF NOT EXISTS road_volume_per_day_day_start_idx ON road_volume_per_day (day_start)",
+    "CREATE INDEX IF NOT EXISTS od_volume_per_hour_hour_start_idx ON od_volume_per_hour (hour_start)",
+    "CREATE INDEX IF NOT EXISTS od_volume_per_day_day_start_idx ON od_volume_per_day (day_start)",
+]
+
+# 每张汇总表各自从其最新的时段开始重新汇总（该时段可能不完整）；
+# 空表从头汇总。日汇总由小时汇总生成，因此排在小时汇总之后
+ROLLUP_REFRESH = [
+    ('road_volume_per_hour', 'hour_start', [
+        "DELETE FROM road_volume_per_hour WHERE hour_start >= :watermark",
+        """
+        INSERT INTO road_volume_per_hour
+        SELECT
+          DATE_TRUNC('hour', departure_time) AS hour_start,
+          unnest(string_to_array(path, '-')) AS road,
+          COUNT(*) AS road_count
+        FROM the_synthetic_individual_level_trip_dataset
+        WHERE departure_time >= :watermark
+        GROUP BY hour_start, road
+        """,
+    ]),
+    ('od_volume_per_hour', 'hour_start', [
+        "DELETE FROM od_volume_per_hour WHERE hour_start >= :watermark",
+        """
+        INSERT INTO od_volume_per_hour
+        SELECT DATE_TRUNC('hour', departure_time) AS hour_start, o_zone, d_zone, COUNT(*) AS od_count
+        FROM the_synthetic_individual_level_trip_dataset
+        WHERE departure_time >= :watermark
+        GROUP BY hour_start, o_zone, d_zone
+        """,
+    ]),
+    ('road_volume_per_day', 'day_start', [
+        "DELETE FROM road_volume_per_day WHERE day_start >= :watermark",
+        """
+        INSERT INTO road_volume_per_day
+        SELECT DATE_TRUNC('day', hour_start) AS day_start, road, SUM(road_count) AS road_count
+        FROM road_volume_per_hour
+        WHERE hour_start >= :watermark
+        GROUP BY day_start, road
+        """,
+    ]),
+    ('od_volume_per_day', 'day_start', [
+        "DELETE FROM od_volume_per_day WHERE day_start >= :watermark",
+        """
+        INSERT INTO od_volume_per_day
+        SELECT DATE_TRUNC('day', hour_start) AS day_start, o_zone, d_zone, SUM(od_count) AS od_count
+        FROM od_volume_per_hour
+        WHERE hour_start >= :watermark
+        GROUP BY day_start, o_zone, d_zone
+        """,
+    ]),
+]
+
+INDEX_REFRESH = (INDEX_TABLE, 'hour_start', [
+    f"DELETE FROM {INDEX_TABLE} WHERE hour_start >= :watermark",
+    f"""
+    INSERT INTO {INDEX_TABLE}
+    SELECT DISTINCT
+      unnest(string_to_array(path, '-'))::VARCHAR(50) AS road,
+      trip_id,
+      DATE_TRUNC('hour', departure_time) AS hour_start
+    FROM the_synthetic_individual_level_trip_dataset
+    WHERE departure_time >= :watermark
+    """,
+])
+
+
+def refresh_rollups(full: bool = False) -> dict:
+    """Bring the rollups up to date with the trip table.
+
+    Trips are assumed to land in departure order: each table only
+    aggregates again from its own latest period on, and an empty table is
+    filled from scratch. `full` rebuilds everything. Cached query results
+    are dropped. Returns the watermark each table was refreshed from.
+    """
+    watermarks = {}
+    with get_engine().begin() as conn:
+        for statement in CREATE_STATEMENTS:
+            conn.execute(sa.text(statement))
+        refresh = ROLLUP_REFRESH
+        if sa.inspect(conn).has_table(INDEX_TABLE):
+            refresh = refresh + [INDEX_REFRESH]
+        for table, column, statements in refresh:
+            watermark = None
+            if not full:
+                watermark = conn.execute(sa.text(f"SELECT MAX({column}) FROM {table}")).scalar()
+            watermarks[table] = watermark or datetime.min
+            for statement in statements:
+                conn.execute(sa.text(statement), {'watermark': watermarks[table]})
+        for table in ROAD_ROLLUPS + OD_ROLLUPS:
+            conn.execute(sa.text(f"ANALYZE {table}"))
+    with _watermarksLock:
+        _rollupWatermarks.clear()
+    RESULT_CACHE.clear()
+    return watermarks
+
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def floor_time(t: datetime, step: timedelta) -> datetime:
+    return datetime.min + (t - datetime.min) // step * step
+
+
+def ceil_time(t: datetime, step: timedelta) -> datetime:
+    return datetime.min - (datetime.min - t) // step * step
+
+
+def to_datetime(t) -> datetime:
+    if isinstance(t, datetime):
+        return t
+    return datetime.fromisoformat(t.strip())
+
+
+def plan_window(begin, end, raw: bool) -> dict:
+    """Split [begin, end) into whole days, hours around them, and (with
+    `raw`) the minutes at both ends that only the trip table can answer.
+
+    Without `raw` the window is counted in hourly buckets, like the
+    road_volume_per_hour queries: an hour is included if it starts inside it.
+    Unused segments are empty ranges.
+    """
+    b = to_datetime(begin)
+    e = max(to_datetime(end), b)
+    rawHead = rawTail = (b, b)
+    if raw:
+        hb, he = ceil_time(b, HOUR), floor_time(e, HOUR)
+        if hb >= he:
+            rawHead, hb, he = (b, e), b, b
+        else:
+            rawHead, rawTail = (b, hb), (he, e)
+    else:
+        hb, he = ceil_time(b, HOUR), ceil_time(e, HOUR)
+    db, de = ceil_time(hb, DAY), floor_time(he, DAY)
+    if db >= de:
+        head, days, tail = (hb, he), (hb, hb), (hb, hb)
+    else:
+        head, days, tail = (hb, db), (db, de), (de, he)
+
+    plan = {}
+    for name, (lo, hi) in [('day', days), ('head', head), ('tail', tail)]:
+        plan[f'{name}_begin'], plan[f'{name}_end'] = str(lo), str(hi)
+    if raw:
+        for name, (lo, hi) in [('raw_head', rawHead), ('raw_tail', rawTail)]:
+            plan[f'{name}_begin'], plan[f'{name}_end'] = str(lo), str(hi)
+    return plan
+
+
+# 汇总表可能由其他进程刷新，覆盖范围定期重新读取
+WATERMARK_TTL = 600.
+# (hourly table, daily table) -> (time read, watermark or None)
+_rollupWatermarks: dict[tuple, tuple[float, datetime]] = {}
+_watermarksLock = threading.Lock()
+
+
+def read_watermark(hourly: str, daily: str):
+    """The time up to which both rollups are complete: the start of their
+    latest, possibly partial, hour and the end of the day before their
+    latest day. None if a table is missing or empty."""
+    if not (has_table(hourly) and has_table(daily)):
+        return None
+    with get_engine().connect() as conn:
+        lastHour = conn.execute(sa.text(f"SELECT MAX(hour_start) FROM {hourly}")).scalar()
+        lastDay = conn.execute(sa.text(f"SELECT MAX(day_start) FROM {daily}")).scalar()
+    if lastHour is None or lastDay is None:
+        return None
+    return min(lastHour, lastDay + DAY)
+
+
+def rollup_watermark(tables: list[str]):
+    key = tuple(tables)
+    now = time.monotonic()
+    with _watermarksLock:
+        cached = _rollupWatermarks.get(key)
+    if cached is None or cached[0] + WATERMARK_TTL < now:
+        cached = (now, read_watermark(*tables))
+        with _watermarksLock:
+            _rollupWatermarks[key] = cached
+    return cached[1]
+
+
+def plan_volume_query(name: str, begin, end) -> tuple[str, dict]:
+    """Choose between the `name` query on the base tables and its `_rollup`
+    variant, and return the query name with its time parameters.
+
+    The rollups only answer windows that end before their watermark; later
+    windows are counted on the base tables."""
+    tables = OD_ROLLUPS if name.startswith('od') else ROAD_ROLLUPS
+    watermark = rollup_watermark(tables)
+    if watermark is not None:
+        try:
+            if to_datetime(end) <= watermark:
+                return f'{name}_rollup', plan_window(begin, end, raw=name.startswith('od'))
+        except ValueError:
+            # 无法解析的时间交给数据库处理
+            pass
+    return name, {'begin': begin, 'end': end}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Refresh the road and OD volume rollups.')
+    parser.add_argument('--full', action='store_true', help='rebuild all rollups instead of only the latest hours')
+    args = parser.parse_args()
+    for table, watermark in refresh_rollups(args.full).items():
+        print(f'{table} is refreshed from {watermark}.')
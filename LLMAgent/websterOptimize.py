@@ -66,25 +66,40 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import collections
+import concurrent.futures
+import hashlib
+import json
 import sys
 import os
+import weakref
+import numpy as np
 import sumolib
 
+from LLMAgent.routeIndex import get_route_index
+from LLMAgent.netCache import get_net
 
 
-def getEdges(veh, net, routes):
-    if isinstance(veh.route, str):
-        edges = routes[veh.route]
-    else:
-        edges = veh.route[0].edges
-    return [net.getEdge(e) for e in edges.split()]
+# net -> {(inEdgeID, outEdgeID): [(tlsID, linkIndex), ..]}
+_tlsConnectionMaps = weakref.WeakKeyDictionary()
 
-def getRoutes(files):
-    route_dict = {}
-    for file in files:
-        for route in sumolib.output.parse(file, 'route'):
-            route_dict[route.id] = route.edges
-    return route_dict
+def getTLSConnectionMap(net):
+    # the TLS controlling an edge transition is the one of the incoming edge,
+    # rail crossings and rail signals excluded
+    if net not in _tlsConnectionMaps:
+        connMap = collections.defaultdict(list)
+        for edge in net.getEdges():
+            if edge.getToNode().getType() in ("rail_crossing", "rail_signal"):
+                continue
+            tls = edge.getTLS()
+            if not tls:
+                continue
+            # c: [[inLane, outLane, linkNo],[],..]
+            for c in tls.getConnections():
+                if c[0].getEdge() == edge:
+                    connMap[(edge.getID(), c[1].getEdge().getID())].append(
+                        (tls.getID(), c[2]))
+        _tlsConnectionMaps[net] = dict(connMap)
+    return _tlsConnectionMaps[net]
 
 def getFlows( net, routeFiles, tlsList, begin, scale_fac, verbose, isSorted=False):
     tlsFlowsMap = {}
@@ -92,40 +107,26 @@ def getFlows( net, routeFiles, tlsList, begin, scale_fac, verbose, isSorted=Fals
     for tls in tlsList:
         tlsFlowsMap[tls._id] = collections.defaultdict(
             lambda: collections.defaultdict(int))
-    route_dict = getRoutes(routeFiles.split(','))
-    for file in routeFiles.split(','):
+    connMap = getTLSConnectionMap(net)
+    indexes = [get_route_index(file) for file in routeFiles.split(',')]
+    for file, routeIndex in zip(routeFiles.split(','), indexes):
         if verbose:
             print("parsing route file:", file)
-        triggered = parsed = 0
-        for veh in sumolib.output.parse(file, 'vehicle'):
-            if veh.depart == "triggered":
-                triggered += 1
-                continue
-            if sumolib.miscutils.parseTime(veh.depart) >= end:
-                if isSorted:
-                    break
-                continue
-            if sumolib.miscutils.parseTime(veh.depart) >= begin:
-                edgeList = getEdges(veh, net, route_dict)
-                for idx, edge in enumerate(edgeList):
-                    tls = None if edge.getToNode().getType() in (
-                        "rail_crossing", "rail_signal") else edge.getTLS()
-                    if tls and idx < len(edgeList) - 1:
-                        # c: [[inLane, outLane, linkNo],[],..]
-                        for c in tls.getConnections():
-                            inEdge = c[0].getEdge()
-                            outEdge = c[1].getEdge()
-                            if inEdge == edge and outEdge == edgeList[idx + 1]:
-                                pce = 1.
-                                if veh.type == "bicycle":
-                                    pce = 0.2
-                                elif veh.type in ["moped", "motorcycle"]:
-                                    pce = 0.5
-                                elif veh.type in ["truck", "trailer", "bus", "coach"]:
-                                    pce = 3.5
-                                tlsFlowsMap[tls.getID()][inEdge.getID(
-                                ) + " " + outEdge.getID()][c[2]] += pce
-                                parsed += 1
+        triggered = int(routeIndex.triggered.sum())
+        parsed = 0
+        departs = routeIndex.depart
+        if isSorted:
+            late = np.flatnonzero(departs >= end)
+            if len(late) > 0:
+                departs = departs[:late[0]]
+        for i in np.flatnonzero((departs >= begin) & (departs < end)):
+            edgeList = routeIndex.get_vehicle_edges(i, indexes)
+            pce = float(routeIndex.pce[i])
+            for idx in range(len(edgeList) - 1):
+                subRoute = edgeList[idx] + " " + edgeList[idx + 1]
+                for tlsID, linkIndex in connMap.get((edgeList[idx], edgeList[idx + 1]), ()):
+                    tlsFlowsMap[tlsID][subRoute][linkIndex] += pce
+                    parsed += 1
         if triggered > 0:
             print("Warning: Ignored %s triggered vehicles in %s." %
                     (triggered, file))
@@ -468,16 +469,13 @@ def checkRoutePeriod(routefiles, begin):
     veh_starttime = -1.
     veh_endtime = -1.
     for file in routefiles.split(','):
-        for veh in sumolib.output.parse(file, 'vehicle'):
-            if veh.depart != "triggered":
-                depart = float(veh.depart)
-                if veh_starttime == -1.:
-                    veh_starttime = veh_endtime = depart
-
-                if veh_endtime < depart:
-                    veh_endtime = depart
-                if veh_starttime > depart:
-                    veh_starttime = depart
+        departs = get_route_index(file).depart
+        departs = departs[~np.isnan(departs)]
+        if len(departs) > 0:
+            if veh_starttime == -1.:
+                veh_starttime = veh_endtime = float(departs[0])
+            veh_endtime = max(veh_endtime, float(departs.max()))
+            veh_starttime = min(veh_starttime, float(departs.min()))
 
     # check the begin time
     checkPeak = False
@@ -503,25 +501,20 @@ def checkRoutePeriod(routefiles, begin):
     return begin, scale_fac
 
 def getPeakFlowBegin(routefiles, begin, veh_endtime):
-    minuteFlowMap = {}
     end_intl = int(veh_endtime//60.)+1
-    for n in range(0, end_intl+1):
-        minuteFlowMap[n] = 0.
     peak_begin = begin
     peakFlow = 0.
 
+    departs = []
+    pces = []
     for file in routefiles.split(','):
-        for veh in sumolib.output.parse(file, 'vehicle'):
-            if veh.depart != "triggered" and sumolib.miscutils.parseTime(veh.depart) >= begin:
-                pce = 1.
-                if veh.type == "bicycle":
-                    pce = 0.2
-                elif veh.type in ["moped", "motorcycle"]:
-                    pce = 0.5
-                elif veh.type in ["truck", "trailer", "bus", "coach"]:
-                    pce = 3.5
-                intl = int(float(veh.depart)//60.)
-                minuteFlowMap[intl] += pce
+        routeIndex = get_route_index(file)
+        counted = routeIndex.depart >= begin   # False for triggered vehicles
+        departs.append(routeIndex.depart[counted])
+        pces.append(routeIndex.pce[counted])
+    minuteFlowMap = np.bincount(
+        (np.concatenate(departs) // 60.).astype(np.int64),
+        weights=np.concatenate(pces), minlength=end_intl+1).tolist()
 
     for i in range(0, end_intl-59):
         temp_sum = 0
@@ -538,6 +531,141 @@ def getPeakFlowBegin(routefiles, begin, veh_endtime):
 
     return peak_begin, peakFlow
 
+def getTLSCycles(tl, connFlowsMap, multiOwnGreen, options):
+    """Optimized cycle lengths of all programs of tl (first step of --unified-cycle)."""
+    multiOwnGreenMap = {tl._id: multiOwnGreen}
+    getmultiOwnGreen = False
+    cycleList = []
+    if options.verbose:
+        print("tl-logic ID: %s" % tl._id)
+    programs = tl.getPrograms()
+    for pro in programs:
+        phases = programs[pro].getPhases()
+
+        # get the connection flows and group flows
+        r = getLaneGroupFlows(
+            tl, connFlowsMap, phases, 0, multiOwnGreenMap, getmultiOwnGreen, options)
+        groupFlowsMap, phaseLaneIndexMap, currentLength, multiOwnGreenMap, getmultiOwnGreen = r
+
+        # only optimize the cycle length
+        cycleList = getMaxOptimizedCycle(groupFlowsMap, phaseLaneIndexMap,
+                                                currentLength, cycleList, multiOwnGreenMap, options)
+    return cycleList, multiOwnGreenMap[tl._id]
+
+def getTLSLogic(tl, connFlowsMap, multiOwnGreen, options):
+    """Optimize the green splits of tl and return its new tlLogic definition."""
+    multiOwnGreenMap = {tl._id: multiOwnGreen}
+    getmultiOwnGreen = False
+    if options.verbose:
+        print("tl-logic ID: %s" % tl._id)
+    programs = tl.getPrograms()
+    for pro in programs:
+        phases = programs[pro].getPhases()
+
+        # get the connection flows and group flows
+        r = getLaneGroupFlows(tl, connFlowsMap, phases, options.greenFilter,
+                                    multiOwnGreenMap, getmultiOwnGreen, options)
+        groupFlowsMap, phaseLaneIndexMap, currentLength, multiOwnGreenMap, getmultiOwnGreen = r
+
+        # optimize the cycle length and calculate the respective green splits
+        groupFlowsMap = optimizeGreenTime(tl, groupFlowsMap, phaseLaneIndexMap,
+                                                currentLength, multiOwnGreenMap, options)
+
+    # write output
+    lines = ['    <tlLogic id="%s" type="%s" programID="%s" offset="%i">\n' %
+                (tl._id, programs[pro]._type, options.program, programs[pro]._offset)]
+
+    phases = programs[pro].getPhases()
+    for i, p in enumerate(phases):
+        duration = p.duration
+        if i in groupFlowsMap:
+            duration = groupFlowsMap[i][0]
+        # the yellow phase
+        elif 'y' in p.state and 'r' in p.state:
+            duration = options.yellowtime
+        else:
+            print(
+                "Duration for Phase %s is from the input file." % i)
+        lines.append(
+            '        <phase duration="%s" state="%s"/>\n' % (duration, p.state))
+    lines.append('    </tlLogic>\n')
+    return ''.join(lines)
+
+# the network of a worker process of TLSOptimizer
+_workerNet = None
+
+def _initWorker(netfile):
+    global _workerNet
+    _workerNet = get_net(
+        netfile, withPrograms=True, withPedestrianConnections=True)
+
+def _runInWorker(func, tlsID, connFlows, multiOwnGreen, options):
+    return func(_workerNet.getTLS(tlsID), connFlows, multiOwnGreen, options)
+
+class TLSOptimizer:
+    """Runs a per-TLS step for a list of TLS, in a process pool if
+    options.processes > 1. Results are returned in the order of the TLS list."""
+
+    def __init__(self, options, connFlowsMap):
+        self.options = options
+        self.connFlowsMap = connFlowsMap
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def map(self, func, tlsList, multiOwnGreenMap, options):
+        tlsIDs = [tl._id for tl in tlsList]
+        if self.options.processes > 1 and len(tlsList) > 1 and self.pool is None:
+            # the network can not be pickled, so every worker reads its own
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(self.options.processes, len(tlsList)),
+                initializer=_initWorker, initargs=(self.options.netfile,))
+        if self.pool is None:
+            results = [func(tl, self.connFlowsMap, multiOwnGreenMap[tl._id], options)
+                       for tl in tlsList]
+        else:
+            # only the flows of its own TLS are sent to a worker
+            results = self.pool.map(
+                _runInWorker, [func] * len(tlsIDs), tlsIDs,
+                [{tlsID: self.connFlowsMap[tlsID]} for tlsID in tlsIDs],
+                [multiOwnGreenMap[tlsID] for tlsID in tlsIDs],
+                [options] * len(tlsIDs))
+        return zip(tlsIDs, results)
+
+# the options a tlLogic computed by getTLSLogic depends on
+FINGERPRINT_OPTIONS = [
+    'yellowtime', 'allred', 'losttime', 'mingreen', 'greenFilter', 'mincycle', 'maxcycle',
+    'existcycle', 'program', 'satheadway', 'restrict', 'unified_cycle'
+]
+
+def getTLSFingerprint(tl, connFlowsMap, options):
+    """Hash of everything the optimized program of tl is computed from."""
+    h = hashlib.sha1()
+    h.update(repr(sorted(connFlowsMap[tl._id].items())).encode())
+    programs = tl.getPrograms()
+    for pro in programs:
+        h.update(repr((pro, programs[pro]._type, programs[pro]._offset,
+                       [(p.duration, p.state) for p in programs[pro].getPhases()])).encode())
+    h.update(repr([getattr(options, o) for o in FINGERPRINT_OPTIONS]).encode())
+    return h.hexdigest()
+
+def loadTLSStore(storefile):
+    """tlsID -> {"fingerprint": .., "tlLogic": ..} of earlier optimizations."""
+    try:
+        with open(storefile, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def saveTLSStore(storefile, store):
+    with open(storefile, 'w', encoding='utf-8') as f:
+        json.dump(store, f, indent=1)
+
 class Webster:
     """韦伯斯特信号配时优化"""
  
@@ -588,6 +716,10 @@ class Webster:
                              help="assume the route file is sorted (aborts reading earlier)")
         optParser.add_option("--skip", category="processing", dest="skip",
                              default='', help="the tls ids, which are skipped and seperated by comma")
+        optParser.add_option("--incremental", category="processing", dest="incremental", action="store_true",
+                             default=False, help="keep the programs of earlier runs in OUTFILE.json and only recompute changed ones")
+        optParser.add_option("-j", "--processes", category="processing", dest="processes", type=int, default=1,
+                             help="optimize the intersections in parallel with INT worker processes")
         optParser.add_option("-v", "--verbose", category="processing", dest="verbose", action="store_true",
                              default=False, help="tell me what you are doing")
         return optParser.parse_args(args=args)
@@ -600,7 +732,7 @@ class Webster:
         begin, scale_fac = checkRoutePeriod(
             self.options.routefiles, self.options.begin)
 
-        net = sumolib.net.readNet(
+        net = get_net(
             self.options.netfile, withPrograms=True, withPedestrianConnections=True)
         tlsList = net.getTrafficLights()
         skipList = []
@@ -614,91 +746,74 @@ class Webster:
         connFlowsMap = getFlows(
             net, self.options.routefiles, tlsList, begin, scale_fac, self.options.verbose, self.options.sorted)
 
+        # with --incremental, the intersections optimized in earlier runs are
+        # kept and only recomputed if their flows, programs or options changed
+        store = {}
+        targetIDs = list(self.target_ID)
+        if self.options.incremental:
+            store = loadTLSStore(self.options.outfile + '.json')
+            targetIDs += [tlsID for tlsID in store if tlsID not in targetIDs]
+
         # remove the tls where no traffic volumes exist and which should be skipped
         effectiveTlsList = getEffectiveTlsList(
-            tlsList, connFlowsMap, skipList, self.options.verbose, self.target_ID)
+            tlsList, connFlowsMap, skipList, self.options.verbose, targetIDs)
         print(len(effectiveTlsList))
 
         # prepare a map for any connection flow has more than one major-green in states
         multiOwnGreenMap = {}
-        getmultiOwnGreen = False
         for tl in effectiveTlsList:
             multiOwnGreenMap[tl._id] = []
 
         with open(self.options.outfile, 'w') as outf:
             sumolib.xml.writeHeader(outf, root="additional", options=self.options)
             if len(effectiveTlsList) > 0:
-                if self.options.unified_cycle:
-                    cycleList = []
-                    if self.options.verbose:
-                        print(
-                            "Firstly only calculate the maximal optimized cycle length! ")
-                    for tl in effectiveTlsList:
+                with TLSOptimizer(self.options, connFlowsMap) as tlsOptimizer:
+                    if self.options.unified_cycle:
+                        if self.options.verbose:
+                            print(
+                                "Firstly only calculate the maximal optimized cycle length! ")
+                        cycleList = []
+                        for tlsID, (cycles, multiOwnGreen) in tlsOptimizer.map(
+                                getTLSCycles, effectiveTlsList, multiOwnGreenMap, self.options):
+                            cycleList += cycles
+                            multiOwnGreenMap[tlsID] = multiOwnGreen
+
+                        self.options.maxcycle = max(cycleList)
+                        self.options.mincycle = max(cycleList)
+                        self.options.restrict = True
                         if self.options.verbose:
-                            print("tl-logic ID: %s" % tl._id)
-                        programs = tl.getPrograms()
-                        for pro in programs:
-                            phases = programs[pro].getPhases()
-
-                            # get the connection flows and group flows
-                            r = getLaneGroupFlows(
-                                tl, connFlowsMap, phases, 0, multiOwnGreenMap, getmultiOwnGreen, self.options)
-                            groupFlowsMap, phaseLaneIndexMap, currentLength, multiOwnGreenMap, getmultiOwnGreen = r
-
-                            # only optimize the cycle length
-                            cycleList = getMaxOptimizedCycle(groupFlowsMap, phaseLaneIndexMap,
-                                                                    currentLength, cycleList, multiOwnGreenMap, self.options)
-
-                    self.options.maxcycle = max(cycleList)
-                    self.options.mincycle = max(cycleList)
-                    self.options.restrict = True
-                    if self.options.verbose:
-                        print("The maximal optimized cycle length is %s." %
-                                max(cycleList))
-                        print(
-                            " It will be used for calculating the green splits for all intersections.")
-
-                # calculate the green splits;
-                # the optimal length will be also calculate if options.unified_cycle is set as false.
-                for tl in effectiveTlsList:
-                    if self.options.verbose:
-                        print("tl-logic ID: %s" % tl._id)
-                    programs = tl.getPrograms()
-                    for pro in programs:
-                        phases = programs[pro].getPhases()
-
-                        # get the connection flows and group flows
-                        r = getLaneGroupFlows(tl, connFlowsMap, phases, self.options.greenFilter,
-                                                    multiOwnGreenMap, getmultiOwnGreen, self.options)
-                        groupFlowsMap, phaseLaneIndexMap, currentLength, multiOwnGreenMap, getmultiOwnGreen = r
-
-                        # optimize the cycle length and calculate the respective green splits
-                        groupFlowsMap = optimizeGreenTime(tl, groupFlowsMap, phaseLaneIndexMap,
-                                                                currentLength, multiOwnGreenMap, self.options)
-
-                    # write output
-                    outf.write('    <tlLogic id="%s" type="%s" programID="%s" offset="%i">\n' %
-                                (tl._id, programs[pro]._type, self.options.program, programs[pro]._offset))
-
-                    phases = programs[pro].getPhases()
-                    for i, p in enumerate(phases):
-                        duration = p.duration
-                        if i in groupFlowsMap:
-                            duration = groupFlowsMap[i][0]
-                        # the yellow phase
-                        elif 'y' in p.state and 'r' in p.state:
-                            duration = self.options.yellowtime
-                        else:
+                            print("The maximal optimized cycle length is %s." %
+                                    max(cycleList))
                             print(
-                                "Duration for Phase %s is from the input file." % i)
-                        outf.write(
-                            '        <phase duration="%s" state="%s"/>\n' % (duration, p.state))
-                    outf.write('    </tlLogic>\n')
+                                " It will be used for calculating the green splits for all intersections.")
+
+                    fingerprints = {}
+                    changedTlsList = []
+                    for tl in effectiveTlsList:
+                        fingerprints[tl._id] = getTLSFingerprint(tl, connFlowsMap, self.options)
+                        if tl._id not in store or store[tl._id]['fingerprint'] != fingerprints[tl._id]:
+                            changedTlsList.append(tl)
+                    if self.options.verbose and self.options.incremental:
+                        print("Reuse the optimized programs of %s tls." %
+                                (len(effectiveTlsList) - len(changedTlsList)))
+
+                    # calculate the green splits;
+                    # the optimal length will be also calculate if options.unified_cycle is set as false.
+                    for tlsID, tlLogic in tlsOptimizer.map(
+                            getTLSLogic, changedTlsList, multiOwnGreenMap, self.options):
+                        store[tlsID] = {'fingerprint': fingerprints[tlsID], 'tlLogic': tlLogic}
+                    store = {tl._id: store[tl._id] for tl in effectiveTlsList}
+                    for tlsID in store:
+                        outf.write(store[tlsID]['tlLogic'])
             else:
+                store = {}
                 print(
                     "There are no flows at the given intersections. No green time optimization is done.")
             outf.write('</additional>\n')
 
+        if self.options.incremental:
+            saveTLSStore(self.options.outfile + '.json', store)
+
     def add_TLS(self):
         tls_file = os.path.basename(self.options.outfile)
         oldStr1 = '<additional-files value="add.add.xml"/>'
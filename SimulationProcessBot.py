@@ -6,6 +6,9 @@ from rich import print
 from langchain.chat_models import AzureChatOpenAI, ChatOpenAI
 
 from LLMAgent.ConversationBot import ConversationBot
+from LLMAgent.replayLLM import TranscriptRecorder
+from LLMAgent.renderProfile import configure_render_profiles
+from LLMAgent.resultHandles import RESULT_STORE, find_handles
 
 from LLMAgent.trafficTools import (
     simulationControl,
@@ -49,10 +52,13 @@ elif OPENAI_CONFIG['OPENAI_API_TYPE'] == 'openai':
 if not os.path.exists('./fig/'):
     os.mkdir('./fig/')
 
+# 图片默认以快速预览输出，可在 config.yaml 中修改
+configure_render_profiles(OPENAI_CONFIG)
+
 
 sumoCFGFile = './real-world-simulation-withTLS/xuancheng.sumocfg'
 sumoNetFile = './real-world-simulation-withTLS/xuancheng.net.xml'
-sumoRouFile = './real-world-simulation-withTLS/xuancheng.net.xml'
+sumoRouFile = './real-world-simulation-withTLS/xuancheng.rou.xml'
 sumoEdgeDataFile = './real-world-simulation-withTLS/edgedata.xml'
 sumoOriginalStateFile = './real-world-simulation-withTLS/originalstate.xml'
 sumoTempStateFile = './real-world-simulation-withTLS/tempstate.xml'
@@ -117,25 +123,39 @@ According to the data above, after optimization, Traffic volume has increased at
 """
 
 # ------------------------------------------------------------------------------
-# --ZH 初始化对话模型
-# --EN Initilize the ConversationBot
-bot = ConversationBot(llm, toolModels, botPrefix, verbose=True)
+# --ZH 初始化对话模型，每个浏览器会话使用自己的对话模型，工具在会话之间共享
+# --EN Initilize the ConversationBot, one per browser session. The tools are
+#      shared by all sessions
+def new_bot() -> ConversationBot:
+    callbacks = []
+    if OPENAI_CONFIG.get('RECORD_TRANSCRIPT'):
+        # 录制对话，用于离线基准测试
+        callbacks.append(TranscriptRecorder(OPENAI_CONFIG['RECORD_TRANSCRIPT'], 'simulation'))
+    return ConversationBot(
+        llm, toolModels, botPrefix, verbose=True,
+        memoryTokenLimit=OPENAI_CONFIG.get('MEMORY_TOKEN_LIMIT', 2000),
+        callbacks=callbacks
+    )
 
 # ------------------------------------------------------------------------------
 # --ZH 设置 gradio 界面
 # --EN Configure the grdio interface
 
 
-def reset(chat_history: list, thoughts: str):
+def reset(chat_history: list, thoughts: str, bot: ConversationBot):
     chat_history = []
     thoughts = ""
-    bot.agent_memory.clear()
-    bot.ch.memory = [[]]
-    return chat_history, thoughts
+    if bot is not None:
+        bot.agent_memory.clear()
+        bot.ch.memory = [[]]
+        bot.turn_usage = []
+    return chat_history, thoughts, bot, gr.update(value=None, visible=False)
 
 
-def respond(msg: str, chat_history: list, thoughts: str):
-    res, cb = bot.dialogue(msg)
+async def respond(msg: str, chat_history: list, thoughts: str, bot: ConversationBot):
+    if bot is None:
+        bot = new_bot()
+    res, cb = await bot.adialogue(msg)
     regex = re.compile(r'`([^`]+)`')
     try:
         filenames = regex.findall(res)
@@ -154,7 +174,16 @@ def respond(msg: str, chat_history: list, thoughts: str):
         thoughts += actionMemory
         thoughts += '\n'
     thoughts += f"<<< {res}\n"
-    return "", chat_history, thoughts
+    thoughts += f"(tokens: prompt {cb.prompt_tokens}, completion {cb.completion_tokens}, chat history {bot.agent_memory.history_tokens})\n"
+
+    # 以句柄引用的完整表格不经过 LLM，直接显示在界面中
+    handles = find_handles(res)
+    table = RESULT_STORE.get(handles[-1]) if handles else None
+    if table is not None:
+        tableUpdate = gr.update(value=table, visible=True)
+    else:
+        tableUpdate = gr.update()
+    return "", chat_history, thoughts, bot, tableUpdate
 
 
 with gr.Blocks(
@@ -163,6 +192,9 @@ with gr.Blocks(
     with gr.Row(visible=True, variant="panel"):
         with gr.Column(visible=True, variant='default'):
             chatbot = gr.Chatbot(scale=2, height=650)
+            botState = gr.State()
+            resultTable = gr.Dataframe(
+                label='Full result table', interactive=False, visible=False)
 
             with gr.Row():
                 humanMsg = gr.Textbox(scale=2)
@@ -189,15 +221,17 @@ with gr.Blocks(
 
     humanMsg.submit(
         respond,
-        [humanMsg, chatbot, ReActMsg],
-        [humanMsg, chatbot, ReActMsg]
+        [humanMsg, chatbot, ReActMsg, botState],
+        [humanMsg, chatbot, ReActMsg, botState, resultTable]
     )
     submitBtn.click(
         respond,
-        [humanMsg, chatbot, ReActMsg],
-        [humanMsg, chatbot, ReActMsg]
+        [humanMsg, chatbot, ReActMsg, botState],
+        [humanMsg, chatbot, ReActMsg, botState, resultTable]
     )
-    clearBtn.click(reset, [chatbot, ReActMsg], [chatbot, ReActMsg])
+    clearBtn.click(reset, [chatbot, ReActMsg, botState], [chatbot, ReActMsg, botState, resultTable])
 
 if __name__ == "__main__":
+    # 同时处理多个会话的请求，耗时的工具不会阻塞其他用户
+    demo.queue(concurrency_count=OPENAI_CONFIG.get('CONCURRENCY_COUNT', 4))
     demo.launch()
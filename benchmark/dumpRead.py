@@ -0,0 +1,134 @@
+"""Time reading the last interval of an edgedata dump.
+
+Writes a synthetic dump of 40 intervals x 1260 edges and compares the
+minidom reader the tools used to call after every simulation step with
+the KPI store: a cold store reading the latest interval, a full read of
+the dump and ingesting one newly written interval:
+
+    python -m benchmark.dumpRead
+"""
+import argparse
+import os
+import tempfile
+import time
+import xml.dom.minidom
+
+import numpy as np
+import pandas as pd
+
+from LLMAgent.kpiStore import MEASURES, KPIStore
+
+
+def write_dump(path: str, intervals: int = 40, edges: int = 1260, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<meandata>\n')
+        for i in range(intervals):
+            f.write(f'    <interval begin="{i * 300:.2f}" end="{(i + 1) * 300:.2f}" id="dump">\n')
+            sampled = rng.choice([0., 1.], edges, p=[0.1, 0.9]) * rng.uniform(1, 500, edges)
+            for e in range(edges):
+                if sampled[e] == 0:
+                    f.write(f'        <edge id="e{e}" sampledSeconds="0.00" departed="0" arrived="0" '
+                            f'entered="0" left="0" laneChangedFrom="0" laneChangedTo="0"/>\n')
+                    continue
+                speed, waiting, loss, density = rng.uniform(0, [20, 60, 120, 80])
+                f.write(f'        <edge id="e{e}" sampledSeconds="{sampled[e]:.2f}" traveltime="12.34" '
+                        f'overlapTraveltime="12.50" density="{density:.2f}" laneDensity="{density / 2:.2f}" '
+                        f'occupancy="3.21" waitingTime="{waiting:.2f}" timeLoss="{loss:.2f}" '
+                        f'speed="{speed:.2f}" speedRelative="0.50" departed="{rng.integers(10)}" arrived="2" '
+                        f'entered="{rng.integers(50)}" left="{rng.integers(50)}" '
+                        f'laneChangedFrom="0" laneChangedTo="0"/>\n')
+            f.write('    </interval>\n')
+        f.write('</meandata>\n')
+
+
+def read_dump_text(dumpfile: str) -> str:
+    with open(dumpfile, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if text.rstrip().endswith('</meandata>'):
+        return text
+    return text[:text.rfind('</interval>') + len('</interval>')] + '\n</meandata>\n'
+
+
+def read_last_dump_minidom(dumpfile: str):
+    # the first reader: a DOM of the whole file, eval() per attribute
+    dom = xml.dom.minidom.parseString(read_dump_text(dumpfile))
+    interval = dom.documentElement.getElementsByTagName('interval')[-1]
+    rows = []
+    for edge in interval.getElementsByTagName('edge'):
+        measures = [float('nan')] * 5
+        if eval(edge.getAttribute('sampledSeconds')) != 0:
+            try:
+                measures = [eval(edge.getAttribute(m)) for m in MEASURES]
+            except SyntaxError:
+                pass
+        rows.append([edge.getAttribute('id'), *measures])
+    return pd.DataFrame(rows, columns=['edgeID', *MEASURES])
+
+
+def read_latest_interval(dumpfile: str):
+    store = KPIStore.empty()
+    store.ingest(dumpfile, tail=True)
+    return store.kpi_frame()
+
+
+def read_whole_dump(dumpfile: str):
+    store = KPIStore.empty()
+    store.ingest(dumpfile)
+    return store.kpi_frame()
+
+
+def time_new_interval(dumpfile: str, repeat: int) -> float:
+    # a store holding all but the last interval ingests the one SUMO appended
+    with open(dumpfile, 'rb') as f:
+        data = f.read()
+    split = data.rfind(b'<interval')
+    stepfile = f'{dumpfile}.step.xml'
+    times = []
+    for _ in range(repeat):
+        with open(stepfile, 'wb') as f:
+            f.write(data[:split])
+        store = KPIStore.empty()
+        store.ingest(stepfile)
+        with open(stepfile, 'ab') as f:
+            f.write(data[split:])
+        start = time.perf_counter()
+        store.ingest(stepfile)
+        store.kpi_frame()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def best_time(func, *args, repeat: int = 3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Time reading the last interval of a synthetic edgedata dump')
+    ap.add_argument('--intervals', type=int, default=40)
+    ap.add_argument('--edges', type=int, default=1260)
+    ap.add_argument('-r', '--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        dumpfile = os.path.join(workdir, 'edgedata.xml')
+        write_dump(dumpfile, args.intervals, args.edges)
+        print(f'dump: {args.intervals} intervals x {args.edges} edges, '
+              f'{os.path.getsize(dumpfile) / 2 ** 20:.1f} MiB')
+        oldTime, old = best_time(read_last_dump_minidom, dumpfile, repeat=args.repeat)
+        latestTime, latest = best_time(read_latest_interval, dumpfile, repeat=args.repeat)
+        wholeTime, new = best_time(read_whole_dump, dumpfile, repeat=args.repeat)
+        stepTime = time_new_interval(dumpfile, args.repeat)
+    old = old.astype({m: float for m in MEASURES})
+    pd.testing.assert_frame_equal(old, new)
+    pd.testing.assert_frame_equal(old, latest)
+    print(f'minidom, whole dump: {oldTime:.3f} s')
+    print(f'KPI store, cold, latest interval: {latestTime:.3f} s')
+    print(f'KPI store, whole dump: {wholeTime:.3f} s')
+    print(f'KPI store, one new interval: {stepTime:.3f} s')
+    print('the last interval frames are identical')
@@ -0,0 +1,150 @@
+"""Build time and memory of buildGraph.Graph on a large network.
+
+Generates an 80 x 80 grid (about 25k edges) with SUMO's netgenerate, or
+uses --net, and compares build_graph with the object-per-lane classes it
+replaced:
+
+    python -m benchmark.graphMemory
+"""
+import argparse
+import gc
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from xml.etree import ElementTree as ET
+
+import sumolib
+
+from LLMAgent.buildGraph import build_graph
+
+
+# the classes before the columnar Graph, without their plotting methods
+class OldLane:
+    def __init__(self, id: str, speed: float, length: float, raw_shape: str) -> None:
+        self.id = id
+        self.speed = speed
+        self.length = length
+        self.shape = [list(map(float, p.split(','))) for p in raw_shape.split(' ')]
+
+
+class OldEdge:
+    def __init__(self, id: str, fromNode: str, toNode: str) -> None:
+        self.id = id,
+        self.fromNode = fromNode
+        self.toNode = toNode
+        self.lanes: dict[str, OldLane] = {}
+        self.next_edges: set[str] = set()
+        self.length: float = 0
+        self.freeFlowSpeed = 13.89
+
+    def get_length(self) -> None:
+        self.length = max(lane.length for lane in self.lanes.values())
+        self.capacity = 1800.0 * len(self.lanes)
+
+
+class OldJunction:
+    def __init__(self, id: str) -> None:
+        self.id = id
+        self.inEdges: set[OldEdge] = set()
+        self.outEdges: set[OldEdge] = set()
+
+    def calCap(self) -> float:
+        jCap = 0
+        nEdges = len(self.inEdges)
+        for edge in self.inEdges:
+            jCap += edge.capacity / nEdges
+        return jCap
+
+
+class OldGraph:
+    def __init__(self) -> None:
+        self.edges: dict[str, OldEdge] = {}
+        self.junctions: dict[str, OldJunction] = {}
+
+
+def old_build_graph(file: str) -> OldGraph:
+    graph = OldGraph()
+    for child in ET.parse(file).getroot():
+        if child.tag == 'edge' and ':' not in child.attrib['id']:
+            edge = OldEdge(child.attrib['id'], child.attrib['from'], child.attrib['to'])
+            for gchild in child:
+                lane = OldLane(gchild.attrib['id'], float(gchild.attrib['speed']),
+                               float(gchild.attrib['length']), gchild.attrib['shape'])
+                edge.lanes[lane.id] = lane
+                edge.get_length()
+            graph.edges[edge.id[0]] = edge
+        elif child.tag == 'junction' and ':' not in child.attrib['id']:
+            graph.junctions[child.attrib['id']] = OldJunction(child.attrib['id'])
+        elif child.tag == 'connection':
+            if ':' not in child.attrib['from'] and ':' not in child.attrib['to']:
+                graph.edges[child.attrib['from']].next_edges.add(child.attrib['to'])
+    for edge in graph.edges.values():
+        graph.junctions[edge.fromNode].outEdges.add(edge)
+        graph.junctions[edge.toNode].inEdges.add(edge)
+    return graph
+
+
+def generate_grid(path: str, number: int = 80, length: float = 100) -> None:
+    subprocess.run([
+        sumolib.checkBinary('netgenerate'), '--grid', '--grid.number', str(number),
+        '--grid.length', str(length), '-o', path
+    ], check=True, stdout=subprocess.DEVNULL)
+
+
+def measure(build, file: str, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        build(file)
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    graph = build(file)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'graph': graph, 'seconds': min(times), 'retained_mb': retained / 1e6, 'peak_mb': peak / 1e6}
+
+
+def check_same(old: OldGraph, new) -> None:
+    assert old.edges.keys() == set(new.edges.keys())
+    assert old.junctions.keys() == set(new.junctions.keys())
+    for eid, edge in old.edges.items():
+        view = new.edges[eid]
+        assert (edge.fromNode, edge.toNode, edge.length, edge.capacity, edge.next_edges) == \
+               (view.fromNode, view.toNode, view.length, view.capacity, view.next_edges), eid
+        for lid, lane in edge.lanes.items():
+            other = view.lanes[lid]
+            assert (lane.speed, lane.length) == (other.speed, other.length), lid
+            assert [p[:2] for p in lane.shape] == other.shape.tolist(), lid
+    for jid, junction in old.junctions.items():
+        view = new.junctions[jid]
+        assert {e.id[0] for e in junction.inEdges} == {e.id for e in view.inEdges}, jid
+        assert {e.id[0] for e in junction.outEdges} == {e.id for e in view.outEdges}, jid
+        assert abs(junction.calCap() - view.calCap()) < 1e-6, jid
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Build time and memory of the network graph')
+    ap.add_argument('--net', help='net file, by default a generated 80 x 80 grid')
+    ap.add_argument('-r', '--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        netfile = args.net
+        if netfile is None:
+            netfile = os.path.join(workdir, 'grid.net.xml')
+            generate_grid(netfile)
+        new = measure(build_graph, netfile, args.repeat)
+        old = measure(old_build_graph, netfile, args.repeat)
+        print(f'net: {len(new["graph"].edges)} edges, {len(new["graph"].junctions)} junctions, '
+              f'{os.path.getsize(netfile) / 1e6:.0f} MB')
+    check_same(old['graph'], new['graph'])
+    print('| graph | build s | retained MB | peak MB |')
+    print('|---|---|---|---|')
+    for name, result in [('object per lane', old), ('columnar', new)]:
+        print(f"| {name} | {result['seconds']:.2f} | {result['retained_mb']:.1f} | {result['peak_mb']:.0f} |")
+    print('all edges, lanes and junctions match')
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from LLMAgent import kpiStore
+from LLMAgent.kpiStore import KPIStore, get_kpi_store
+
+HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<!-- run {run} -->\n<meandata>\n'
+
+
+def interval(begin: float, end: float, nEdges: int = 5) -> str:
+    edges = ''.join(
+        f'        <edge id="e{e}" sampledSeconds="{(e + begin) % 7:.2f}" speed="{e + begin / 100:.2f}" '
+        f'waitingTime="{e:.2f}" timeLoss="{begin / 600:.2f}" left="{e + 1}" density="{e * 2:.2f}"/>\n'
+        for e in range(nEdges))
+    return f'    <interval begin="{begin:.2f}" end="{end:.2f}" id="dump">\n{edges}    </interval>\n'
+
+
+def write(path, text: str, mode: str = 'w') -> None:
+    with open(path, mode, encoding='utf-8') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def dumpfile(tmp_path, monkeypatch):
+    monkeypatch.setattr(kpiStore, '_kpiStores', {})
+    path = tmp_path / 'edgedata.xml'
+    write(path, HEADER.format(run=1) + ''.join(interval(t, t + 600) for t in range(0, 3000, 600)))
+    return str(path)
+
+
+def full_frame(dumpfile: str) -> pd.DataFrame:
+    store = KPIStore.empty()
+    store.ingest(dumpfile)
+    return store.kpi_frame()
+
+
+def test_cold_store_reads_the_latest_interval(dumpfile):
+    store = get_kpi_store(dumpfile)
+    assert list(store.begins) == [2400.]
+    assert not store.complete
+    pd.testing.assert_frame_equal(store.kpi_frame(), full_frame(dumpfile))
+
+    store = get_kpi_store(dumpfile, full=True)
+    assert list(store.begins) == [0., 600., 1200., 1800., 2400.]
+    assert store.complete
+
+
+def test_new_intervals_are_saved_as_segments(dumpfile, monkeypatch):
+    store = get_kpi_store(dumpfile)
+    write(dumpfile, interval(3000, 3600), 'a')
+    store = get_kpi_store(dumpfile)
+    write(dumpfile, interval(3600, 4200), 'a')
+    store = get_kpi_store(dumpfile)
+    assert list(store.begins) == [2400., 3000., 3600.]
+    assert len(os.listdir(f'{dumpfile}.kpi')) == 3
+
+    # 新的进程从保存的片段继续，不再解析已读的区间
+    monkeypatch.setattr(kpiStore, '_kpiStores', {})
+    reloaded = get_kpi_store(dumpfile)
+    for name in KPIStore.ARRAYS:
+        np.testing.assert_array_equal(getattr(reloaded, name), getattr(store, name))
+    assert reloaded.offset == store.offset
+    pd.testing.assert_frame_equal(reloaded.kpi_frame(), full_frame(dumpfile))
+
+
+def test_restarted_dump_replaces_the_segments(dumpfile, monkeypatch):
+    get_kpi_store(dumpfile)
+    write(dumpfile, interval(3000, 3600), 'a')
+    get_kpi_store(dumpfile)
+    # SUMO 重新运行时重写整个文件
+    write(dumpfile, HEADER.format(run=2) + interval(600, 1200) + interval(1200, 1800))
+    store = get_kpi_store(dumpfile)
+    assert list(store.begins) == [600., 1200.]
+    assert len(os.listdir(f'{dumpfile}.kpi')) == 1
+
+    monkeypatch.setattr(kpiStore, '_kpiStores', {})
+    assert list(get_kpi_store(dumpfile).begins) == [600., 1200.]
@@ -0,0 +1,28 @@
+from LLMAgent import resultCache
+from LLMAgent.resultCache import ResultCache
+
+
+def test_historical_results_expire(monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(resultCache.time, 'monotonic', lambda: now[0])
+    cache = ResultCache(ttl=10., historical_ttl=100.)
+    calls = []
+
+    def run(params):
+        calls.append(params)
+        return len(calls)
+
+    past = {'start': '2023-05-01 00:00:00', 'end': '2023-05-02 00:00:00'}
+    future = {'start': '2023-05-01 00:00:00', 'end': '2999-01-01 00:00:00'}
+    assert cache.get_or_run('q', past, run) == 1
+    assert cache.get_or_run('q', future, run) == 2
+
+    now[0] += 50.
+    assert cache.get_or_run('q', past, run) == 1
+    assert cache.get_or_run('q', future, run) == 3
+
+    now[0] += 60.
+    assert cache.get_or_run('q', past, run) == 4
+
+    cache.clear()
+    assert cache.get_or_run('q', past, run) == 5
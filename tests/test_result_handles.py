@@ -0,0 +1,21 @@
+import pandas as pd
+import pytest
+
+from LLMAgent.resultHandles import ResultStore
+
+pytest.importorskip('pyarrow')
+
+
+def test_evicted_results_are_read_from_parquet(tmp_path, capsys):
+    store = ResultStore(maxsize=2, folder=str(tmp_path), maxfiles=1)
+    frames = [pd.DataFrame({'road': [f'r{i}'], 'volume': [i]}) for i in range(5)]
+    # 混合类型的列无法写入 Parquet
+    frames[1] = pd.DataFrame({'road': ['r1', 1]})
+    handles = [store.put(df) for df in frames]
+
+    assert f'result {handles[1]} is dropped' in capsys.readouterr().out
+    assert [p.name for p in tmp_path.iterdir()] == [f'{handles[2]}.parquet']
+    assert store.get(handles[0]) is None
+    assert store.get(handles[1]) is None
+    pd.testing.assert_frame_equal(store.get(handles[2]), frames[2])
+    pd.testing.assert_frame_equal(store.get(handles[4]), frames[4])
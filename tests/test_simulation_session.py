@@ -0,0 +1,40 @@
+import os
+import shutil
+
+import pytest
+from sumolib import checkBinary
+
+from LLMAgent.kpiStore import KPIStore
+from LLMAgent.simulationSession import SimulationSession
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIO = os.path.join(ROOT, 'real-world-simulation-withTLS')
+
+if shutil.which(checkBinary('sumo')) is None:
+    pytest.skip('SUMO is not installed', allow_module_level=True)
+
+
+@pytest.fixture
+def session(tmp_path):
+    folder = tmp_path / 'scenario'
+    shutil.copytree(SCENARIO, folder)
+    session = SimulationSession(
+        str(folder / 'xuancheng.sumocfg'), str(folder / 'originalstate.xml'),
+        str(folder / 'tempstate.xml'), label=f'test{id(tmp_path)}',
+        dumpfile=str(folder / 'edgedata.xml'))
+    yield session
+    session.close()
+
+
+def test_advance_writes_the_simulated_interval(session):
+    store = KPIStore.empty()
+    previous = None
+    for reset in (True, False, False):
+        now = session.advance(600, reset=reset)
+        store.ingest(session.dumpfile)
+        # 最新的统计区间就是刚仿真的时段，不必关闭 SUMO
+        assert store.ends[-1] == now
+        if previous is not None:
+            assert store.begins[-1] == previous
+        assert (store.kpi_frame()['left'] > 0).sum() > 38
+        previous = now
@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy as sa
+
+from LLMAgent import dbConnector, roadTripIndex, volumeRollup
+from LLMAgent.resultCache import RESULT_CACHE
+from LLMAgent.roadTripIndex import build_road_trip_index, has_road_trip_index
+from LLMAgent.volumeRollup import ROAD_ROLLUPS, OD_ROLLUPS, plan_volume_query, refresh_rollups
+
+pgserver = pytest.importorskip('pgserver')
+
+TRIP_TABLE = """
+    CREATE TABLE the_synthetic_individual_level_trip_dataset (
+      trip_id INT, departure_time TIMESTAMP, o_zone VARCHAR(50), d_zone VARCHAR(50), path VARCHAR(200))
+    """
+
+# README 第 2 步：由出行路径生成 road_volume_per_hour
+README_ROAD_VOLUME_PER_HOUR = [
+    "CREATE TABLE road_volume_per_hour (hour_start TIMESTAMP, road VARCHAR(50), road_count INT)",
+    """
+    INSERT INTO road_volume_per_hour
+    SELECT DATE_TRUNC('hour', departure_time) AS hour_start, unnest(string_to_array(path, '-')) AS road,
+      COUNT(*) AS road_count
+    FROM the_synthetic_individual_level_trip_dataset
+    GROUP BY hour_start, road
+    """,
+]
+
+
+def insert_trips(conn, first: int, n: int, start: datetime):
+    rows = [{
+        'trip_id': i,
+        'departure_time': start + timedelta(minutes=17 * (i - first)),
+        'o_zone': f'z{i % 5}', 'd_zone': f'z{i % 7}',
+        'path': '-'.join(f'r{(i + k) % 11}' for k in range(1 + i % 3)),
+    } for i in range(first, first + n)]
+    conn.execute(sa.text(
+        "INSERT INTO the_synthetic_individual_level_trip_dataset "
+        "VALUES (:trip_id, :departure_time, :o_zone, :d_zone, :path)"), rows)
+
+
+def rollups(conn) -> dict:
+    return {
+        table: sorted(conn.execute(sa.text(f"SELECT * FROM {table}")).fetchall())
+        for table in ROAD_ROLLUPS + OD_ROLLUPS
+    }
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    server = pgserver.get_server(str(tmp_path / 'pgdata'), cleanup_mode='stop')
+    engine = sa.create_engine(server.get_uri())
+    monkeypatch.setattr(dbConnector, '_engine', engine)
+    monkeypatch.setattr(volumeRollup, '_rollupWatermarks', {})
+    monkeypatch.setattr(roadTripIndex, '_indexReady', False)
+    yield engine
+    engine.dispose()
+    server.cleanup()
+
+
+def test_first_incremental_run_matches_full(engine):
+    with engine.begin() as conn:
+        conn.execute(sa.text(TRIP_TABLE))
+        # 约 3 天的出行
+        insert_trips(conn, 0, 250, datetime(2023, 5, 1, 6, 3))
+        for statement in README_ROAD_VOLUME_PER_HOUR:
+            conn.execute(sa.text(statement))
+
+    watermarks = refresh_rollups()
+    assert watermarks['od_volume_per_hour'] == datetime.min
+    with engine.connect() as conn:
+        incremental = rollups(conn)
+    refresh_rollups(full=True)
+    with engine.connect() as conn:
+        assert incremental == rollups(conn)
+
+
+def test_incremental_run_after_new_trips_matches_full(engine):
+    with engine.begin() as conn:
+        conn.execute(sa.text(TRIP_TABLE))
+        insert_trips(conn, 0, 250, datetime(2023, 5, 1, 6, 3))
+    refresh_rollups()
+    with engine.begin() as conn:
+        # 新出行从已汇总的最后一个小时中间开始
+        last = conn.execute(sa.text(
+            "SELECT MAX(departure_time) FROM the_synthetic_individual_level_trip_dataset")).scalar()
+        insert_trips(conn, 250, 100, last + timedelta(minutes=1))
+
+    refresh_rollups()
+    with engine.connect() as conn:
+        incremental = rollups(conn)
+    refresh_rollups(full=True)
+    with engine.connect() as conn:
+        assert incremental == rollups(conn)
+
+
+def test_windows_after_the_watermark_use_the_base_tables(engine):
+    with engine.begin() as conn:
+        conn.execute(sa.text(TRIP_TABLE))
+    # 汇总表还不存在
+    assert plan_volume_query('road_volume_all', '2023-05-01 00:00', '2023-05-02 00:00')[0] == 'road_volume_all'
+
+    with engine.begin() as conn:
+        # 2023-05-01 06:03 到 2023-05-04 04:49
+        insert_trips(conn, 0, 250, datetime(2023, 5, 1, 6, 3))
+    refresh_rollups()
+    for name in ('road_volume_all', 'od_volume_top'):
+        assert plan_volume_query(name, '2023-05-01 00:00', '2023-05-03 00:00')[0] == f'{name}_rollup'
+        # 最后一个小时可能不完整
+        assert plan_volume_query(name, '2023-05-03 12:00', '2023-05-04 05:00')[0] == name
+
+    with engine.begin() as conn:
+        insert_trips(conn, 250, 100, datetime(2023, 5, 4, 5, 0))
+    assert plan_volume_query('road_volume_all', '2023-05-04 00:00', '2023-05-05 00:00')[0] == 'road_volume_all'
+    # 刷新后不再返回缓存的旧结果
+    RESULT_CACHE.get_or_run('road_volume_all', {'end': '2023-05-05 00:00'}, lambda params: [])
+    refresh_rollups()
+    assert RESULT_CACHE.stats()['size'] == 0
+    assert plan_volume_query('road_volume_all', '2023-05-04 00:00', '2023-05-05 00:00')[0] == 'road_volume_all_rollup'
+
+
+def test_road_trip_index_is_looked_up_until_it_exists(engine, monkeypatch):
+    with engine.begin() as conn:
+        conn.execute(sa.text(TRIP_TABLE))
+        insert_trips(conn, 0, 20, datetime(2023, 5, 1, 6, 3))
+    assert not has_road_trip_index()
+    assert not has_road_trip_index()
+
+    build_road_trip_index()
+    lookups = []
+    has_table = roadTripIndex.has_table
+    monkeypatch.setattr(roadTripIndex, 'has_table', lambda t: lookups.append(t) or has_table(t))
+    assert has_road_trip_index()
+    assert has_road_trip_index()
+    assert lookups == [roadTripIndex.INDEX_TABLE]
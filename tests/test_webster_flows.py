@@ -0,0 +1,43 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from LLMAgent.netCache import get_net
+from LLMAgent.websterOptimize import checkRoutePeriod, getFlows
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIO = os.path.join(ROOT, 'real-world-simulation-withTLS')
+# 由优化前的 getFlows（逐个扫描信号灯连接）在同一场景上生成
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'webster_flows_xuancheng.json')
+
+
+@pytest.fixture(scope='module')
+def scenario(tmp_path_factory):
+    # 路网快照与路径索引写在副本旁，不改动仓库中的场景
+    folder = tmp_path_factory.mktemp('scenario')
+    for name in ('xuancheng.net.xml', 'xuancheng.rou.xml'):
+        shutil.copy(os.path.join(SCENARIO, name), folder)
+    return str(folder / 'xuancheng.net.xml'), str(folder / 'xuancheng.rou.xml')
+
+
+with open(GOLDEN) as f:
+    golden = json.load(f)
+
+
+@pytest.mark.parametrize('begin', [None, 0, 900])
+@pytest.mark.parametrize('isSorted', [False, True])
+def test_conn_flows_match_baseline(scenario, begin, isSorted):
+    netFile, routeFile = scenario
+    expected = golden[f'begin={begin} sorted={isSorted}']
+    net = get_net(netFile, withPrograms=True, withPedestrianConnections=True)
+
+    begin, scale_fac = checkRoutePeriod(routeFile, begin)
+    connFlowsMap = getFlows(net, routeFile, net.getTrafficLights(), begin, scale_fac, False, isSorted)
+
+    assert (begin, scale_fac) == (expected['begin'], expected['scale_fac'])
+    assert {
+        tlsID: {str(link): flow for link, flow in flows.items()}
+        for tlsID, flows in connFlowsMap.items()
+    } == expected['connFlowsMap']